@@ -0,0 +1,308 @@
+"""Pre-aggregated chat funnel analytics
+
+Every conversation state change $incs one rollup document per (UTC hour, first FAQ
+asked), so the funnel endpoint reads a few hundred small documents rather than
+scanning conversations and leads. A rollup counts:
+
+* ``reached.<stage>`` - sessions entering a funnel stage for the first time
+* ``transitions.<from>><to>`` - every state change, including repeats
+
+Sessions are attributed to the first FAQ they had asked when they reached each stage
+("none" before any FAQ), so a session that asks a question after reaching greeting
+counts its later stages under that FAQ.
+
+The rollups can be rebuilt from stored transcripts (or, for sessions without one, an
+approximation from their current state) while the server is running:
+
+    cd backend
+    python analytics.py rebuild-funnel
+
+Only hours before the one the rebuild starts in are recomputed; the live server keeps
+counting from there, so its rollups for later hours are left as they are. With tenants
+configured (TENANTS_DIR or TENANTS_SOURCE, as for the server) each tenant is rebuilt
+from its own conversations.
+"""
+import argparse
+import asyncio
+import os
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from tenants import DEFAULT_TENANT_ID, FileTenantSource, MongoTenantSource, ScopedDatabase
+from transcripts import decode_bucket
+
+FUNNEL_STAGES = ["greeting", "faq", "collect_name", "collect_phone", "collect_suburb", "collect_job", "completed"]
+# Stages a session must have passed through to be in a given state (for approximate backfill)
+LEAD_PATH = ["greeting", "collect_name", "collect_phone", "collect_suburb", "collect_job", "completed"]
+NO_FAQ = "none"
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+def hour_key(at: datetime) -> str:
+    return at.astimezone(timezone.utc).strftime(HOUR_FORMAT)
+
+
+def parse_hour(hour: str) -> datetime:
+    return datetime.strptime(hour, HOUR_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def funnel_step(from_state: str, to_state: str, reached: List[str]) -> Tuple[Dict[str, int], List[str]]:
+    """Rollup increments for one state change, and the session's updated reached list"""
+    increments = {f"transitions.{from_state}>{to_state}": 1}
+    if to_state in FUNNEL_STAGES and to_state not in reached:
+        increments[f"reached.{to_state}"] = 1
+        reached = reached + [to_state]
+    return increments, reached
+
+
+def merge_increments(steps: Iterable[Tuple[str, Optional[str], Dict[str, int]]]) -> Dict[Tuple[str, Optional[str]], Dict[str, int]]:
+    """Sum (hour, first_faq, increments) steps into one increments dict per rollup"""
+    totals: Dict[Tuple[str, Optional[str]], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for hour, first_faq, increments in steps:
+        for field, count in increments.items():
+            totals[(hour, first_faq)][field] += count
+    return {key: dict(inc) for key, inc in totals.items()}
+
+
+class FunnelRollups:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("hour", 1), ("first_faq", 1)])
+
+    @staticmethod
+    def rollup_id(hour: str, first_faq: Optional[str]) -> str:
+        return f"{hour}|{first_faq or NO_FAQ}"
+
+    @classmethod
+    def increment(cls, hour: str, first_faq: Optional[str], increments: Dict[str, int]) -> Tuple[dict, dict]:
+        """(filter, update) adding ``increments`` to one rollup, creating it if needed"""
+        return (
+            {"_id": cls.rollup_id(hour, first_faq)},
+            {"$inc": increments, "$setOnInsert": {"hour": hour, "first_faq": first_faq or NO_FAQ}},
+        )
+
+    async def record(self, at: datetime, first_faq: Optional[str], increments: Dict[str, int]):
+        await self.collection.update_one(*self.increment(hour_key(at), first_faq, increments), upsert=True)
+
+    async def record_many(self, steps: List[Tuple[datetime, Optional[str], Dict[str, int]]]):
+        """Record several (at, first_faq, increments) steps with one upsert per rollup touched"""
+        totals = merge_increments((hour_key(at), first_faq, increments) for at, first_faq, increments in steps)
+        if len(totals) == 1:
+            (hour, first_faq), inc = next(iter(totals.items()))
+            await self.collection.update_one(*self.increment(hour, first_faq, inc), upsert=True)
+        elif totals:
+            await self.collection.bulk_write([
+                UpdateOne(*self.increment(hour, first_faq, inc), upsert=True)
+                for (hour, first_faq), inc in totals.items()
+            ], ordered=False)
+
+    async def query(self, start: date, end: date, tz: ZoneInfo, first_faq: Optional[str] = None,
+                    group_by: str = "day") -> List[dict]:
+        """Funnel per local day, per first FAQ, or in total between two local dates (inclusive)"""
+        start_hour = hour_key(datetime.combine(start, time.min, tzinfo=tz))
+        end_hour = hour_key(datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz))
+        filter_ = {"hour": {"$gte": start_hour, "$lt": end_hour}}
+        if first_faq:
+            filter_["first_faq"] = first_faq
+
+        groups: Dict[str, dict] = {}
+        async for doc in self.collection.find(filter_, {"_id": 0}):
+            if group_by == "day":
+                key = parse_hour(doc["hour"]).astimezone(tz).date().isoformat()
+            elif group_by == "faq":
+                key = doc["first_faq"]
+            else:
+                key = "total"
+            group = groups.setdefault(key, {"reached": defaultdict(int), "transitions": defaultdict(int)})
+            for field in ("reached", "transitions"):
+                for name, count in doc.get(field, {}).items():
+                    group[field][name] += count
+        return [summarize(key, groups[key]) for key in sorted(groups)]
+
+
+def summarize(key: str, group: dict) -> dict:
+    """Stage counts with conversion from the previous stage and from the top of the funnel"""
+    reached = group["reached"]
+    # Per-FAQ groups have no greeting entries (sessions start before any FAQ), so they start at faq
+    top = next((reached[stage] for stage in FUNNEL_STAGES if reached.get(stage)), 0)
+    stages, previous = [], None
+    for stage in FUNNEL_STAGES:
+        sessions = reached.get(stage, 0)
+        stages.append({
+            "stage": stage,
+            "sessions": sessions,
+            "from_previous": round(sessions / previous, 4) if previous else None,
+            "from_start": round(sessions / top, 4) if top else None,
+        })
+        previous = sessions
+    return {"key": key, "stages": stages, "transitions": dict(group["transitions"])}
+
+
+# ============== BACKFILL ==============
+
+def session_increments(events: Iterable[Tuple[str, str, Optional[str]]]) -> List[Tuple[str, Optional[str], Dict[str, int]]]:
+    """Replay one session's (timestamp, state after the turn, faq label) events into
+    (hour, first_faq, increments) - the same accounting the live chat path does"""
+    out = []
+    state, reached, first_faq = None, [], None
+    for at, to_state, faq in events:
+        hour = hour_key(datetime.fromisoformat(at))
+        if state is None:
+            reached = ["greeting"]
+            out.append((hour, None, {"reached.greeting": 1}))
+            state = "greeting"
+        first_faq = first_faq or faq
+        if to_state != state:
+            increments, reached = funnel_step(state, to_state, reached)
+            out.append((hour, first_faq, increments))
+            state = to_state
+    return out
+
+
+def approximate_increments(conversation: dict) -> List[Tuple[str, Optional[str], Dict[str, int]]]:
+    """Best guess for a session with no transcript: the lead-capture path up to its current state"""
+    updated_at = conversation.get("updated_at")
+    if not updated_at:
+        return []
+    hour = hour_key(datetime.fromisoformat(updated_at))
+    state = conversation.get("state", "greeting")
+    path = LEAD_PATH[:LEAD_PATH.index(state) + 1] if state in LEAD_PATH else ["greeting"]
+    if state == "faq":
+        path.append("faq")
+    return [(hour, conversation.get("first_faq"), {f"reached.{stage}": 1 for stage in path})]
+
+
+async def rebuild_funnel(db, batch_size: int = 500, cutoff: Optional[str] = None) -> dict:
+    """Recompute funnel_rollups for the hours before ``cutoff`` (default: the current hour)
+
+    The totals are built up in a scratch collection, then replace the live rollups one
+    document at a time. Rollups from ``cutoff`` on are never touched, so nothing the live
+    server records while this runs is lost; it only writes to the current hour. Every
+    operation goes through filters rather than drop/rename, so ``db`` can be a tenant's
+    ``ScopedDatabase``.
+    """
+    cutoff = cutoff or hour_key(datetime.now(timezone.utc))
+    scratch = db.funnel_rollups_rebuild
+    await scratch.delete_many({})
+    stats = {"cutoff": cutoff, "sessions": 0, "from_transcripts": 0, "approximated": 0, "rollups": 0, "removed": 0}
+
+    async def flush(batch):
+        totals = merge_increments(batch)
+        if totals:
+            await scratch.bulk_write([
+                UpdateOne(*FunnelRollups.increment(hour, first_faq, inc), upsert=True)
+                for (hour, first_faq), inc in totals.items()
+            ], ordered=False)
+
+    pending: List[Tuple[str, Optional[str], Dict[str, int]]] = []
+    sessions: List[dict] = []
+
+    async def process(conversations: List[dict]):
+        ids = [c["session_id"] for c in conversations]
+        sealed: Dict[str, List[dict]] = defaultdict(list)
+        async for bucket in db.conversation_transcripts.find({"session_id": {"$in": ids}}, {"_id": 0}).sort("seq", 1):
+            sealed[bucket["session_id"]].extend(decode_bucket(bucket))
+        for conversation in conversations:
+            messages = sealed.get(conversation["session_id"], []) + conversation.get("transcript", [])
+            if messages:
+                steps = session_increments((m["at"], m["state"], m.get("faq")) for m in messages if "state" in m)
+                stats["from_transcripts"] += 1
+            else:
+                steps = approximate_increments(conversation)
+                stats["approximated"] += 1
+            pending.extend(step for step in steps if step[0] < cutoff)
+            stats["sessions"] += 1
+
+    projection = {"_id": 0, "session_id": 1, "state": 1, "updated_at": 1, "first_faq": 1, "transcript": 1}
+    async for conversation in db.conversations.find({}, projection).batch_size(batch_size):
+        sessions.append(conversation)
+        if len(sessions) >= batch_size:
+            await process(sessions)
+            await flush(pending)
+            sessions.clear()
+            pending.clear()
+    await process(sessions)
+    await flush(pending)
+
+    # Rebuilt rollups replace the live ones first, so the funnel never reads as empty
+    rebuilt = set()
+    replacements: List[ReplaceOne] = []
+    async for doc in scratch.find({}, {"_id": 0}):
+        rebuilt.add((doc["hour"], doc["first_faq"]))
+        replacements.append(ReplaceOne({"_id": FunnelRollups.rollup_id(doc["hour"], doc["first_faq"])}, doc, upsert=True))
+        if len(replacements) >= batch_size:
+            await db.funnel_rollups.bulk_write(replacements, ordered=False)
+            replacements.clear()
+    if replacements:
+        await db.funnel_rollups.bulk_write(replacements, ordered=False)
+    stats["rollups"] = len(rebuilt)
+
+    # ... then rollups before the cutoff that the rebuild didn't produce are removed
+    stale = [
+        DeleteOne({"_id": FunnelRollups.rollup_id(doc["hour"], doc["first_faq"])})
+        async for doc in db.funnel_rollups.find({"hour": {"$lt": cutoff}}, {"_id": 0, "hour": 1, "first_faq": 1})
+        if (doc["hour"], doc["first_faq"]) not in rebuilt
+    ]
+    if stale:
+        await db.funnel_rollups.bulk_write(stale, ordered=False)
+    stats["removed"] = len(stale)
+    await scratch.delete_many({})
+    return stats
+
+
+async def rebuild_tenant_funnels(database, tenant_ids: List[str], batch_size: int = 500) -> Dict[str, dict]:
+    """rebuild_funnel for each tenant through its ``ScopedDatabase``, so a tenant's rollups only
+    come from (and only replace) its own documents"""
+    results = {}
+    for tenant_id in tenant_ids:
+        scope = None if tenant_id == DEFAULT_TENANT_ID else tenant_id
+        results[tenant_id] = await rebuild_funnel(ScopedDatabase(database, lambda scope=scope: scope), batch_size)
+    return results
+
+
+async def configured_tenant_ids(database) -> Optional[List[str]]:
+    """Tenant ids from the server's tenant settings, or None when it runs single-tenant"""
+    tenants_dir = os.environ.get("TENANTS_DIR", "")
+    source = os.environ.get("TENANTS_SOURCE", "files" if tenants_dir else "")
+    if source == "files":
+        specs = await FileTenantSource(Path(tenants_dir)).load()
+    elif source == "mongo":
+        specs = await MongoTenantSource(database.tenants).load()
+    else:
+        return None
+    return [DEFAULT_TENANT_ID] + sorted({spec["id"] for spec in specs if spec.get("id")} - {DEFAULT_TENANT_ID})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild-funnel", help="recompute funnel_rollups from historical conversations")
+    rebuild.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    load_dotenv(Path(__file__).parent / ".env")
+    database = AsyncIOMotorClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]]
+
+    async def rebuild_all() -> Dict[str, dict]:
+        tenant_ids = await configured_tenant_ids(database)
+        if tenant_ids is None:
+            return {DEFAULT_TENANT_ID: await rebuild_funnel(database, args.batch_size)}
+        return await rebuild_tenant_funnels(database, tenant_ids, args.batch_size)
+
+    for tenant_id, stats in asyncio.run(rebuild_all()).items():
+        print(f"{tenant_id}: rebuilt funnel rollups before {stats['cutoff']} from {stats['sessions']} sessions "
+              f"({stats['from_transcripts']} with transcripts, {stats['approximated']} approximated) "
+              f"into {stats['rollups']} rollup documents, removing {stats['removed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""Cold archive for old completed leads and their email logs
+
+Leads completed more than ``after`` ago (a year by default) are rarely read again, but in
+the hot collections they still take up index and working-set space. ``ColdArchive.run``
+moves them, with their email logs, into compressed JSONL files under ``root``:
+
+    <root>/<tenant>/2025-03/leads-<segment>.jsonl.zst        one file pair per batch and month
+    <root>/<tenant>/2025-03/email_logs-<segment>.jsonl.zst   (.gz without the zstandard package)
+    <root>/<tenant>/index.jsonl                               {"month", "segment", "ext", "leads": [ids], "email_logs"}
+
+``root`` must be durable storage every worker can read (a shared volume, not a container's
+local disk): once a lead is moved, the archive holds the only copy. The server only archives
+when ARCHIVE_DIR is set.
+
+Months are the month a lead was completed. A batch is written to temporary files and
+renamed into place, then appended to the index, and only then deleted from Mongo - just the
+email logs that were written, and each lead only if it is still eligible and unchanged since
+it was read. A lead updated part-way through a batch stays hot and is released from the
+index (``{"released": [ids]}``) so reads don't see its stale copy. A crash part-way leaves at
+worst a lead in both places, and the next run archives it again (the index's last segment
+listing a lead wins).
+
+Lookups by id read the index (cached, and re-read from where it left off when another
+worker appends to it), then decompress one segment of at most a batch of leads (cached per
+segment). Search builds the same BM25 index lead_search.py uses over the archived leads,
+adding new entries as the index grows. Archived leads are read-only: anything that updates a
+lead only sees the hot collection.
+
+Like the review campaign, a run holds a lease in job_cursors so one worker archives at a
+time, and a pass can be started by hand:
+
+    cd backend
+    python archive.py run --after-days 365
+
+The command works on the unscoped database, so it is for single-tenant deployments; with
+tenants, POST /api/archive/run archives the calling tenant (and ARCHIVE_INTERVAL_HOURS
+every tenant), each into its own directory.
+"""
+import argparse
+import asyncio
+import gzip
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from pymongo import DeleteOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from lead_search import InvertedIndex
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional - segments are gzip-compressed without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "cold_archive"
+INDEX_FILE = "index.jsonl"
+DEFAULT_DIR = "default"
+
+
+def compress(data: bytes, ext: str) -> bytes:
+    if ext == ".zst":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, ext: str) -> bytes:
+    if ext == ".zst":
+        if zstandard is None:
+            raise RuntimeError("Archive segment is zstd-compressed but the zstandard package isn't installed")
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return reader.read()
+    return gzip.decompress(data)
+
+
+def segment_path(directory: Path, entry: dict, kind: str) -> Path:
+    return directory / entry["month"] / f"{kind}-{entry['segment']}.jsonl{entry['ext']}"
+
+
+@lru_cache(maxsize=32)
+def _read_segment(path: Path, ext: str) -> Tuple[dict, ...]:
+    """Decoded documents of one segment file; segments are never rewritten, so caching by path is safe"""
+    if not path.exists():
+        return ()
+    return tuple(orjson.loads(line) for line in decompress(path.read_bytes(), ext).splitlines() if line)
+
+
+def unchanged(lead: dict, query: dict) -> dict:
+    """Filter matching ``lead`` only while it is still eligible and its top-level values are as read"""
+    return {"$and": [query, {k: v for k, v in lead.items() if not isinstance(v, (list, dict))}]}
+
+
+class ArchiveIndex:
+    """Lead id -> the latest segment holding it, read incrementally as the append-only file grows
+
+    Release entries (``{"released": [ids]}``) drop leads that stayed in the hot collection.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.log: List[dict] = []  # every segment in file order, for consumers that follow the index
+        self.offset = 0
+
+    def refresh(self):
+        """Read entries appended since the last refresh, by this or another process"""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size <= self.offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        # A line still being written has no newline yet; pick it up next time
+        complete = data[:data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        for line in complete.splitlines():
+            if line:
+                entry = orjson.loads(line)
+                for lead_id in entry.get("released", ()):
+                    self.entries.pop(lead_id, None)
+                for lead_id in entry.get("leads", ()):
+                    self.entries[lead_id] = entry
+                self.log.append(entry)
+
+
+class ColdArchive:
+    def __init__(self, root: Path, leads, email_logs, cursors, scope: Callable[[], Optional[str]] = lambda: None,
+                 after: timedelta = timedelta(days=365), batch_size: int = 500, lease_seconds: int = 300,
+                 on_moved: Optional[Callable[[List[str]], Awaitable[None]]] = None):
+        self.root = root
+        self.leads = leads
+        self.email_logs = email_logs
+        self.cursors = cursors
+        self.scope = scope  # tenant scope; each tenant's archive is a directory under root
+        self.after = after
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.on_moved = on_moved  # called with the ids of each batch once it has left the hot collections
+        self.ext = ".zst" if zstandard is not None else ".gz"
+        self.owner = f"{id(self):x}-{time.time_ns()}"
+        self.indexes: Dict[Path, ArchiveIndex] = {}
+        self.search_indexes: Dict[Path, Tuple[InvertedIndex, int]] = {}  # with how much of the index log it covers
+        self.lock = threading.RLock()  # reads run in worker threads and share the cached indexes
+
+    def directory(self) -> Path:
+        return self.root / (self.scope() or DEFAULT_DIR)
+
+    def eligible_query(self, now: datetime) -> dict:
+        return {"status": "completed", "completed_at": {"$lt": (now - self.after).isoformat()}}
+
+    async def ensure_indexes(self):
+        await self.leads.create_index([("status", 1), ("completed_at", 1)])
+
+    # ----- reads -----
+
+    def _index(self, directory: Path) -> ArchiveIndex:
+        with self.lock:
+            index = self.indexes.get(directory)
+            if index is None:
+                index = self.indexes[directory] = ArchiveIndex(directory / INDEX_FILE)
+            index.refresh()
+            return index
+
+    def _find_lead(self, directory: Path, lead_id: str) -> Optional[dict]:
+        entry = self._index(directory).entries.get(lead_id)
+        if entry is None:
+            return None
+        for lead in _read_segment(segment_path(directory, entry, "leads"), entry["ext"]):
+            if lead["id"] == lead_id:
+                return dict(lead)
+        return None
+
+    def _find_email_logs(self, directory: Path, lead_id: str) -> List[dict]:
+        entry = self._index(directory).entries.get(lead_id)
+        if entry is None or not entry["email_logs"]:
+            return []
+        return [dict(log) for log in _read_segment(segment_path(directory, entry, "email_logs"), entry["ext"])
+                if log["lead_id"] == lead_id]
+
+    def _search(self, directory: Path, query: str, top: int, created_from: Optional[str],
+                created_to: Optional[str]) -> Tuple[int, List[Tuple[dict, float]]]:
+        with self.lock:
+            index = self._index(directory)
+            search_index, covered = self.search_indexes.get(directory) or (InvertedIndex(), 0)
+            for entry in index.log[covered:]:
+                for lead_id in entry.get("released", ()):
+                    search_index.remove(lead_id)
+                if "released" in entry:
+                    continue
+                for lead in _read_segment(segment_path(directory, entry, "leads"), entry["ext"]):
+                    if index.entries.get(lead["id"]) is entry:
+                        search_index.add(lead)
+            self.search_indexes[directory] = (search_index, len(index.log))
+            total, ranked = search_index.search(query, top, created_from, created_to)
+        return total, [(self._find_lead(directory, lead_id), score) for lead_id, score in ranked]
+
+    async def find_lead(self, lead_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._find_lead, self.directory(), lead_id)
+
+    async def find_email_logs(self, lead_id: str) -> List[dict]:
+        return await asyncio.to_thread(self._find_email_logs, self.directory(), lead_id)
+
+    async def search(self, query: str, skip: int, limit: int, created_from: Optional[str] = None,
+                     created_to: Optional[str] = None) -> Tuple[int, List[dict]]:
+        """Return (total matches, one page of archived leads with a ``score``), like LeadSearch.search"""
+        total, ranked = await asyncio.to_thread(self._search, self.directory(), query, skip + limit,
+                                                created_from, created_to)
+        page = [{**lead, "score": round(score, 4), "archived": True} for lead, score in ranked[skip:] if lead]
+        return total, page
+
+    def _months(self, directory: Path) -> Dict[str, dict]:
+        with self.lock:
+            index = self._index(directory)
+            months: Dict[str, dict] = {}
+            for entry in index.log:
+                if "released" in entry:
+                    for month, count in entry["email_logs"].items():
+                        months[month]["email_logs"] -= count
+                    continue
+                month = months.setdefault(entry["month"], {"leads": 0, "email_logs": 0})
+                month["leads"] += sum(index.entries.get(lead_id) is entry for lead_id in entry["leads"])
+                month["email_logs"] += entry["email_logs"]
+            return {month: months[month] for month in sorted(months)}
+
+    async def status(self) -> dict:
+        doc = await self.cursors.find_one({"_id": JOB_ID}, {"_id": 0, "owner": 0}) or {"status": "idle"}
+        doc["archived"] = await asyncio.to_thread(self._months, self.directory())
+        doc["eligible"] = await self.leads.count_documents(self.eligible_query(datetime.now(timezone.utc)))
+        return doc
+
+    # ----- lease -----
+
+    async def _claim(self, now: float) -> Optional[dict]:
+        """Take the job lease unless another worker holds a live one"""
+        try:
+            return await self.cursors.find_one_and_update(
+                {"_id": JOB_ID, "$or": [{"status": {"$ne": "running"}}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"status": "running", "owner": self.owner, "lease_until": now + self.lease_seconds}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def _checkpoint(self, fields: dict):
+        await self.cursors.update_one(
+            {"_id": JOB_ID, "owner": self.owner},
+            {"$set": {"lease_until": time.time() + self.lease_seconds, **fields}},
+        )
+
+    # ----- moving -----
+
+    def _write_batch(self, directory: Path, leads: List[dict], email_logs: List[dict]) -> int:
+        """Write one batch as a segment per month and index it; returns compressed bytes written"""
+        logs_by_lead: Dict[str, List[dict]] = {}
+        for log in email_logs:
+            logs_by_lead.setdefault(log["lead_id"], []).append(log)
+        by_month: Dict[str, List[dict]] = {}
+        for lead in leads:
+            by_month.setdefault(lead["completed_at"][:7], []).append(lead)
+
+        segment = f"{time.time_ns():x}"
+        written = 0
+        entries = []
+        for month, month_leads in by_month.items():
+            month_logs = [log for lead in month_leads for log in logs_by_lead.get(lead["id"], ())]
+            entry = {"month": month, "segment": segment, "ext": self.ext,
+                     "leads": [lead["id"] for lead in month_leads], "email_logs": len(month_logs)}
+            for kind, docs in (("leads", month_leads), ("email_logs", month_logs)):
+                if not docs:
+                    continue
+                path = segment_path(directory, entry, kind)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = compress(b"".join(orjson.dumps(doc) + b"\n" for doc in docs), self.ext)
+                tmp = path.with_name(path.name + ".tmp")
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+                written += len(data)
+            entries.append(entry)
+
+        with open(directory / INDEX_FILE, "ab") as f:
+            f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        return written
+
+    def _release(self, directory: Path, leads: List[dict], email_logs: List[dict]):
+        """Index that ``leads`` were written but stayed hot, so their archived copies (and logs) are ignored"""
+        month_of = {lead["id"]: lead["completed_at"][:7] for lead in leads}
+        logs_by_month: Dict[str, int] = {}
+        for log in email_logs:
+            month = month_of[log["lead_id"]]
+            logs_by_month[month] = logs_by_month.get(month, 0) + 1
+        entry = {"released": sorted(month_of), "email_logs": logs_by_month}
+        with open(directory / INDEX_FILE, "ab") as f:
+            f.write(orjson.dumps(entry) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def run(self) -> Optional[dict]:
+        """Move every eligible lead and its email logs to the archive. Returns None if another worker is running it."""
+        started = time.time()
+        if await self._claim(started) is None:
+            return None
+        directory = self.directory()
+        query = self.eligible_query(datetime.now(timezone.utc))
+        stats = {"leads": 0, "email_logs": 0, "batches": 0, "bytes": 0}
+        try:
+            while True:
+                leads = await self.leads.find(query, {"_id": 0}).sort([("completed_at", 1), ("id", 1)]) \
+                    .limit(self.batch_size).to_list(self.batch_size)
+                if not leads:
+                    break
+                ids = [lead["id"] for lead in leads]
+                email_logs = await self.email_logs.find({"lead_id": {"$in": ids}}, {"_id": 0}).to_list(None)
+                stats["bytes"] += await asyncio.to_thread(self._write_batch, directory, leads, email_logs)
+                # Only delete once the batch is on disk and indexed, and only what was written
+                await self.leads.bulk_write([DeleteOne(unchanged(lead, query)) for lead in leads], ordered=False)
+                kept = {lead["id"] for lead in await self.leads.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})
+                        .to_list(None)}
+                moved = [lead_id for lead_id in ids if lead_id not in kept]
+                moved_logs = [log for log in email_logs if log["lead_id"] not in kept]
+                if kept:
+                    await asyncio.to_thread(self._release, directory, [lead for lead in leads if lead["id"] in kept],
+                                            [log for log in email_logs if log["lead_id"] in kept])
+                await self.email_logs.delete_many({"id": {"$in": [log["id"] for log in moved_logs]}})
+                if self.on_moved is not None and moved:
+                    await self.on_moved(moved)
+                stats["leads"] += len(moved)
+                stats["email_logs"] += len(moved_logs)
+                stats["batches"] += 1
+                await self._checkpoint({"progress": stats})
+        except Exception:
+            await self._checkpoint({"status": "failed", "lease_until": 0})
+            raise
+
+        stats["elapsed_seconds"] = round(time.time() - started, 3)
+        stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+        await self._checkpoint({"status": "idle", "progress": None, "last_run": stats, "lease_until": 0})
+        logger.info(f"Archived {stats['leads']} leads and {stats['email_logs']} email logs "
+                    f"({stats['bytes']:,} bytes) in {stats['elapsed_seconds']}s")
+        return stats
+
+    async def run_forever(self, interval_seconds: float, run_pass: Optional[Callable[[], Awaitable]] = None):
+        """Run a pass every ``interval_seconds``; ``run_pass`` replaces the default single ``run()``"""
+        while True:
+            try:
+                await (run_pass or self.run)()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Archive run failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="move old completed leads and their email logs to the archive")
+    run.add_argument("--after-days", type=float, default=365)
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--root", default=None, help="archive directory (default: ARCHIVE_DIR)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    load_dotenv(Path(__file__).parent / ".env")
+    if not (args.root or os.environ.get("ARCHIVE_DIR")):
+        raise SystemExit("Pass --root or set ARCHIVE_DIR to the durable directory the server reads the archive from")
+    logging.basicConfig(level=logging.INFO)
+    db = AsyncIOMotorClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]]
+    root = Path(args.root or os.environ["ARCHIVE_DIR"])
+    archive = ColdArchive(root, db.leads, db.email_logs, db.job_cursors, after=timedelta(days=args.after_days),
+                          batch_size=args.batch_size)
+    stats = asyncio.run(archive.run())
+    if stats is None:
+        raise SystemExit("Another worker is archiving; try again once its lease ends")
+    print(f"Archived {stats['leads']} leads and {stats['email_logs']} email logs in {stats['batches']} batches "
+          f"({stats['bytes']:,} compressed bytes) to {root}")
+
+
+if __name__ == "__main__":
+    main()
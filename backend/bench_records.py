@@ -0,0 +1,168 @@
+"""Benchmark the Pydantic models against the internal records (records.py)
+
+    cd backend
+    python bench_records.py              # 20,000 operations per path, 1,000 leads per list response
+    python bench_records.py -n 50000
+
+For each path the server takes it compares the old Pydantic code with the records code:
+
+* capture: build a lead from chat data, dump it, copy it for insert_one, pick the chat reply fields
+* email_log: build an email log, dump it for insert_one and again for the API response
+* list_response: GET /api/leads - response_model validation + JSON, vs wire_document + orjson
+* retained: memory held per lead while kept as a model instance vs as a record
+
+CPU is the best of five runs per operation; allocation is the traced peak per operation.
+One run on the development container (Python 3.11, pydantic 2.x):
+
+    path                pydantic      records  speedup   pydantic alloc   records alloc
+    capture             12.53 us      9.41 us     1.3x          2,096 B         1,592 B
+    email_log           13.79 us      7.21 us     1.9x          1,736 B           919 B
+    list_response       10.09 ms      2.04 ms     5.0x      3,442 KB/1k       968 KB/1k
+    retained          1,503 B/lead     407 B/lead
+
+About 7 us of each record build is uuid4() and the ISO timestamp, which both versions pay.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+import orjson
+from pydantic import TypeAdapter
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("DB_NAME", "bench")
+sys.path.insert(0, str(Path(__file__).parent))
+logging.disable(logging.CRITICAL)
+
+from records import EmailLogRecord, LeadRecord, wire_document  # noqa: E402
+from server import CHAT_LEAD_FIELDS, EmailLog, Lead  # noqa: E402
+
+COLLECTED = {
+    "name": "Sam Citizen",
+    "phone": "0412 345 678",
+    "suburb": "Berwick",
+    "job_description": "Switchboard upgrade and two new powerpoints in the garage",
+    "suburb_canonical": "Berwick",
+    "postcode": "3806",
+    "phone_e164": "+61412345678",
+}
+EMAIL = {
+    "lead_id": "8d7c1b9e-3f0a-4f55-9a57-0c5e0f7f2b61",
+    "email_type": "confirmation",
+    "recipient_name": "Sam Citizen",
+    "recipient_phone": "0412 345 678",
+    "subject": "Thanks for contacting Add Power Electrics - We'll be in touch soon!",
+    "body": "Hi Sam,\n\nThanks for reaching out..." * 10,
+}
+
+
+def capture_pydantic():
+    lead_dict = Lead(urgency="normal", **COLLECTED).model_dump()
+    stored = lead_dict.copy()
+    return stored, {
+        "id": lead_dict["id"],
+        "name": lead_dict["name"],
+        "phone": lead_dict["phone"],
+        "suburb": lead_dict["suburb"],
+        "job_description": lead_dict["job_description"],
+        "status": lead_dict["status"],
+        "created_at": lead_dict["created_at"],
+    }
+
+
+def capture_records():
+    lead_dict = LeadRecord(urgency="normal", **COLLECTED).to_dict()
+    stored = lead_dict.copy()
+    return stored, {field: lead_dict[field] for field in CHAT_LEAD_FIELDS}
+
+
+def email_log_pydantic():
+    email_log = EmailLog(**EMAIL)
+    return email_log.model_dump(), email_log.model_dump()
+
+
+def email_log_records():
+    email_log = EmailLogRecord(**EMAIL).to_dict()
+    return email_log.copy(), email_log
+
+
+LEADS_ADAPTER = TypeAdapter(List[Lead])
+
+
+def list_response_pydantic(docs: List[dict]) -> bytes:
+    # What FastAPI does for response_model=List[Lead]: validate, dump in JSON mode, json.dumps
+    content = LEADS_ADAPTER.dump_python(LEADS_ADAPTER.validate_python(docs), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def list_response_records(docs: List[dict]) -> bytes:
+    return orjson.dumps([wire_document(LeadRecord, doc) for doc in docs])
+
+
+def best_time(fn: Callable, n: int, repeats: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return best / n
+
+
+def peak_alloc(fn: Callable) -> int:
+    fn()  # warm caches outside the trace
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def retained_per_lead(build: Callable, n: int) -> float:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = [build() for _ in range(n)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return (after - before) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=20_000, help="operations per timing run")
+    parser.add_argument("--list-size", type=int, default=1000, help="leads per list response (GET /api/leads returns up to 1000)")
+    args = parser.parse_args()
+
+    docs = [LeadRecord(**{**COLLECTED, "name": f"Lead {i}"}).to_dict() for i in range(args.list_size)]
+    if list_response_pydantic(docs) != list_response_records(docs):
+        raise SystemExit("list responses differ - wire format is not preserved")
+    list_n = max(1, args.n // args.list_size * 5)
+
+    rows = [
+        ("capture", capture_pydantic, capture_records, args.n, 1),
+        ("email_log", email_log_pydantic, email_log_records, args.n, 1),
+        ("list_response", lambda: list_response_pydantic(docs), lambda: list_response_records(docs), list_n, args.list_size),
+    ]
+    print(f"{'path':<15} {'pydantic':>12} {'records':>12} {'speedup':>8} {'pydantic alloc':>16} {'records alloc':>15}")
+    for name, old, new, n, per in rows:
+        old_t, new_t = best_time(old, n), best_time(new, n)
+        old_a, new_a = peak_alloc(old), peak_alloc(new)
+        unit, scale = ("us", 1e6) if per == 1 else ("ms", 1e3)
+        alloc = (lambda b: f"{b:,} B") if per == 1 else (lambda b: f"{b * 1000 // per // 1024:,} KB/1k")
+        print(f"{name:<15} {old_t * scale:>9.2f} {unit} {new_t * scale:>9.2f} {unit} {old_t / new_t:>7.1f}x "
+              f"{alloc(old_a):>16} {alloc(new_a):>15}")
+
+    old_r = retained_per_lead(lambda: Lead(urgency="normal", **COLLECTED), args.n)
+    new_r = retained_per_lead(lambda: LeadRecord(urgency="normal", **COLLECTED), args.n)
+    print(f"{'retained':<15} {old_r:>7,.0f} B/lead {new_r:>7,.0f} B/lead")
+
+
+if __name__ == "__main__":
+    main()
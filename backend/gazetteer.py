@@ -0,0 +1,213 @@
+"""Victorian suburb gazetteer with prefix and typo-tolerant lookup
+
+Loaded once from data/vic_suburbs.csv. Exact and abbreviated names ("Cranbourne Nth")
+resolve through a dict, prefixes through a trie (for quick-reply suggestions) and
+misspellings ("cranborne") through a trigram index verified with Levenshtein distance.
+"""
+import csv
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DATA_FILE = Path(__file__).parent / "data" / "vic_suburbs.csv"
+
+# Abbreviations people type for directional/common suburb words
+ABBREVIATIONS = {
+    "nth": "north", "n": "north",
+    "sth": "south", "s": "south",
+    "e": "east", "w": "west",
+    "mt": "mount", "saint": "st",
+    "pk": "park", "hts": "heights", "vlg": "village",
+}
+POSTCODE_RE = re.compile(r"\b(3\d{3})\b")
+NON_WORD_RE = re.compile(r"[^a-z0-9 ]+")
+STATE_WORDS = {"vic", "victoria", "australia", "au"}
+
+
+class Suburb(NamedTuple):
+    name: str
+    postcode: str
+
+
+class SuburbMatch(NamedTuple):
+    name: str
+    postcode: str
+    distance: int  # 0 for exact / abbreviation matches
+
+
+def normalize_suburb(text: str) -> Tuple[str, Optional[str]]:
+    """Normalize free text to a lookup key, pulling out any postcode typed with it"""
+    text = text.lower().replace("'", "")
+    postcode_match = POSTCODE_RE.search(text)
+    postcode = postcode_match.group(1) if postcode_match else None
+    words = NON_WORD_RE.sub(" ", POSTCODE_RE.sub(" ", text)).split()
+    words = [ABBREVIATIONS.get(w, w) for w in words if w not in STATE_WORDS]
+    return " ".join(words), postcode
+
+
+def levenshtein(a: str, b: str, limit: int = 1 << 30) -> int:
+    """Edit distance with early exit once every cell in a row exceeds ``limit``"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NGramIndex:
+    """Trigram index: candidates must share enough trigrams before edit distance is computed"""
+
+    def __init__(self):
+        self.postings: Dict[str, List[str]] = {}
+        self.size: Dict[str, int] = {}
+
+    def add(self, key: str):
+        grams = trigrams(key)
+        self.size[key] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(key)
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Keys within ``max_distance`` edits of ``word``, nearest first"""
+        grams = trigrams(word)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for key in self.postings.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        # One edit changes at most three trigrams
+        results = []
+        for key, count in shared.items():
+            if count >= max(len(grams), self.size[key]) - 3 * max_distance:
+                distance = levenshtein(word, key, max_distance)
+                if distance <= max_distance:
+                    results.append((distance, key))
+        results.sort()
+        return results
+
+
+class PrefixTrie:
+    """Character trie; each node keeps the key that ends there under the "" edge"""
+
+    def __init__(self):
+        self.root: dict = {}
+
+    def add(self, key: str):
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[""] = key
+
+    def starting_with(self, prefix: str, limit: int) -> List[str]:
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        results = []
+        stack = [node]
+        while stack and len(results) < limit:
+            current = stack.pop()
+            if "" in current:
+                results.append(current[""])
+            # Reverse-sorted so the alphabetically first branch is popped first
+            stack.extend(current[ch] for ch in sorted((c for c in current if c), reverse=True))
+        return results
+
+
+class Gazetteer:
+    def __init__(self, suburbs: List[Suburb]):
+        self.by_key: Dict[str, List[Suburb]] = {}
+        self.by_postcode: Dict[str, List[Suburb]] = {}
+        self.trie = PrefixTrie()
+        self.ngrams = NGramIndex()
+        for suburb in suburbs:
+            key, _ = normalize_suburb(suburb.name)
+            self.by_key.setdefault(key, []).append(suburb)
+            self.by_postcode.setdefault(suburb.postcode, []).append(suburb)
+            self.trie.add(key)
+            self.ngrams.add(key)
+
+    @classmethod
+    def from_csv(cls, path: Path = DATA_FILE) -> "Gazetteer":
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls([Suburb(row["suburb"], row["postcode"]) for row in csv.DictReader(f)])
+
+    def __len__(self) -> int:
+        return len(self.by_key)
+
+    def _pick(self, key: str, postcode: Optional[str]) -> Suburb:
+        candidates = self.by_key[key]
+        if postcode:
+            for suburb in candidates:
+                if suburb.postcode == postcode:
+                    return suburb
+        return candidates[0]
+
+    def lookup(self, text: str) -> Optional[SuburbMatch]:
+        """Resolve free text to a canonical suburb, or None if nothing is close enough"""
+        return self._lookup(text.strip())
+
+    @lru_cache(maxsize=4096)
+    def _lookup(self, text: str) -> Optional[SuburbMatch]:
+        key, postcode = normalize_suburb(text)
+        if not key:
+            # Bare postcode - only usable if it maps to a single suburb
+            matches = self.by_postcode.get(postcode or "", [])
+            if len(matches) == 1:
+                return SuburbMatch(matches[0].name, matches[0].postcode, 0)
+            return None
+
+        if key in self.by_key:
+            suburb = self._pick(key, postcode)
+            return SuburbMatch(suburb.name, suburb.postcode, 0)
+
+        # One typo for short names, two for longer ones
+        max_distance = 1 if len(key) <= 6 else 2
+        candidates = self.ngrams.search(key, max_distance)
+        if not candidates:
+            return None
+        if postcode:
+            in_postcode = [c for c in candidates if any(s.postcode == postcode for s in self.by_key[c[1]])]
+            candidates = in_postcode or candidates
+        best_distance = candidates[0][0]
+        best = [c for c in candidates if c[0] == best_distance]
+        if len(best) > 1:
+            return None  # ambiguous - better to store nothing than the wrong suburb
+        suburb = self._pick(best[0][1], postcode)
+        return SuburbMatch(suburb.name, suburb.postcode, best_distance)
+
+    def suggest(self, text: str, limit: int = 5) -> List[Suburb]:
+        """Suggestions for partial or misspelled input: prefix matches first, then near misses"""
+        key, postcode = normalize_suburb(text)
+        if not key and postcode:
+            return self.by_postcode.get(postcode, [])[:limit]
+        keys = self.trie.starting_with(key, limit) if key else []
+        if len(keys) < limit and len(key) >= 3:
+            for _, candidate in self.ngrams.search(key, 2):
+                if candidate not in keys:
+                    keys.append(candidate)
+                if len(keys) >= limit:
+                    break
+        return [self.by_key[k][0] for k in keys[:limit]]
+
+
+@lru_cache(maxsize=1)
+def get_gazetteer() -> Gazetteer:
+    """The bundled gazetteer, loaded on first use"""
+    return Gazetteer.from_csv()
@@ -0,0 +1,233 @@
+"""TF-IDF + linear fallback classifier for messages the keyword matcher can't place
+
+Trained offline (pure NumPy, no network/GPU) from the FAQ keywords plus any labelled
+chat messages, and saved as .npy files that the server memory-maps at startup:
+
+    cd backend
+    python intent_classifier.py train --examples labelled_messages.jsonl
+
+``labelled_messages.jsonl`` holds one {"message": ..., "label": ...} object per line, where
+label is one of the labels printed by ``python intent_classifier.py labels``. Scoring one
+message is a handful of row lookups into the weight matrix (well under a millisecond).
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_MODEL_DIR = Path(__file__).parent / "models" / "intent"
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def extract_features(text: str) -> List[str]:
+    """Word unigrams/bigrams plus character trigrams (to survive typos like "swichboard")"""
+    words = WORD_RE.findall(text.lower())
+    features = [f"w:{w}" for w in words]
+    features += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f"<{w}>"
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+class IntentClassifier:
+    """Multinomial logistic regression over L2-normalized TF-IDF features"""
+
+    def __init__(self, vocabulary: Dict[str, int], labels: List[str], idf: np.ndarray,
+                 weights: np.ndarray, bias: np.ndarray):
+        self.vocabulary = vocabulary
+        self.labels = labels
+        self.idf = idf
+        self.weights = weights  # (n_features, n_labels), usually a read-only memmap
+        self.bias = bias
+
+    # ----- persistence -----
+
+    @classmethod
+    def load(cls, model_dir: Path = DEFAULT_MODEL_DIR) -> "IntentClassifier":
+        model_dir = Path(model_dir)
+        meta = json.loads((model_dir / "meta.json").read_text())
+        return cls(
+            vocabulary=meta["vocabulary"],
+            labels=meta["labels"],
+            idf=np.load(model_dir / "idf.npy", mmap_mode="r"),
+            weights=np.load(model_dir / "weights.npy", mmap_mode="r"),
+            bias=np.load(model_dir / "bias.npy"),
+        )
+
+    def save(self, model_dir: Path = DEFAULT_MODEL_DIR):
+        model_dir = Path(model_dir)
+        model_dir.mkdir(parents=True, exist_ok=True)
+        (model_dir / "meta.json").write_text(json.dumps({"labels": self.labels, "vocabulary": self.vocabulary}))
+        np.save(model_dir / "idf.npy", np.asarray(self.idf, dtype=np.float32))
+        np.save(model_dir / "weights.npy", np.asarray(self.weights, dtype=np.float32))
+        np.save(model_dir / "bias.npy", np.asarray(self.bias, dtype=np.float32))
+
+    # ----- scoring -----
+
+    def _vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Sparse TF-IDF vector as (feature indices, values)"""
+        counts = Counter(f for f in extract_features(text) if f in self.vocabulary)
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        indices = np.fromiter((self.vocabulary[f] for f in counts), dtype=np.int64, count=len(counts))
+        tf = np.fromiter((1 + math.log(c) for c in counts.values()), dtype=np.float32, count=len(counts))
+        values = tf * self.idf[indices]
+        return indices, values / np.linalg.norm(values)
+
+    def predict_proba_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """Label probabilities for many messages at once, shape (len(texts), n_labels)"""
+        rows, indices, values = [], [], []
+        for row, text in enumerate(texts):
+            idx, val = self._vectorize(text)
+            rows.append(np.full(len(idx), row, dtype=np.int64))
+            indices.append(idx)
+            values.append(val)
+        logits = np.tile(np.asarray(self.bias, dtype=np.float32), (len(texts), 1))
+        if texts:
+            rows_, idx_, val_ = np.concatenate(rows), np.concatenate(indices), np.concatenate(values)
+            np.add.at(logits, rows_, self.weights[idx_] * val_[:, None])
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, text: str) -> Optional[Tuple[str, float]]:
+        """(label, probability) for one message, or None if no known feature occurs"""
+        indices, values = self._vectorize(text)
+        if len(indices) == 0:
+            return None
+        logits = np.asarray(self.bias, dtype=np.float32) + values @ self.weights[indices]
+        logits -= logits.max()
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+    def predict_batch(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        probabilities = self.predict_proba_batch(texts)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    # ----- training -----
+
+    @classmethod
+    def train(cls, examples: Sequence[Tuple[str, str]], epochs: int = 300, learning_rate: float = 2.0,
+              l2: float = 1e-4, min_df: int = 1, batch_size: int = 1024, seed: int = 0) -> "IntentClassifier":
+        """Fit on (message, label) pairs with mini-batch gradient descent"""
+        labels = sorted({label for _, label in examples})
+        label_index = {label: i for i, label in enumerate(labels)}
+        documents = [extract_features(text) for text, _ in examples]
+
+        df = Counter(f for doc in documents for f in set(doc))
+        vocabulary = {f: i for i, f in enumerate(sorted(f for f, n in df.items() if n >= min_df))}
+        n_docs = len(documents)
+        idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for feature, i in vocabulary.items():
+            idf[i] = math.log((1 + n_docs) / (1 + df[feature])) + 1
+
+        model = cls(vocabulary, labels, idf,
+                    np.zeros((len(vocabulary), len(labels)), dtype=np.float32),
+                    np.zeros(len(labels), dtype=np.float32))
+        vectors = [model._vectorize(text) for text, _ in examples]
+        targets = np.array([label_index[label] for _, label in examples])
+
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(n_docs)
+            for start in range(0, n_docs, batch_size):
+                batch = order[start:start + batch_size]
+                x = np.zeros((len(batch), len(vocabulary)), dtype=np.float32)
+                for row, doc in enumerate(batch):
+                    idx, val = vectors[doc]
+                    x[row, idx] = val
+                logits = x @ model.weights + model.bias
+                logits -= logits.max(axis=1, keepdims=True)
+                p = np.exp(logits)
+                p /= p.sum(axis=1, keepdims=True)
+                p[np.arange(len(batch)), targets[batch]] -= 1
+                model.weights -= learning_rate * (x.T @ p / len(batch) + l2 * model.weights)
+                model.bias -= learning_rate * p.mean(axis=0)
+        return model
+
+
+# ============== TRAINING DATA ==============
+
+def faq_label(keywords: Sequence[str]) -> str:
+    """Stable label for an FAQ entry, independent of its position in FAQ_PATTERNS"""
+    return f"faq:{keywords[0]}"
+
+
+def seed_examples(faq_patterns, booking_words: Iterable[str], diy_words: Iterable[str]) -> List[Tuple[str, str]]:
+    """Training pairs generated from the keyword lists the matcher already uses"""
+    templates = ["{}", "need {}", "my {}", "{} help", "question about {}", "looking for {}"]
+    examples = []
+    for keywords, _ in faq_patterns:
+        label = faq_label(keywords)
+        examples += [(t.format(kw), label) for kw in keywords for t in templates]
+    examples += [(t.format(w), "start_lead") for w in booking_words for t in templates]
+    examples += [(t.format(w), "diy_warning") for w in diy_words for t in templates]
+    return examples
+
+
+def read_examples(path: Path) -> List[Tuple[str, str]]:
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["message"], record["label"]))
+    return examples
+
+
+def _import_server():
+    # server.py builds its Mongo client at import time; the client connects lazily
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "offline")
+    sys.path.insert(0, str(Path(__file__).parent))
+    import server
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="train and save the model")
+    train.add_argument("--examples", type=Path, action="append", default=[], help="labelled JSONL (repeatable)")
+    train.add_argument("--out", type=Path, default=DEFAULT_MODEL_DIR)
+    train.add_argument("--epochs", type=int, default=300)
+    sub.add_parser("labels", help="list the labels the server understands")
+    score = sub.add_parser("score", help="score messages from stdin, one per line")
+    score.add_argument("--model", type=Path, default=DEFAULT_MODEL_DIR)
+    args = parser.parse_args()
+
+    if args.command == "score":
+        model = IntentClassifier.load(args.model)
+        messages = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+        for message, (label, p) in zip(messages, model.predict_batch(messages)):
+            print(f"{p:.3f}\t{label}\t{message}")
+        return
+
+    server = _import_server()
+    examples = seed_examples(server.FAQ_PATTERNS, server.BOOKING_WORDS, server.DIY_WORDS)
+    if args.command == "labels":
+        print("\n".join(sorted({label for _, label in examples})))
+        return
+
+    for path in args.examples:
+        examples += read_examples(path)
+    model = IntentClassifier.train(examples, epochs=args.epochs)
+    model.save(args.out)
+    accuracy = np.mean([model.predict(text)[0] == label for text, label in examples if model.predict(text)])
+    print(f"Trained on {len(examples)} examples, {len(model.vocabulary)} features, "
+          f"{len(model.labels)} labels (training accuracy {accuracy:.1%}) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Full-text lead search
+
+Uses the Mongo text index on leads when the server supports it. Otherwise (or with
+LEAD_SEARCH_BACKEND=memory) an in-process BM25 inverted index is built from the leads
+collection on first use and kept up to date as this process inserts, updates and
+deletes leads. The fallback index is per process, so with several workers it only sees
+other workers' changes after a restart.
+
+With an ``archive`` (archive.ColdArchive), matches from archived leads follow the hot ones,
+so a query keeps paging into the archive once the hot results run out.
+"""
+import heapq
+import logging
+import math
+import re
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {"a", "an", "and", "at", "for", "in", "is", "it", "my", "of", "on", "the", "to", "with", "job"}
+
+# Relative weight of a term found in each field (mirrors the Mongo text index weights)
+FIELD_WEIGHTS = {"name": 5, "suburb": 3, "suburb_canonical": 3, "job_description": 1}
+SEARCH_PROJECTION = {"_id": 0, "id": 1, "created_at": 1, "enquiries.job_description": 1, **{f: 1 for f in FIELD_WEIGHTS}}
+
+
+def stem(token: str) -> str:
+    """Very light plural stripping so "lights" matches "light" """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(t) for t in TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class InvertedIndex:
+    """BM25 index over weighted lead fields"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # term -> lead id -> weighted tf
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.doc_length: Dict[str, float] = {}
+        self.created_at: Dict[str, str] = {}
+        self.total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_length)
+
+    def add(self, lead: dict):
+        lead_id = lead["id"]
+        if lead_id in self.doc_length:
+            self.remove(lead_id)
+
+        weights: Dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(lead.get(field)):
+                weights[term] += weight
+        for enquiry in lead.get("enquiries") or []:
+            for term in tokenize(enquiry.get("job_description")):
+                weights[term] += FIELD_WEIGHTS["job_description"]
+
+        for term, tf in weights.items():
+            self.postings[term][lead_id] = tf
+        length = sum(weights.values())
+        self.doc_terms[lead_id] = list(weights)
+        self.doc_length[lead_id] = length
+        self.created_at[lead_id] = lead.get("created_at", "")
+        self.total_length += length
+
+    def remove(self, lead_id: str):
+        if lead_id not in self.doc_length:
+            return
+        for term in self.doc_terms.pop(lead_id):
+            postings = self.postings[term]
+            postings.pop(lead_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_length.pop(lead_id)
+        self.created_at.pop(lead_id, None)
+
+    def search(self, query: str, top: int, created_from: Optional[str] = None,
+               created_to: Optional[str] = None) -> Tuple[int, List[Tuple[str, float]]]:
+        """Return (number of matches, best ``top`` matches as (id, score)); newer leads win ties"""
+        terms = set(tokenize(query))
+        if not terms or not self.doc_length:
+            return 0, []
+        n_docs = len(self.doc_length)
+        k1, b = self.K1, self.B
+        avg_length = self.total_length / n_docs
+        doc_length = self.doc_length
+        scores: Dict[str, float] = defaultdict(float)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for lead_id, tf in postings.items():
+                norm = k1 * (1 - b + b * doc_length[lead_id] / avg_length)
+                scores[lead_id] += idf * tf * (k1 + 1) / (tf + norm)
+
+        created_at = self.created_at
+        if created_from or created_to:
+            scores = {
+                lead_id: score for lead_id, score in scores.items()
+                if (not created_from or created_at[lead_id] >= created_from)
+                and (not created_to or created_at[lead_id] <= created_to)
+            }
+        best = heapq.nlargest(top, scores.items(), key=lambda item: (item[1], created_at[item[0]]))
+        return len(scores), best
+
+
+class LeadSearch:
+    def __init__(self, collection, backend: str = "auto", partition: Callable[[], Any] = lambda: None, archive=None):
+        self.collection = collection
+        self.archive = archive
+        self.use_mongo = backend in ("auto", "mongo")
+        self.fallback_allowed = backend in ("auto", "memory")
+        # The fallback keeps one index per partition (tenant), each built on first use
+        self.partition = partition
+        self.indexes: Dict[Any, InvertedIndex] = {}
+
+    @property
+    def index(self) -> Optional[InvertedIndex]:
+        return self.indexes.get(self.partition())
+
+    async def ensure_indexes(self):
+        if not self.use_mongo:
+            return
+        try:
+            await self.collection.create_index(
+                [(field, "text") for field in FIELD_WEIGHTS] + [("enquiries.job_description", "text")],
+                weights={**FIELD_WEIGHTS, "enquiries.job_description": 1},
+                name="lead_text_search",
+            )
+        except OperationFailure as e:
+            if not self.fallback_allowed:
+                raise
+            logger.warning(f"Text index unavailable, using in-process lead search: {e}")
+            self.use_mongo = False
+
+    # ----- incremental maintenance of the fallback index -----
+
+    def on_saved(self, lead: dict):
+        if self.index is not None:
+            self.index.add(lead)
+
+    def on_deleted(self, lead_id: str):
+        if self.index is not None:
+            self.index.remove(lead_id)
+
+    async def _build_index(self, batch_size: int = 5000):
+        index = InvertedIndex()
+        cursor = self.collection.find({}, SEARCH_PROJECTION).batch_size(batch_size)
+        async for lead in cursor:
+            index.add(lead)
+        self.indexes[self.partition()] = index
+        logger.info(f"Built in-process lead search index ({len(index)} leads)")
+
+    # ----- queries -----
+
+    async def search(self, query: str, skip: int, limit: int,
+                     created_from: Optional[str] = None, created_to: Optional[str] = None) -> Tuple[int, List[dict]]:
+        """Return (total matches, one page of leads with a ``score``)"""
+        total, leads = await self._search_hot(query, skip, limit, created_from, created_to)
+        if self.archive is None:
+            return total, leads
+        archived_total, archived = await self.archive.search(
+            query, max(skip - total, 0), limit - len(leads), created_from, created_to
+        )
+        return total + archived_total, leads + archived
+
+    async def _search_hot(self, query, skip, limit, created_from, created_to):
+        if self.use_mongo:
+            try:
+                return await self._search_mongo(query, skip, limit, created_from, created_to)
+            except OperationFailure as e:
+                if not self.fallback_allowed:
+                    raise
+                logger.warning(f"Mongo text search failed, switching to in-process index: {e}")
+                self.use_mongo = False
+        return await self._search_memory(query, skip, limit, created_from, created_to)
+
+    @staticmethod
+    def _date_filter(created_from: Optional[str], created_to: Optional[str]) -> dict:
+        created = {}
+        if created_from:
+            created["$gte"] = created_from
+        if created_to:
+            created["$lte"] = created_to
+        return {"created_at": created} if created else {}
+
+    async def _search_mongo(self, query, skip, limit, created_from, created_to):
+        filter_ = {"$text": {"$search": query}, **self._date_filter(created_from, created_to)}
+        total = await self.collection.count_documents(filter_)
+        leads = await self.collection.find(
+            filter_, {"_id": 0, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), ("created_at", -1)]).skip(skip).limit(limit).to_list(limit)
+        return total, leads
+
+    async def _search_memory(self, query, skip, limit, created_from, created_to):
+        if self.index is None:
+            await self._build_index()
+        total, ranked = self.index.search(query, skip + limit, created_from, created_to)
+        page = ranked[skip:]
+        if not page:
+            return total, []
+        docs = await self.collection.find({"id": {"$in": [lead_id for lead_id, _ in page]}}, {"_id": 0}).to_list(len(page))
+        by_id = {doc["id"]: doc for doc in docs}
+        leads = [{**by_id[lead_id], "score": round(score, 4)} for lead_id, score in page if lead_id in by_id]
+        return total, leads
@@ -0,0 +1,135 @@
+"""Event-loop lag and slow-callback monitor
+
+Everything in a worker shares one asyncio loop, so any synchronous stretch - rendering
+an email, validating a large response model - delays every other request. Two
+measurements catch it:
+
+* lag: a probe task sleeps ``interval`` seconds and records how late it wakes up
+* slow callbacks: like asyncio debug mode, every callback the loop runs is timed, and
+  those over ``slow_callback`` seconds are logged and counted against the route whose
+  request was running (``RouteContextMiddleware`` records it in a context variable, which
+  every task the request starts inherits)
+
+Timing a callback costs two perf_counter calls.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from outbound import percentiles
+
+logger = logging.getLogger(__name__)
+
+LAG_SAMPLES = 2048
+RECENT_STALLS = 20
+
+# The ASGI scope of the request being handled; routing fills in scope["endpoint"] later
+current_scope: ContextVar[Optional[Scope]] = ContextVar("current_scope", default=None)
+
+
+def route_label(scope: Optional[Scope]) -> str:
+    if scope is None:
+        return "background"
+    endpoint = scope.get("endpoint")
+    name = getattr(endpoint, "__name__", None) or scope.get("path", "?")
+    return f"{scope.get('method', '')} {name}".strip()
+
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    callback = handle._callback
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"task {getattr(coro, '__qualname__', coro)}"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+class RouteContextMiddleware:
+    """Record the request scope for stall attribution"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            # Not reset afterwards: the server runs each request in its own task (and context),
+            # and a request that completes within one callback must still be attributable
+            # once that callback returns
+            current_scope.set(scope)
+        await self.app(scope, receive, send)
+
+
+class LoopMonitor:
+    def __init__(self, slow_callback: float = 0.1, interval: float = 0.25):
+        self.slow_callback = slow_callback
+        self.interval = interval
+        self.lag: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self.max_lag = 0.0
+        self.stalls: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_ms": 0.0})
+        self.recent: Deque[dict] = deque(maxlen=RECENT_STALLS)
+        self._original_run = None
+
+    # ----- slow callbacks -----
+
+    def install(self):
+        """Time every callback run by any asyncio loop in this process"""
+        if self._original_run is not None:
+            return
+        original = self._original_run = asyncio.Handle._run
+        monitor = self
+
+        def _run(handle):
+            started = time.perf_counter()
+            original(handle)
+            elapsed = time.perf_counter() - started
+            if elapsed >= monitor.slow_callback:
+                monitor.record_stall(handle, elapsed)
+
+        asyncio.Handle._run = _run
+
+    def uninstall(self):
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+            self._original_run = None
+
+    def record_stall(self, handle: asyncio.Handle, elapsed: float):
+        context = getattr(handle, "_context", None)
+        route = route_label(context.get(current_scope) if context is not None else None)
+        callback = describe_callback(handle)
+        ms = round(elapsed * 1000, 2)
+        stats = self.stalls[route]
+        stats["count"] += 1
+        stats["seconds"] += elapsed
+        stats["max_ms"] = max(stats["max_ms"], ms)
+        self.recent.append({"at": time.time(), "route": route, "callback": callback, "duration_ms": ms})
+        logger.warning(f"event=slow_callback route={route!r} callback={callback!r} duration_ms={ms}",
+                       extra={"event": "slow_callback", "route": route, "callback": callback, "duration_ms": ms})
+
+    # ----- lag probe -----
+
+    async def run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.slow_callback:
+                ms = round(lag * 1000, 2)
+                logger.warning(f"event=loop_lag lag_ms={ms}", extra={"event": "loop_lag", "lag_ms": ms})
+
+    def stats(self) -> dict:
+        return {
+            "slow_callback_ms": self.slow_callback * 1000,
+            "lag_ms": {**percentiles(self.lag), "max": round(self.max_lag * 1000, 2)},
+            "stalls_by_route": {
+                route: {"count": s["count"], "seconds": round(s["seconds"], 3), "max_ms": s["max_ms"]}
+                for route, s in sorted(self.stalls.items(), key=lambda item: -item[1]["seconds"])
+            },
+            "recent_stalls": list(self.recent),
+        }
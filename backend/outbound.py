@@ -0,0 +1,165 @@
+"""Prioritised dispatcher for outbound email/SMS work
+
+Jobs are queued in three lanes - urgent, normal, bulk - and run by a fixed pool of
+workers. Every worker takes the highest-priority job waiting, and ``reserved_urgent``
+of them only ever take urgent jobs, so an emergency confirmation starts straight away
+even while every general worker is busy with a review-request campaign. Queue wait and
+total latency are tracked per lane. ``stop`` lets the workers drain the queues for a grace
+period before cancelling them, and logs any job it has to drop.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LANES = ("urgent", "normal", "bulk")  # highest priority first
+LATENCY_SAMPLES = 2048
+
+
+def percentiles(samples, points=(50, 95, 99)) -> Dict[str, Optional[float]]:
+    """Nearest-rank percentiles in milliseconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2) for p in points}
+
+
+class LaneStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.total: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def as_dict(self, queued: int) -> dict:
+        return {
+            "queued": queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_ms": percentiles(self.wait),
+            "total_ms": percentiles(self.total),
+        }
+
+
+Job = Tuple[float, Callable[..., Awaitable[Any]], tuple, asyncio.Future, contextvars.Context]
+
+
+class OutboundDispatcher:
+    def __init__(self, workers: int = 4, reserved_urgent: int = 1):
+        if not 0 <= reserved_urgent < workers:
+            raise ValueError("reserved_urgent must leave at least one general worker")
+        self.workers = workers
+        self.reserved_urgent = reserved_urgent
+        self.queues: Dict[str, Deque[Job]] = {lane: deque() for lane in LANES}
+        self.lane_stats = {lane: LaneStats() for lane in LANES}
+        self._ready: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._running = 0  # jobs taken off a queue and not finished yet
+
+    def _ensure_started(self):
+        """Start the workers on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._ready = asyncio.Condition()
+        self._tasks = [
+            loop.create_task(self._worker(("urgent",) if i < self.reserved_urgent else LANES))
+            for i in range(self.workers)
+        ]
+
+    def pending(self) -> int:
+        """Jobs queued or running"""
+        return self._running + sum(len(queue) for queue in self.queues.values())
+
+    async def stop(self, timeout: float = 10.0, poll_seconds: float = 0.05):
+        """Give queued and running jobs up to ``timeout`` seconds to finish, then cancel the workers
+
+        Jobs that didn't finish in time are logged and their futures cancelled.
+        """
+        if self._tasks:
+            deadline = time.monotonic() + timeout
+            while self.pending() and time.monotonic() < deadline:
+                await asyncio.sleep(poll_seconds)
+            if self._running:
+                logger.warning(f"Outbound: cancelling {self._running} job(s) still running after {timeout}s")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        for lane in LANES:
+            queue = self.queues[lane]
+            while queue:
+                _, fn, _, future, _ = queue.popleft()
+                future.cancel()
+                logger.warning(f"Outbound {lane} job {getattr(fn, '__name__', fn)} dropped at shutdown")
+
+    def _next_job(self, lanes) -> Optional[Tuple[str, Job]]:
+        for lane in lanes:
+            if self.queues[lane]:
+                return lane, self.queues[lane].popleft()
+        return None
+
+    async def _worker(self, lanes):
+        while True:
+            async with self._ready:
+                picked = self._next_job(lanes)
+                while picked is None:
+                    await self._ready.wait()
+                    picked = self._next_job(lanes)
+            lane, (enqueued, fn, args, future, context) = picked
+            stats = self.lane_stats[lane]
+            stats.wait.append(time.perf_counter() - enqueued)
+            self._running += 1
+            try:
+                # Run in the submitter's context, so context variables (e.g. the tenant) carry over
+                result = await asyncio.create_task(fn(*args), context=context)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"Outbound {lane} job {getattr(fn, '__name__', fn)} failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                stats.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._running -= 1
+            stats.total.append(time.perf_counter() - enqueued)
+
+    async def submit(self, lane: str, fn: Callable[..., Awaitable[Any]], *args) -> asyncio.Future:
+        """Queue ``fn(*args)`` on ``lane``; the returned future resolves with its result"""
+        if lane not in self.queues:
+            raise ValueError(f"Unknown lane {lane!r}")
+        self._ensure_started()
+        future = self._loop.create_future()
+        # Fire-and-forget callers never read the result; failures are already logged by the worker
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.queues[lane].append((time.perf_counter(), fn, args, future, contextvars.copy_context()))
+        self.lane_stats[lane].submitted += 1
+        async with self._ready:
+            # Wake everyone: a reserved worker only takes urgent jobs, so notify(1) could pick one that can't run it
+            self._ready.notify_all()
+        return future
+
+    async def run(self, lane: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Queue ``fn(*args)`` and wait for its result"""
+        return await (await self.submit(lane, fn, *args))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "reserved_urgent": self.reserved_urgent,
+            "lanes": {lane: self.lane_stats[lane].as_dict(len(self.queues[lane])) for lane in LANES},
+        }
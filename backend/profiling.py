@@ -0,0 +1,196 @@
+"""Opt-in per-request profiling
+
+A request is profiled when it carries a valid ``X-Profile`` token, or when it is picked
+by the sampling rate (sampling only covers ``sample_paths``, e.g. /api/chat). The whole
+request runs under cProfile and the result is written as a standard pstats file
+(``python -m pstats``, snakeviz, gprof2dot), next to a small JSON file with the request
+details. The profile id is returned in the ``X-Profile-Id``
+response header.
+
+cProfile follows the event-loop thread, so the profile covers intent detection, Pydantic
+model construction, serialization and the loop itself. Time spent waiting for Mongo shows
+up under the loop's ``select``/``epoll`` call. Only one request is profiled at a time, and
+anything else running on the loop during that window is included too.
+
+A token is ``<expires>.<signature>``, where the signature is an HMAC-SHA256 (keyed with
+``PROFILING_SECRET``) over the expiry and the request path. To mint one:
+
+    cd backend
+    python profiling.py sign /api/chat --ttl 600
+
+The admin endpoints that list and download profiles take a token signed for the path
+``admin`` in the ``X-Profile-Admin`` header (``python profiling.py sign admin``).
+
+If neither a secret nor a sampling rate is configured, the middleware isn't installed.
+"""
+import argparse
+import asyncio
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_RE = re.compile(r"^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$")
+
+
+def sign(secret: str, path: str, expires: int) -> str:
+    return hmac.new(secret.encode(), f"{expires}:{path}".encode(), hashlib.sha256).hexdigest()
+
+
+def make_token(secret: str, path: str, ttl_seconds: int = 600) -> str:
+    expires = int(time.time()) + ttl_seconds
+    return f"{expires}.{sign(secret, path, expires)}"
+
+
+def verify_token(secret: str, path: str, token: str, now: Optional[float] = None) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < (time.time() if now is None else now):
+        return False
+    return hmac.compare_digest(signature, sign(secret, path, int(expires)))
+
+
+class ProfileStore:
+    """Profiles on local disk: <id>.prof (pstats) + <id>.json, oldest pruned beyond ``keep``"""
+
+    def __init__(self, directory: Path, keep: int = 200):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    def new_id(self) -> str:
+        # Timestamp first (to the microsecond) so names sort oldest to newest
+        return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.exists() else None
+
+    def save(self, profile_id: str, profiler: cProfile.Profile, meta: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(self.directory / f"{profile_id}.prof")
+        meta = {**meta, "id": profile_id, "functions": len(stats.stats), "cpu_seconds": round(stats.total_tt, 6)}
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(meta))
+        self._prune()
+
+    def _prune(self):
+        profiles = sorted(self.directory.glob("*.prof"))
+        for old in profiles[:max(0, len(profiles) - self.keep)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".json").unlink(missing_ok=True)
+
+    def list(self, limit: int = 100) -> List[dict]:
+        if not self.directory.exists():
+            return []
+        out = []
+        for meta_path in sorted(self.directory.glob("*.json"), reverse=True)[:limit]:
+            try:
+                out.append(json.loads(meta_path.read_text()))
+            except (OSError, ValueError):
+                continue  # pruned or half-written
+        return out
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, store: ProfileStore, secret: Optional[str] = None,
+                 sample_rate: float = 0.0, sample_paths: Tuple[str, ...] = ("/api/chat",)):
+        self.app = app
+        self.store = store
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.sample_paths = sample_paths
+        self._active = False
+
+    def _reason(self, scope: Scope) -> Optional[str]:
+        """Why this request should be profiled, or None"""
+        if self.secret:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    if verify_token(self.secret, scope["path"], value.decode("latin-1")):
+                        return "requested"
+                    logger.warning(f"Rejected profiling token for {scope['path']}")
+                    return None
+        if self.sample_rate and scope["path"].startswith(self.sample_paths) and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = self._reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        if self._active:
+            # cProfile sees the whole thread, so overlapping profiles would be meaningless
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = self.store.new_id()
+        status = None
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        profiler = cProfile.Profile()
+        self._active = True
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            self._active = False
+            meta = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "reason": reason,
+                "wall_ms": round((time.perf_counter() - started) * 1000, 2),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            try:
+                await asyncio.to_thread(self.store.save, profile_id, profiler, meta)
+            except OSError as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    signer = sub.add_parser("sign", help="mint an X-Profile token for a request path")
+    signer.add_argument("path", help="request path, e.g. /api/chat")
+    signer.add_argument("--ttl", type=int, default=600, help="seconds the token stays valid")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv(Path(__file__).parent / ".env")
+    secret = os.environ.get("PROFILING_SECRET")
+    if not secret:
+        parser.error("PROFILING_SECRET is not set")
+    print(make_token(secret, args.path, args.ttl))
+
+
+if __name__ == "__main__":
+    main()
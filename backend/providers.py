@@ -0,0 +1,427 @@
+"""Email and SMS providers over one pooled HTTP client
+
+Every provider shares a single httpx.AsyncClient, opened at startup and closed at
+shutdown. Sends therefore reuse kept-alive connections instead of paying a new TLS
+handshake each. When the h2 package is installed the client speaks HTTP/2, and concurrent
+sends to a provider multiplex over one connection. ``HttpPool`` adds:
+
+* pool limits, plus a cap on requests in flight per host
+* connect/read/write/pool timeouts
+* a circuit breaker per host: after ``failure_threshold`` consecutive failures (transport
+  errors, timeouts, 429s and 5xxs) requests fail fast for ``reset_seconds``, then a single
+  trial request decides whether the circuit closes again
+
+Providers are mock (log only - the default), SendGrid and Resend for email, and Twilio for
+SMS. ``send_batch`` uses the provider's batch API where one exists:
+
+* Resend: /emails/batch, up to 100 emails per request
+* SendGrid: one request per 1000 recipients, each personalization carrying its own subject,
+  with its body in a substitution
+* Twilio has no batch API, so its batches are concurrent single sends over the shared
+  connection
+
+Sends never raise: they return a SendResult, with ``ok=False`` and the error on failure.
+Every base URL can point at provider_stub.py, for tests and benchmarks without network.
+"""
+import abc
+import asyncio
+import importlib.util
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """A provider request failed (transport error, timeout, 429 or 5xx)"""
+
+
+class CircuitOpenError(ProviderError):
+    """Requests to this host are failing fast until the circuit's reset time"""
+
+
+@dataclass(slots=True)
+class EmailMessage:
+    to: Optional[str]
+    to_name: str
+    subject: str
+    body: str
+    tag: str = ""  # email type, sent as a category/tag where the provider supports one
+
+
+@dataclass(slots=True)
+class SmsMessage:
+    to: str
+    body: str
+
+
+@dataclass(slots=True)
+class SendResult:
+    ok: bool
+    provider: str
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+# ============== HTTP POOL ==============
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        # Open on reaching the threshold, or again when the half-open trial fails
+        if self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+    def abandon_trial(self):
+        """The half-open trial ended without an answer from the host; let the next request try"""
+        self.trial_running = False
+
+
+class HostStats:
+    def __init__(self, breaker: CircuitBreaker, per_host: int):
+        self.breaker = breaker
+        self.semaphore = asyncio.Semaphore(per_host)
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+
+class HttpPool:
+    """The process-wide HTTP client for provider calls"""
+
+    def __init__(self, http2: bool = True, max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0, per_host: int = 10, timeout: float = 10.0,
+                 connect_timeout: float = 5.0, failure_threshold: int = 5, reset_seconds: float = 30.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the h2 package isn't installed - provider calls use HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.per_host = per_host
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+        self.hosts: Dict[str, HostStats] = {}
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(http2=self.http2, limits=self.limits, timeout=self.timeout,
+                                            transport=self.transport)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _host(self, url: str) -> HostStats:
+        host = urlsplit(url).netloc
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats(CircuitBreaker(self.failure_threshold, self.reset_seconds), self.per_host)
+        return stats
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request; raises ProviderError for failures that count against the host's circuit
+
+        Other 4xx responses (bad credentials, invalid payload) are returned to the caller: they
+        say nothing about the provider's health.
+        """
+        if self.client is None:
+            await self.start()
+        host = self._host(url)
+        if not host.breaker.allow():
+            host.rejected += 1
+            raise CircuitOpenError(f"circuit open for {urlsplit(url).netloc}")
+        trial = host.breaker.trial_running  # this request is the half-open trial
+        try:
+            async with host.semaphore:
+                host.requests += 1
+                host.in_flight += 1
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                finally:
+                    host.in_flight -= 1
+        except httpx.HTTPError as e:
+            host.failures += 1
+            host.breaker.record_failure()
+            raise ProviderError(f"{type(e).__name__}: {e}") from e
+        except BaseException:
+            # Cancelled, or failed before reaching the host: that says nothing about its health,
+            # but a trial left marked as running would keep the circuit from ever closing
+            if trial:
+                host.breaker.abandon_trial()
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            host.failures += 1
+            host.breaker.record_failure()
+            raise ProviderError(f"HTTP {response.status_code} from {urlsplit(url).netloc}")
+        host.breaker.record_success()
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "http2": self.http2,
+            "hosts": {
+                name: {
+                    "requests": h.requests,
+                    "failures": h.failures,
+                    "rejected": h.rejected,
+                    "in_flight": h.in_flight,
+                    "circuit": h.breaker.state,
+                    "times_opened": h.breaker.times_opened,
+                }
+                for name, h in self.hosts.items()
+            },
+        }
+
+
+def json_object(response: httpx.Response) -> dict:
+    """The JSON object in a success response, or {} if the body isn't one - the send still went through"""
+    try:
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+# ============== EMAIL ==============
+
+class EmailProvider(abc.ABC):
+    name = "email"
+    log_prefix = "[EMAIL]"
+    mocked = False
+    batch_size = 1  # messages per batch API request; 1 = no batch API
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {"sent": 0, "failed": 0, "requests": 0}
+
+    async def send(self, message: EmailMessage) -> SendResult:
+        return (await self.send_batch([message]))[0]
+
+    async def send_batch(self, messages: List[EmailMessage]) -> List[SendResult]:
+        results: List[Optional[SendResult]] = [None] * len(messages)
+        sendable = []
+        for i, message in enumerate(messages):
+            if message.to or self.mocked:
+                sendable.append(i)
+            else:
+                results[i] = SendResult(False, self.name, error="lead has no email address")
+        chunks = [sendable[i:i + self.batch_size] for i in range(0, len(sendable), self.batch_size)]
+        sent = await asyncio.gather(*(self._send_chunk([messages[i] for i in chunk]) for chunk in chunks))
+        for chunk, chunk_results in zip(chunks, sent):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        for result in results:
+            self.counters["sent" if result.ok else "failed"] += 1
+        return results
+
+    async def _send_chunk(self, messages: List[EmailMessage]) -> List[SendResult]:
+        """One provider request for up to ``batch_size`` messages"""
+        self.counters["requests"] += 1
+        try:
+            return await self._post(messages)
+        except ProviderError as e:
+            return [SendResult(False, self.name, error=str(e))] * len(messages)
+
+    @abc.abstractmethod
+    async def _post(self, messages: List[EmailMessage]) -> List[SendResult]:
+        """Send ``messages`` in one provider request"""
+
+    def _failed(self, response: httpx.Response, count: int) -> List[SendResult]:
+        error = f"HTTP {response.status_code}: {response.text[:200]}"
+        return [SendResult(False, self.name, error=error)] * count
+
+    def stats(self) -> dict:
+        return {"provider": self.name, "batch_size": self.batch_size, **self.counters}
+
+
+class MockEmailProvider(EmailProvider):
+    name = "mock"
+    log_prefix = "[MOCKED EMAIL]"
+    mocked = True
+
+    async def _post(self, messages: List[EmailMessage]) -> List[SendResult]:
+        return [SendResult(True, self.name, message_id=str(uuid.uuid4())) for _ in messages]
+
+
+class SendGridProvider(EmailProvider):
+    name = "sendgrid"
+    log_prefix = "[SENDGRID]"
+    BASE_URL = "https://api.sendgrid.com"
+    batch_size = 1000  # personalizations per request
+    BODY_TAG = "-body-"
+    MAX_SUBSTITUTION = 10_000  # bytes of substitutions allowed per personalization
+
+    def __init__(self, pool: HttpPool, api_key: str, sender: str, sender_name: str = "", base_url: str = BASE_URL):
+        super().__init__()
+        self.pool = pool
+        self.url = f"{base_url.rstrip('/')}/v3/mail/send"
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.sender = {"email": sender, **({"name": sender_name} if sender_name else {})}
+
+    async def _send_chunk(self, messages: List[EmailMessage]) -> List[SendResult]:
+        if len(messages) > 1 and any(len(m.body.encode()) > self.MAX_SUBSTITUTION for m in messages):
+            # A body too large for a substitution: send this chunk one message at a time
+            singles = await asyncio.gather(*(EmailProvider._send_chunk(self, [m]) for m in messages))
+            return [results[0] for results in singles]
+        return await super()._send_chunk(messages)
+
+    async def _post(self, messages: List[EmailMessage]) -> List[SendResult]:
+        if len(messages) == 1:
+            message = messages[0]
+            payload = {
+                "personalizations": [{"to": [{"email": message.to, "name": message.to_name}]}],
+                "from": self.sender,
+                "subject": message.subject,
+                "content": [{"type": "text/plain", "value": message.body}],
+            }
+        else:
+            payload = {
+                "personalizations": [
+                    {"to": [{"email": m.to, "name": m.to_name}], "subject": m.subject, "substitutions": {self.BODY_TAG: m.body}}
+                    for m in messages
+                ],
+                "from": self.sender,
+                "content": [{"type": "text/plain", "value": self.BODY_TAG}],
+            }
+        tags = sorted({m.tag for m in messages if m.tag})
+        if tags:
+            payload["categories"] = tags
+        response = await self.pool.request("POST", self.url, json=payload, headers=self.headers)
+        if response.status_code != 202:
+            return self._failed(response, len(messages))
+        message_id = response.headers.get("x-message-id")
+        return [SendResult(True, self.name, message_id=message_id) for _ in messages]
+
+
+class ResendProvider(EmailProvider):
+    name = "resend"
+    log_prefix = "[RESEND]"
+    BASE_URL = "https://api.resend.com"
+    batch_size = 100
+
+    def __init__(self, pool: HttpPool, api_key: str, sender: str, sender_name: str = "", base_url: str = BASE_URL):
+        super().__init__()
+        self.pool = pool
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.sender = f"{sender_name} <{sender}>" if sender_name else sender
+
+    def _email(self, message: EmailMessage) -> dict:
+        email = {"from": self.sender, "to": [message.to], "subject": message.subject, "text": message.body}
+        if message.tag:
+            email["tags"] = [{"name": "type", "value": message.tag}]
+        return email
+
+    async def _post(self, messages: List[EmailMessage]) -> List[SendResult]:
+        if len(messages) == 1:
+            response = await self.pool.request("POST", f"{self.base_url}/emails", json=self._email(messages[0]), headers=self.headers)
+            if response.status_code != 200:
+                return self._failed(response, 1)
+            return [SendResult(True, self.name, message_id=json_object(response).get("id"))]
+        response = await self.pool.request("POST", f"{self.base_url}/emails/batch",
+                                           json=[self._email(m) for m in messages], headers=self.headers)
+        if response.status_code != 200:
+            return self._failed(response, len(messages))
+        ids = [item.get("id") if isinstance(item, dict) else None for item in json_object(response).get("data") or []]
+        return [SendResult(True, self.name, message_id=ids[i] if i < len(ids) else None) for i in range(len(messages))]
+
+
+# ============== SMS ==============
+
+class SmsProvider(abc.ABC):
+    name = "sms"
+    log_prefix = "[SMS]"
+    mocked = False
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {"sent": 0, "failed": 0, "requests": 0}
+
+    async def send(self, message: SmsMessage) -> SendResult:
+        self.counters["requests"] += 1
+        try:
+            result = await self._post(message)
+        except ProviderError as e:
+            result = SendResult(False, self.name, error=str(e))
+        self.counters["sent" if result.ok else "failed"] += 1
+        return result
+
+    async def send_batch(self, messages: List[SmsMessage]) -> List[SendResult]:
+        return list(await asyncio.gather(*(self.send(m) for m in messages)))
+
+    @abc.abstractmethod
+    async def _post(self, message: SmsMessage) -> SendResult:
+        """Send one message"""
+
+    def stats(self) -> dict:
+        return {"provider": self.name, **self.counters}
+
+
+class MockSmsProvider(SmsProvider):
+    name = "mock"
+    log_prefix = "[MOCKED SMS]"
+    mocked = True
+
+    async def _post(self, message: SmsMessage) -> SendResult:
+        return SendResult(True, self.name, message_id=str(uuid.uuid4()))
+
+
+class TwilioProvider(SmsProvider):
+    name = "twilio"
+    log_prefix = "[TWILIO]"
+    BASE_URL = "https://api.twilio.com"
+
+    def __init__(self, pool: HttpPool, account_sid: str, auth_token: str, from_number: str, base_url: str = BASE_URL):
+        super().__init__()
+        self.pool = pool
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.auth = (account_sid, auth_token)
+        self.from_number = from_number
+
+    async def _post(self, message: SmsMessage) -> SendResult:
+        response = await self.pool.request("POST", self.url, auth=self.auth,
+                                           data={"To": message.to, "From": self.from_number, "Body": message.body})
+        if response.status_code != 201:
+            return SendResult(False, self.name, error=f"HTTP {response.status_code}: {response.text[:200]}")
+        return SendResult(True, self.name, message_id=json_object(response).get("sid"))
@@ -0,0 +1,144 @@
+"""Token-bucket rate limiting for public endpoints
+
+Buckets are always checked in process first, so abusive clients are rejected without any
+I/O. When a shared store is configured (``RATE_LIMIT_BACKEND=mongo``) requests that pass
+the local check are also charged against a bucket document shared by every worker.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+class RateLimit(NamedTuple):
+    capacity: int      # burst size
+    per_seconds: float  # time to refill a full bucket
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+
+def parse_rate(value: str) -> Optional[RateLimit]:
+    """Parse "30/60" (30 requests per 60 seconds). "0" or "" disables the limit."""
+    value = (value or "").strip()
+    if value in ("", "0", "off", "none"):
+        return None
+    capacity, _, seconds = value.partition("/")
+    return RateLimit(int(capacity), float(seconds or 60))
+
+
+class InMemoryBucketStore:
+    """Per-process buckets: key -> (tokens, last refill timestamp, seconds to refill)"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def consume(self, key: str, limit: RateLimit, now: Optional[float] = None, cost: int = 1) -> Tuple[bool, float]:
+        """Take ``cost`` tokens. Returns (allowed, seconds until enough tokens are available)."""
+        now = time.monotonic() if now is None else now
+        tokens, last, _ = self._buckets.get(key, (limit.capacity, now, limit.per_seconds))
+        tokens = min(limit.capacity, tokens + (now - last) * limit.refill_rate)
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now, limit.per_seconds)
+            if len(self._buckets) > self.max_keys:
+                self._sweep(now)
+            return True, 0.0
+        self._buckets[key] = (tokens, now, limit.per_seconds)
+        return False, (cost - tokens) / limit.refill_rate
+
+    def _sweep(self, now: float):
+        """Drop buckets idle long enough to have refilled - they are equivalent to a fresh one
+
+        Each bucket refills over its own limit's window, so scopes with different limits can share the store.
+        """
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < v[2]}
+        if len(self._buckets) > self.max_keys:
+            # Still full of active keys (e.g. a botnet) - forget the oldest half
+            ordered = sorted(self._buckets.items(), key=lambda item: item[1][1])
+            self._buckets = dict(ordered[len(ordered) // 2:])
+
+
+class MongoBucketStore:
+    """Buckets shared between workers, updated atomically with a pipeline update"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def consume(self, key: str, limit: RateLimit, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        refilled = {"$min": [
+            limit.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", limit.capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, limit.refill_rate]},
+            ]},
+        ]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", cost]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", cost]}, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": datetime.fromtimestamp(now + limit.per_seconds, tz=timezone.utc),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["allowed"]:
+            return True, 0.0
+        return False, (cost - doc["tokens"]) / limit.refill_rate
+
+
+class RateLimiter:
+    """Applies per-route limits for each key scope (e.g. client IP, chat session)"""
+
+    def __init__(self, limits: Dict[str, Dict[str, Optional[RateLimit]]], shared_store: Optional[MongoBucketStore] = None):
+        self.limits = limits
+        self.local = InMemoryBucketStore()
+        self.shared = shared_store
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    async def check(self, route: str, cost: int = 1, **keys: str) -> Optional[float]:
+        """Charge one request (``cost`` tokens) against every configured scope.
+
+        Returns None when allowed, otherwise the number of seconds to wait.
+        """
+        route_limits = self.limits.get(route, {})
+        checks = [(scope, key, route_limits.get(scope)) for scope, key in keys.items() if key]
+        checks = [(scope, key, limit) for scope, key, limit in checks if limit is not None]
+
+        # Cheap in-process rejection first
+        for scope, key, limit in checks:
+            allowed, retry_after = self.local.consume(f"{route}:{scope}:{key}", limit, cost=cost)
+            if not allowed:
+                self.counters[f"{route}.{scope}.rejected_local"] += 1
+                return retry_after
+
+        if self.shared is not None:
+            for scope, key, limit in checks:
+                allowed, retry_after = await self.shared.consume(f"{route}:{scope}:{key}", limit, cost=cost)
+                if not allowed:
+                    self.counters[f"{route}.{scope}.rejected_shared"] += 1
+                    return retry_after
+
+        self.counters[f"{route}.allowed"] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "backend": "mongo" if self.shared is not None else "memory",
+            "tracked_keys": len(self.local),
+            "counters": dict(self.counters),
+        }
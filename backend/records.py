@@ -0,0 +1,111 @@
+"""Internal lead and email-log records
+
+Pydantic models validate what comes in through the API (``LeadCreate``, request bodies) and
+document the responses, but leads and email logs the server builds itself need no
+validation. These slotted dataclasses build those documents with the same fields, order
+and defaults as ``server.Lead``/``server.EmailLog`` for a fraction of the CPU and memory
+(see bench_records.py). ``check_matches`` is run at import so the two can't drift apart.
+
+``wire_document`` gives a stored document the shape response_model validation would:
+model fields only, in model order, with defaults filled in for older documents.
+"""
+import uuid
+from dataclasses import MISSING, dataclass, field, fields
+from datetime import datetime, timezone
+from operator import attrgetter
+from typing import Callable, List, Optional, Tuple
+
+
+def new_id() -> str:
+    return str(uuid.uuid4())
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass(slots=True)
+class LeadRecord:
+    name: str
+    phone: str
+    suburb: str
+    job_description: str
+    id: str = field(default_factory=new_id)
+    created_at: str = field(default_factory=utc_now)
+    status: str = "new"
+    sms_sent: bool = False
+    email_sent: bool = False
+    quote_sent: bool = False
+    review_requested: bool = False
+    suburb_canonical: Optional[str] = None
+    postcode: Optional[str] = None
+    phone_e164: Optional[str] = None
+    enquiry_count: int = 1
+    enquiries: List[dict] = field(default_factory=list)
+    completed_at: Optional[str] = None
+    urgency: str = "normal"
+
+    # Document order: matches server.Lead (id first), not the constructor's
+    FIELDS = ("id", "name", "phone", "suburb", "job_description", "created_at", "status", "sms_sent",
+              "email_sent", "quote_sent", "review_requested", "suburb_canonical", "postcode", "phone_e164",
+              "enquiry_count", "enquiries", "completed_at", "urgency")
+
+    def to_dict(self) -> dict:
+        return dict(zip(self.FIELDS, _lead_values(self)))
+
+
+@dataclass(slots=True)
+class EmailLogRecord:
+    lead_id: str
+    email_type: str
+    recipient_name: str
+    recipient_phone: str
+    subject: str
+    body: str
+    id: str = field(default_factory=new_id)
+    sent_at: str = field(default_factory=utc_now)
+    status: str = "sent"
+
+    FIELDS = ("id", "lead_id", "email_type", "recipient_name", "recipient_phone", "subject", "body",
+              "sent_at", "status")
+
+    def to_dict(self) -> dict:
+        return dict(zip(self.FIELDS, _email_log_values(self)))
+
+
+# Class attributes without annotations aren't dataclass fields (or slots)
+_lead_values = attrgetter(*LeadRecord.FIELDS)
+_email_log_values = attrgetter(*EmailLogRecord.FIELDS)
+
+
+def check_matches(model, record) -> None:
+    """Raise if a record's document fields or defaults differ from its Pydantic model's"""
+    if tuple(model.model_fields) != record.FIELDS:
+        raise TypeError(f"{record.__name__} fields {record.FIELDS} don't match {model.__name__} {tuple(model.model_fields)}")
+    defaults = {f.name: f.default for f in fields(record)}
+    for name, info in model.model_fields.items():
+        if info.default_factory is None and not info.is_required() and defaults[name] != info.default:
+            raise TypeError(f"{record.__name__}.{name} defaults to {defaults[name]!r}, {model.__name__} to {info.default!r}")
+
+
+def _wire_defaults(record) -> List[Tuple[str, object, Optional[Callable]]]:
+    return [(f.name, f.default, None if f.default_factory is MISSING else f.default_factory)
+            for f in sorted(fields(record), key=lambda f: record.FIELDS.index(f.name))]
+
+
+_WIRE_DEFAULTS = {LeadRecord: _wire_defaults(LeadRecord), EmailLogRecord: _wire_defaults(EmailLogRecord)}
+
+
+def wire_document(record, doc: dict) -> dict:
+    """A stored document as its response model would serialize it"""
+    out = {}
+    for name, default, factory in _WIRE_DEFAULTS[record]:
+        if name in doc:
+            out[name] = doc[name]
+        elif factory is not None:
+            out[name] = factory()
+        elif default is MISSING:
+            raise KeyError(f"{record.__name__} document is missing {name!r}")
+        else:
+            out[name] = default
+    return out
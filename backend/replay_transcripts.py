@@ -0,0 +1,163 @@
+"""Replay recorded chat transcripts through the state machine and diff against a golden file
+
+    cd backend
+    python replay_transcripts.py transcripts.jsonl --write-golden golden.jsonl   # record
+    python replay_transcripts.py transcripts.jsonl --golden golden.jsonl         # check
+
+Transcript lines are either {"session_id": ..., "message": ...} (one turn per line, in
+order) or {"session_id": ..., "turns": ["msg", ...]}. Sessions are independent, so they
+are spread over a process pool. Each worker runs server.process_chat_message with
+STORAGE_BACKEND=memory, so nothing is written anywhere. Each turn yields
+{session_id, turn, message, intent, state, action}. Exit status is 1 when any turn
+differs from the golden file.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+COMPARED_FIELDS = ("intent", "state", "action")
+
+# ============== WORKERS ==============
+
+_server = None
+
+
+def _init_worker():
+    global _server
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ.setdefault("DB_NAME", "replay")
+    # Replays exercise the state machine only; nothing is worth recording
+    os.environ.setdefault("TRANSCRIPTS_ENABLED", "false")
+    os.environ.setdefault("FUNNEL_ANALYTICS_ENABLED", "false")
+    sys.path.insert(0, str(Path(__file__).parent))
+    logging.disable(logging.CRITICAL)
+    import server
+    _server = server
+
+
+def _action_of(reply) -> Optional[str]:
+    if hasattr(reply, "action"):
+        return reply.action
+    if hasattr(reply, "body"):
+        return json.loads(reply.body).get("action")
+    return None
+
+
+async def _replay_sessions(sessions: List[Tuple[str, List[str]]]) -> List[dict]:
+    results = []
+    for session_id, messages in sessions:
+        # Fresh store per session keeps runs independent of how sessions are chunked
+        _server.db.clear()
+        for turn, message in enumerate(messages):
+            intent, _ = _server.detect_intent(message.strip())
+            reply = await _server.process_chat_message(session_id, message)
+            conversation = await _server.db.conversations.find_one({"session_id": session_id})
+            results.append({
+                "session_id": session_id,
+                "turn": turn,
+                "message": message,
+                "intent": intent,
+                "state": conversation.get("state") if conversation else None,
+                "action": _action_of(reply),
+            })
+    return results
+
+
+def replay_chunk(sessions: List[Tuple[str, List[str]]]) -> List[dict]:
+    if _server is None:
+        _init_worker()
+    return asyncio.run(_replay_sessions(sessions))
+
+
+# ============== CLI ==============
+
+
+def read_transcripts(path: Path) -> "OrderedDict[str, List[str]]":
+    sessions: "OrderedDict[str, List[str]]" = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = sessions.setdefault(record["session_id"], [])
+            if "turns" in record:
+                messages.extend(t["message"] if isinstance(t, dict) else t for t in record["turns"])
+            else:
+                messages.append(record["message"])
+    return sessions
+
+
+def chunked(items: list, n_chunks: int) -> List[list]:
+    size = max(1, -(-len(items) // n_chunks))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def diff_against_golden(results: List[dict], golden_path: Path, show: int) -> int:
+    golden = {}
+    with open(golden_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                golden[(record["session_id"], record["turn"])] = record
+
+    differences = 0
+    for result in results:
+        expected = golden.pop((result["session_id"], result["turn"]), None)
+        if expected is None:
+            changed = ["(not in golden)"]
+        else:
+            changed = [f"{f}: {expected.get(f)!r} -> {result[f]!r}" for f in COMPARED_FIELDS if expected.get(f) != result[f]]
+        if changed:
+            differences += 1
+            if differences <= show:
+                print(f"{result['session_id']}#{result['turn']} {result['message']!r}: {'; '.join(changed)}")
+    if golden:
+        differences += len(golden)
+        print(f"{len(golden)} golden turns missing from this replay")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("transcripts", type=Path)
+    parser.add_argument("--golden", type=Path, help="golden JSONL to diff against")
+    parser.add_argument("--write-golden", type=Path, help="write this run's results as the new golden file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--show", type=int, default=50, help="max differences to print")
+    args = parser.parse_args()
+
+    sessions = list(read_transcripts(args.transcripts).items())
+    turns = sum(len(messages) for _, messages in sessions)
+    started = time.perf_counter()
+    if args.workers <= 1:
+        results = replay_chunk(sessions)
+    else:
+        # Several chunks per worker so one long session doesn't leave the others idle
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+            results = [r for chunk in pool.map(replay_chunk, chunked(sessions, args.workers * 4)) for r in chunk]
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {turns} turns from {len(sessions)} sessions in {elapsed:.2f}s "
+          f"({turns / elapsed:,.0f} turns/s, {args.workers} workers)")
+
+    if args.write_golden:
+        with open(args.write_golden, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"Wrote golden file {args.write_golden}")
+
+    if args.golden:
+        differences = diff_against_golden(results, args.golden, args.show)
+        print(f"{differences} of {turns} turns differ from {args.golden}")
+        sys.exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
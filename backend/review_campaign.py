@@ -0,0 +1,198 @@
+"""Scheduled review-request campaign
+
+Periodically picks completed leads that haven't been asked for a review and whose job
+was completed at least ``delay`` ago, oldest first, via the
+(status, review_requested, completed_at) index. Each batch is sent with at most
+``concurrency`` emails in flight and at most ``per_minute`` started per minute (a token
+bucket), then saved with one insert_many and one update_many. With ``deliver_batch`` (an
+email provider with a batch API) each batch goes out in chunks of up to ``batch_chunk``
+leads per call instead, throttled per email all the same.
+
+Progress lives in a job_cursors document that doubles as a lease, so only one worker runs
+the campaign at a time and a run interrupted by a restart resumes after the last lead it
+saved. A finished run starts from the beginning next time, which retries failed sends.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from rate_limit import InMemoryBucketStore, RateLimit
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "review_requests"
+LEAD_PROJECTION = {"_id": 0, "id": 1, "name": 1, "phone": 1, "email": 1, "suburb": 1, "job_description": 1, "completed_at": 1}
+
+
+class ReviewCampaign:
+    def __init__(self, leads, cursors, deliver: Callable[[dict], Awaitable[dict]],
+                 save: Callable[[List[dict], List[dict]], Awaitable[None]], delay: timedelta = timedelta(hours=24),
+                 batch_size: int = 50, concurrency: int = 5, per_minute: int = 60, lease_seconds: int = 300,
+                 deliver_batch: Optional[Callable[[List[dict]], Awaitable[List[Optional[dict]]]]] = None,
+                 batch_chunk: int = 100):
+        self.leads = leads
+        self.cursors = cursors
+        self.deliver = deliver  # render + send one review request, returns its email log
+        self.save = save        # persist a batch: (leads, email logs)
+        self.deliver_batch = deliver_batch  # send several at once: an email log per lead, None if it failed
+        self.batch_chunk = batch_chunk
+        self.delay = delay
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.throttle = RateLimit(per_minute, 60)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{id(self):x}-{time.time_ns()}"
+
+    async def ensure_indexes(self):
+        await self.leads.create_index([("status", 1), ("review_requested", 1), ("completed_at", 1), ("id", 1)])
+        # Leads completed before completed_at existed: treat them as completed when created
+        await self.leads.update_many(
+            {"status": "completed", "completed_at": None},
+            [{"$set": {"completed_at": "$created_at"}}],
+        )
+
+    def eligible_query(self, now: datetime, after: Optional[dict] = None) -> dict:
+        query = {
+            "status": "completed",
+            "review_requested": False,
+            "completed_at": {"$lte": (now - self.delay).isoformat()},
+        }
+        if after:
+            query["$or"] = [
+                {"completed_at": {"$gt": after["completed_at"]}},
+                {"completed_at": after["completed_at"], "id": {"$gt": after["id"]}},
+            ]
+        return query
+
+    # ----- lease / cursor -----
+
+    async def _claim(self, now: float) -> Optional[dict]:
+        """Take the job lease unless another worker holds a live one; returns the cursor doc"""
+        try:
+            return await self.cursors.find_one_and_update(
+                {"_id": JOB_ID, "$or": [{"status": {"$ne": "running"}}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"status": "running", "owner": self.owner, "lease_until": now + self.lease_seconds}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The upsert collided with the existing document: its lease is held elsewhere
+            return None
+
+    async def _checkpoint(self, fields: dict):
+        await self.cursors.update_one(
+            {"_id": JOB_ID, "owner": self.owner},
+            {"$set": {"lease_until": time.time() + self.lease_seconds, **fields}},
+        )
+
+    async def status(self) -> dict:
+        doc = await self.cursors.find_one({"_id": JOB_ID}, {"_id": 0, "owner": 0}) or {"status": "idle"}
+        doc["eligible"] = await self.leads.count_documents(self.eligible_query(datetime.now(timezone.utc)))
+        return doc
+
+    # ----- sending -----
+
+    async def _send_batch(self, leads: List[dict], bucket: InMemoryBucketStore, stats: dict) -> List[Tuple[dict, dict]]:
+        if self.deliver_batch is not None:
+            return await self._send_chunks(leads, bucket, stats)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(lead: dict) -> Optional[dict]:
+            async with semaphore:
+                while True:
+                    allowed, retry_after = bucket.consume(JOB_ID, self.throttle)
+                    if allowed:
+                        break
+                    stats["throttled_seconds"] += retry_after
+                    await asyncio.sleep(retry_after)
+                try:
+                    return await self.deliver(lead)
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.error(f"Review request for lead {lead['id']} failed: {e}")
+                    return None
+
+        results = await asyncio.gather(*(send_one(lead) for lead in leads))
+        return [(lead, log) for lead, log in zip(leads, results) if log is not None]
+
+    async def _send_chunks(self, leads: List[dict], bucket: InMemoryBucketStore, stats: dict) -> List[Tuple[dict, dict]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # A chunk takes one token per email, so it can't be bigger than the bucket
+        size = max(1, min(self.batch_chunk, self.throttle.capacity))
+        chunks = [leads[i:i + size] for i in range(0, len(leads), size)]
+
+        async def send_chunk(chunk: List[dict]) -> List[Optional[dict]]:
+            async with semaphore:
+                while True:
+                    allowed, retry_after = bucket.consume(JOB_ID, self.throttle, cost=len(chunk))
+                    if allowed:
+                        break
+                    stats["throttled_seconds"] += retry_after
+                    await asyncio.sleep(retry_after)
+                try:
+                    logs = await self.deliver_batch(chunk)
+                except Exception as e:
+                    logger.error(f"Review requests for {len(chunk)} leads from {chunk[0]['id']} failed: {e}")
+                    logs = [None] * len(chunk)
+                stats["failed"] += sum(log is None for log in logs)
+                return logs
+
+        results = await asyncio.gather(*(send_chunk(chunk) for chunk in chunks))
+        return [(lead, log) for chunk, logs in zip(chunks, results) for lead, log in zip(chunk, logs) if log is not None]
+
+    async def run(self) -> Optional[dict]:
+        """One campaign pass over every eligible lead. Returns None if another worker is running it."""
+        started = time.time()
+        cursor = await self._claim(started)
+        if cursor is None:
+            return None
+        position = cursor.get("position")
+        if position:
+            logger.info(f"Resuming review campaign after lead {position['id']}")
+
+        now = datetime.now(timezone.utc)
+        stats = {"sent": 0, "failed": 0, "batches": 0, "throttled_seconds": 0.0}
+        bucket = InMemoryBucketStore()
+        try:
+            while True:
+                leads = await self.leads.find(self.eligible_query(now, position), LEAD_PROJECTION) \
+                    .sort([("completed_at", 1), ("id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+                if not leads:
+                    break
+                sent = await self._send_batch(leads, bucket, stats)
+                if sent:
+                    await self.save([lead for lead, _ in sent], [log for _, log in sent])
+                stats["sent"] += len(sent)
+                stats["batches"] += 1
+                position = {"completed_at": leads[-1]["completed_at"], "id": leads[-1]["id"]}
+                await self._checkpoint({"position": position, "progress": stats})
+        except Exception:
+            # Keep the position so the next run resumes here; release the lease
+            await self._checkpoint({"status": "failed", "lease_until": 0})
+            raise
+
+        elapsed = time.time() - started
+        stats["elapsed_seconds"] = round(elapsed, 3)
+        stats["per_minute"] = round(stats["sent"] / elapsed * 60, 1) if elapsed > 0 else 0.0
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 3)
+        stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+        await self._checkpoint({"status": "idle", "position": None, "progress": None, "last_run": stats, "lease_until": 0})
+        logger.info(f"Review campaign sent {stats['sent']} requests ({stats['failed']} failed) "
+                    f"in {elapsed:.1f}s, {stats['per_minute']}/min")
+        return stats
+
+    async def run_forever(self, interval_seconds: float, run_pass: Optional[Callable[[], Awaitable]] = None):
+        """Run a pass every ``interval_seconds``; ``run_pass`` replaces the default single ``run()``"""
+        while True:
+            try:
+                await (run_pass or self.run)()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Review campaign run failed: {e}")
+            await asyncio.sleep(interval_seconds)
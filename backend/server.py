@@ -1,23 +1,58 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import functools
 import os
 import logging
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Annotated, Callable, Dict, List, Optional, Tuple
 import uuid
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import re
+import numpy as np
+import orjson
+from pymongo import UpdateOne
+
+from analytics import FunnelRollups, funnel_step
+from archive import ColdArchive
+from compression import CompressionMiddleware
+from gazetteer import get_gazetteer
+from lead_search import LeadSearch
+from loop_monitor import LoopMonitor, RouteContextMiddleware
+from outbound import OutboundDispatcher
+from profiling import ProfileStore, ProfilingMiddleware, verify_token
+from providers import (EmailMessage, EmailProvider, HttpPool, MockEmailProvider, MockSmsProvider, ProviderError,
+                       ResendProvider, SendGridProvider, SmsMessage, SmsProvider, TwilioProvider)
+from intent_classifier import IntentClassifier, faq_label
+from rate_limit import MongoBucketStore, RateLimiter, parse_rate
+from records import EmailLogRecord, LeadRecord, check_matches, wire_document
+from review_campaign import ReviewCampaign
+from route_planner import get_centroids, plan as plan_routes
+from storage import open_database
+from tenants import (DEFAULT_TENANT_ID, FileTenantSource, MongoTenantSource, ScopedDatabase, TenantMiddleware,
+                     TenantRegistry, active_tenant, current_tenant)
+from transcripts import TranscriptStore
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Database connection: MongoDB, or STORAGE_BACKEND=memory for an in-process store (tests, benchmarks)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+mongo_url = os.environ.get('MONGO_URL')
+client, db = open_database(STORAGE_BACKEND, mongo_url, os.environ.get('DB_NAME', 'add_power_electrics'))
+
+# Multi-tenant mode (see tenants.py): tenant specs from TENANTS_DIR, or TENANTS_SOURCE=mongo for the
+# tenants collection. Every collection is then scoped to the request's tenant.
+TENANTS_DIR = os.environ.get('TENANTS_DIR', '')
+TENANTS_SOURCE = os.environ.get('TENANTS_SOURCE', 'files' if TENANTS_DIR else '')
+MULTI_TENANT = TENANTS_SOURCE in ('files', 'mongo')
+if MULTI_TENANT:
+    db = ScopedDatabase(db, lambda: active_tenant(tenant_registry).scope)
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -40,6 +75,13 @@ class Lead(BaseModel):
     email_sent: bool = False
     quote_sent: bool = False
     review_requested: bool = False
+    suburb_canonical: Optional[str] = None  # gazetteer name, None if the suburb wasn't recognised
+    postcode: Optional[str] = None
+    phone_e164: Optional[str] = None  # e.g. +61412345678, used to spot repeat enquiries
+    enquiry_count: int = 1
+    enquiries: List[dict] = Field(default_factory=list)  # repeat enquiries merged into this lead
+    completed_at: Optional[str] = None  # set when status becomes "completed"
+    urgency: str = "normal"  # "urgent" for emergencies (no power, sparking, ...) - jumps the outbound queue
 
 class LeadCreate(BaseModel):
     name: str
@@ -58,9 +100,24 @@ class EmailLog(BaseModel):
     sent_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     status: str = "sent"  # In real implementation: "sent", "delivered", "failed"
 
+# Leads and email logs built by the server itself skip validation (see records.py)
+check_matches(Lead, LeadRecord)
+check_matches(EmailLog, EmailLogRecord)
+
+# Fields clients may request via the ?fields= parameter on list endpoints
+LEAD_FIELDS = set(Lead.model_fields)
+EMAIL_LOG_FIELDS = set(EmailLog.model_fields)
+
 class ChatMessage(BaseModel):
-    message: str
-    session_id: str
+    message: str = Field(max_length=2000)
+    session_id: str = Field(min_length=1, max_length=128)
+
+# Most messages the widget may send in one /api/chat/batch request
+CHAT_BATCH_MAX_MESSAGES = int(os.environ.get('CHAT_BATCH_MAX_MESSAGES', '10'))
+
+class ChatBatch(BaseModel):
+    session_id: str = Field(min_length=1, max_length=128)
+    messages: List[Annotated[str, Field(max_length=2000)]] = Field(min_length=1, max_length=CHAT_BATCH_MAX_MESSAGES)
 
 class ChatResponse(BaseModel):
     response: str
@@ -90,6 +147,14 @@ class ConversationState(BaseModel):
     state: str = "greeting"  # greeting, faq, collect_name, collect_phone, collect_suburb, collect_job, completed
     collected_data: dict = Field(default_factory=dict)
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    # Open transcript bucket bookkeeping (the bucket itself is the "transcript" array)
+    transcript_count: int = 0
+    transcript_bytes: int = 0
+    transcript_seq: int = 0
+    transcript_total: int = 0
+    # Funnel analytics: stages this session has entered and the first FAQ it asked
+    funnel_reached: List[str] = Field(default_factory=lambda: ["greeting"])
+    first_faq: Optional[str] = None
 
 # ============== FAQ DATABASE ==============
 
@@ -100,7 +165,11 @@ BUSINESS_INFO = {
     "rating": "5.0 stars (37 reviews)",
     "areas": "Greater Melbourne - all suburbs from CBD to outer areas",
     "hours": "9 AM - 5 PM, Monday to Friday",
-    "emergency": "Yes, we offer emergency electrical services"
+    "emergency": "Yes, we offer emergency electrical services",
+    # Email sign-offs and links
+    "email_signature": "Licensed & Insured | 5.0 Stars (37 Reviews)\nServicing Clyde North & Melbourne's South-East",
+    "review_signature": "5.0 Stars | 37+ Reviews | Greater Melbourne\nLicensed & Insured",
+    "review_link": "https://g.page/r/YOUR-GOOGLE-REVIEW-LINK/review",
 }
 
 # Order matters - more specific patterns first
@@ -155,7 +224,7 @@ FAQ_PATTERNS = [
     
     # License & Insurance
     (["license", "licensed", "insured", "insurance", "qualified", "certified"],
-     "Absolutely! Add Power Electrics is fully licensed and insured. All our work meets Australian electrical standards and we provide certificates of compliance."),
+     "Absolutely! {business_name} is fully licensed and insured. All our work meets Australian electrical standards and we provide certificates of compliance."),
     
     # DIY / How to do it myself questions - SAFETY REDIRECT
     (["how to", "how do i", "how can i", "diy", "myself", "manually", "tutorial", "guide", "steps to", "can i do"],
@@ -195,94 +264,770 @@ def is_valid_name(message: str) -> bool:
 
 # ============== CHATBOT LOGIC ==============
 
-def detect_intent(message: str) -> tuple:
+# Fixed bot replies - shared by detect_intent and the canned response table below.
+# {business_*} placeholders are filled in from the tenant's BUSINESS_INFO (see TenantConfig).
+GREETING_RESPONSE = "G'day! 👋 Welcome to {business_name} - your trusted local sparky in Greater Melbourne with a 5-star rating! How can I help you today? I can answer questions about our services or help you book a job."
+DIY_WARNING_RESPONSE = "⚠️ For your safety, we strongly recommend NOT doing electrical work yourself. In Australia, DIY electrical work is actually illegal and can void your insurance, cause fires, or serious injury.\n\nWe offer affordable rates and can usually come out within 24-48 hours. Want me to grab your details for a free quote?"
+START_LEAD_RESPONSE = "Great! I'd love to help you book a service. Let me grab a few details so we can get back to you quickly. What's your name?"
+NEGATIVE_RESPONSE = "No worries! Is there anything else I can help you with today?"
+OTHER_SERVICE_RESPONSE = "No worries! Just type what electrical work you need and I'll help you out. Or if you'd like, I can grab your details and have someone call you back to discuss."
+EXPLORE_SERVICES_RESPONSE = "We offer a wide range of electrical services! Here are some of our most popular ones - tap to learn more, or type your own question:"
+UNKNOWN_RESPONSE = "I'm here to help with electrical questions! What would you like to know about? Tap a service below or type your question:"
+BOOKING_SUFFIX = "\n\nWould you like to book a job or get a free quote? I can grab your details!"
+
+# Lead capture prompts
+ASK_NAME_RESPONSE = "Great! I'd love to help you book a service. Let me grab a few details so we can get back to you quickly. 👤 What's your name?"
+NAME_RETRY_RESPONSE = "I didn't quite catch that. Could you please tell me your name?"
+ASK_SUBURB_RESPONSE = "Perfect! 📍 What suburb are you located in?"
+SUBURB_RETRY_RESPONSE = "Hmm, I couldn't find that suburb 📍 Did you mean one of these? If it's right as typed, just send it again."
+PHONE_RETRY_RESPONSE = "Hmm, that doesn't look like a valid phone number. Could you please enter your Australian mobile or landline number? (e.g., 0412 345 678)"
+ASK_JOB_RESPONSE = "Great! 🔧 Now, briefly describe the electrical work you need done:"
+LEAD_SAVED_RESPONSE = "Awesome! ✅ Thanks {name}! I've passed your details to the team at {business_name} and sent you a confirmation.\n\n📋 **Your Request:**\n• Name: {name}\n• Phone: {phone}\n• Suburb: {suburb}\n• Job: {job_description}\n\n📧 A confirmation has been sent to you!\n\nWe'll be in touch shortly! Is there anything else I can help with?"
+
+# Reply templates a tenant can override, by name
+DEFAULT_RESPONSES = {
+    "greeting": GREETING_RESPONSE,
+    "diy_warning": DIY_WARNING_RESPONSE,
+    "start_lead": START_LEAD_RESPONSE,
+    "negative": NEGATIVE_RESPONSE,
+    "other_service": OTHER_SERVICE_RESPONSE,
+    "explore_services": EXPLORE_SERVICES_RESPONSE,
+    "unknown": UNKNOWN_RESPONSE,
+    "booking_suffix": BOOKING_SUFFIX,
+    "ask_name": ASK_NAME_RESPONSE,
+    "name_retry": NAME_RETRY_RESPONSE,
+    "ask_suburb": ASK_SUBURB_RESPONSE,
+    "suburb_retry": SUBURB_RETRY_RESPONSE,
+    "phone_retry": PHONE_RETRY_RESPONSE,
+    "ask_job": ASK_JOB_RESPONSE,
+    "lead_saved": LEAD_SAVED_RESPONSE,  # filled per lead: {name} {phone} {suburb} {job_description}
+}
+
+GREETING_WORDS = ["hi", "hello", "hey", "g'day", "gday", "good morning", "good afternoon"]
+DIY_WORDS = ["how to", "how do i", "how can i", "diy", "myself", "manually", "tutorial", "guide", "steps to", "can i do it myself"]
+BOOKING_WORDS = ["book", "appointment", "schedule", "come out", "visit", "call me", "contact", "call back", "callback"]
+YES_WORDS = ["yes", "yeah", "yep", "sure", "ok", "okay", "please", "definitely", "absolutely"]
+NO_WORDS = {"no", "nah", "not", "don't", "nope"}
+OTHER_SERVICE_MESSAGES = {"other", "other services", "something else"}
+EXPLORE_WORDS = ["tell me more", "more info", "what else", "other services", "what do you do", "services"]
+
+def compile_keywords(keywords) -> re.Pattern:
+    """One regex finding any keyword as a substring - same result as any(kw in text ...)"""
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+# Keyword lists compiled once so each check is a single regex scan
+GREETING_RE = compile_keywords(GREETING_WORDS)
+DIY_RE = compile_keywords(DIY_WORDS)
+BOOKING_RE = compile_keywords(BOOKING_WORDS)
+EXPLORE_RE = compile_keywords(EXPLORE_WORDS)
+# Whole message, message starting "yes ..." or ending "... yes"
+_yes = "|".join(re.escape(y) for y in YES_WORDS)
+YES_RE = re.compile(rf"\A(?:{_yes})(?:\Z| )| (?:{_yes})\Z")
+
+# Messages that make a lead urgent. "fire"/"smoke" only count when not part of "fire alarm"/"smoke detector".
+URGENT_WORDS = ["emergency", "urgent", "asap", "no power", "power out", "blackout", "tripping", "sparking",
+                "sparks", "burning", "electric shock", "exposed wire", "live wire"]
+URGENT_RE = re.compile(compile_keywords(URGENT_WORDS).pattern + r"|\bfire\b(?! alarm)|\bsmok(?:e|ing)\b(?! (?:alarm|detector))")
+
+def is_urgent(text: str) -> bool:
+    return bool(URGENT_RE.search(text.lower()))
+
+# Optional trained fallback for messages no keyword matches (see intent_classifier.py)
+INTENT_MODEL_DIR = Path(os.environ.get('INTENT_MODEL_DIR', ROOT_DIR / 'models' / 'intent'))
+INTENT_CLASSIFIER_THRESHOLD = float(os.environ.get('INTENT_CLASSIFIER_THRESHOLD', '0.5'))
+
+def load_intent_classifier() -> Optional[IntentClassifier]:
+    if not (INTENT_MODEL_DIR / "meta.json").exists():
+        logger.info(f"No intent model in {INTENT_MODEL_DIR} - unknown messages get the services menu")
+        return None
+    return IntentClassifier.load(INTENT_MODEL_DIR)
+
+intent_classifier = load_intent_classifier()
+
+def detect_intent(message: str, config: Optional["TenantConfig"] = None) -> tuple:
     """Detect user intent from message and return (intent_type, response)"""
+    config = config or tenant_config()
+    responses = config.responses
     message_lower = message.lower().strip()
     
     # Check for greetings
-    greetings = ["hi", "hello", "hey", "g'day", "gday", "good morning", "good afternoon"]
-    if any(g in message_lower for g in greetings):
-        return ("greeting", f"G'day! 👋 Welcome to Add Power Electrics - your trusted local sparky in Greater Melbourne with a 5-star rating! How can I help you today? I can answer questions about our services or help you book a job.")
+    if GREETING_RE.search(message_lower):
+        return ("greeting", responses["greeting"])
     
     # Check for DIY/how-to questions FIRST (safety concern)
-    diy_patterns = ["how to", "how do i", "how can i", "diy", "myself", "manually", "tutorial", "guide", "steps to", "can i do it myself"]
-    if any(diy in message_lower for diy in diy_patterns):
-        return ("diy_warning", "⚠️ For your safety, we strongly recommend NOT doing electrical work yourself. In Australia, DIY electrical work is actually illegal and can void your insurance, cause fires, or serious injury.\n\nWe offer affordable rates and can usually come out within 24-48 hours. Want me to grab your details for a free quote?")
+    if DIY_RE.search(message_lower):
+        return ("diy_warning", responses["diy_warning"])
     
     # Check for booking/quote intent
-    booking_words = ["book", "appointment", "schedule", "come out", "visit", "call me", "contact", "call back", "callback"]
-    if any(b in message_lower for b in booking_words):
-        return ("start_lead", "Great! I'd love to help you book a service. Let me grab a few details so we can get back to you quickly. What's your name?")
+    if BOOKING_RE.search(message_lower):
+        return ("start_lead", responses["start_lead"])
     
     # Check FAQ patterns (ordered list - more specific first)
-    for keywords, response in FAQ_PATTERNS:
-        if any(kw in message_lower for kw in keywords):
-            return ("faq", response + "\n\nWould you like to book a job or get a free quote? I can grab your details!")
+    for matcher, response in config.faq_matchers:
+        if matcher.search(message_lower):
+            return ("faq", response)
     
     # Check for yes/affirmative responses
-    yes_words = ["yes", "yeah", "yep", "sure", "ok", "okay", "please", "definitely", "absolutely"]
-    if any(y == message_lower or message_lower.startswith(y + " ") or message_lower.endswith(" " + y) for y in yes_words):
+    if YES_RE.search(message_lower):
         return ("affirmative", None)  # Will be handled based on context
     
     # Check for no/negative responses
-    no_words = ["no", "nah", "not", "don't", "nope"]
-    if any(n == message_lower for n in no_words):
-        return ("negative", "No worries! Is there anything else I can help you with today?")
+    if message_lower in NO_WORDS:
+        return ("negative", responses["negative"])
     
     # Check for "Other" - prompt them to specify
-    if message_lower == "other" or message_lower == "other services" or message_lower == "something else":
-        return ("other_service", "No worries! Just type what electrical work you need and I'll help you out. Or if you'd like, I can grab your details and have someone call you back to discuss.")
+    if message_lower in OTHER_SERVICE_MESSAGES:
+        return ("other_service", responses["other_service"])
     
     # Check for "tell me more" or similar exploratory responses
-    explore_words = ["tell me more", "more info", "what else", "other services", "what do you do", "services"]
-    if any(e in message_lower for e in explore_words):
-        return ("explore_services", "We offer a wide range of electrical services! Here are some of our most popular ones - tap to learn more, or type your own question:")
+    if EXPLORE_RE.search(message_lower):
+        return ("explore_services", responses["explore_services"])
+    
+    # Before giving up, ask the trained classifier
+    if intent_classifier is not None:
+        prediction = intent_classifier.predict(message_lower)
+        if prediction and prediction[1] >= INTENT_CLASSIFIER_THRESHOLD and prediction[0] in config.classifier_intents:
+            return config.classifier_intents[prediction[0]]
     
     # Default response
-    return ("unknown", "I'm here to help with electrical questions! What would you like to know about? Tap a service below or type your question:")
+    return ("unknown", responses["unknown"])
+
+# ============== TENANT CONFIG ==============
+
+SAMPLE_LEAD = {"name": "Sam", "phone": "0412 345 678", "suburb": "Berwick", "job_description": "Lighting"}
+
+class TenantConfig:
+    """Replies, FAQ matchers, quick replies, canned responses and email templates for one
+    business, compiled once from its tenant spec (the built-in business for the default tenant)"""
+
+    def __init__(self, spec: dict):
+        business = spec.get("business", {})
+        if spec.get("id", DEFAULT_TENANT_ID) != DEFAULT_TENANT_ID and not {"name", "phone"} <= set(business):
+            raise ValueError("business.name and business.phone are required")
+        self.business = {**BUSINESS_INFO, **business}
+        self.template_vars = {f"business_{key}": value for key, value in self.business.items()}
+        fill = lambda template: template.format_map(self.template_vars)
+
+        overrides = spec.get("responses", {})
+        unknown = sorted(set(overrides) - set(DEFAULT_RESPONSES))
+        if unknown:
+            raise ValueError(f"Unknown responses: {unknown}")
+        templates = {**DEFAULT_RESPONSES, **overrides}
+        self.lead_saved_template = templates.pop("lead_saved")
+        self.responses = {name: fill(template) for name, template in templates.items()}
+        self.render_lead_saved(SAMPLE_LEAD)  # fail now, not mid-conversation, on a bad placeholder
+
+        # FAQ answers with the booking offer appended once, instead of on every match
+        faq = [(entry["keywords"], entry["answer"]) for entry in spec["faq"]] if "faq" in spec else FAQ_PATTERNS
+        self.faq_responses = [(keywords, fill(answer) + self.responses["booking_suffix"]) for keywords, answer in faq]
+        self.faq_matchers = [(compile_keywords(keywords), response) for keywords, response in self.faq_responses]
+        # FAQ reply -> label, to tell which FAQ a detected "faq" intent was
+        self.faq_labels = {response: faq_label(keywords) for keywords, response in self.faq_responses}
+        # Classifier label -> the (intent, response) detect_intent would have returned
+        self.classifier_intents = {faq_label(keywords): ("faq", response) for keywords, response in self.faq_responses}
+        self.classifier_intents["start_lead"] = ("start_lead", self.responses["start_lead"])
+        self.classifier_intents["diy_warning"] = ("diy_warning", self.responses["diy_warning"])
+
+        self.quick_replies = {**QUICK_REPLIES, **spec.get("quick_replies", {})}
+        self.emails = {name: {**template, **spec.get("emails", {}).get(name, {})} for name, template in EMAIL_TEMPLATES.items()}
+        for name in self.emails:
+            self.render_email(name, SAMPLE_LEAD)
+        self.canned = self.build_canned_responses()
+
+    def render_lead_saved(self, data: dict) -> str:
+        return self.lead_saved_template.format_map({**self.template_vars, **data})
+
+    def render_email(self, name: str, lead: dict) -> dict:
+        template = self.emails[name]
+        values = {**self.template_vars, **lead}
+        return {"subject": template["subject"].format_map(values), "body": template["body"].format_map(values)}
+
+    def build_canned_responses(self) -> dict:
+        """Pre-serialize every chat reply that has no per-user interpolation
+
+        Maps (response, quick reply set, action) to the ChatResponse as JSON bytes.
+        """
+        r = self.responses
+        static_replies = [
+            (r["greeting"], "greeting", None),
+            (r["diy_warning"], "diy_warning", None),
+            (r["negative"], "negative", None),
+            (r["other_service"], "other_service", None),
+            (r["explore_services"], "services_menu", None),
+            (r["unknown"], "services_menu", None),
+            (r["ask_name"], "collect_name", "collect_name"),
+            (r["name_retry"], "collect_name", "collect_name"),
+            (r["ask_suburb"], "collect_suburb", "collect_suburb"),
+            (r["phone_retry"], "collect_phone", "collect_phone"),
+            (r["ask_job"], "collect_job", "collect_job"),
+        ] + [(response, "faq_followup", None) for _, response in self.faq_responses]
+
+        canned = {}
+        for response, quick_replies, action in static_replies:
+            chat_response = ChatResponse(response=response, action=action, quick_replies=self.quick_replies[quick_replies])
+            canned[(response, quick_replies, action)] = orjson.dumps(chat_response.model_dump())
+        return canned
+
+def canned_response(response: str, quick_replies: str, action: Optional[str] = None) -> Response:
+    """Return a pre-serialized ChatResponse, skipping model construction and validation"""
+    config = tenant_config()
+    body = config.canned.get((response, quick_replies, action))
+    if body is None:
+        body = orjson.dumps(ChatResponse(response=response, action=action, quick_replies=config.quick_replies[quick_replies]).model_dump())
+    return Response(content=body, media_type="application/json")
 
 async def get_or_create_conversation(session_id: str) -> dict:
     """Get or create a conversation state"""
-    conv = await db.conversations.find_one({"session_id": session_id}, {"_id": 0})
+    # The open transcript bucket is only ever appended to, never read back per turn
+    conv = await db.conversations.find_one({"session_id": session_id}, {"_id": 0, "transcript": 0})
     if not conv:
         conv = ConversationState(session_id=session_id).model_dump()
         await db.conversations.insert_one(conv)
+        if funnel_rollups is not None:
+            await funnel_rollups.record(datetime.now(timezone.utc), None, {"reached.greeting": 1})
     return conv
 
-async def update_conversation(session_id: str, state: str, collected_data: dict):
-    """Update conversation state"""
-    await db.conversations.update_one(
-        {"session_id": session_id},
-        {"$set": {
-            "state": state,
-            "collected_data": collected_data,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+# An unchanged conversation only gets its updated_at refreshed once per this many seconds
+CONVERSATION_TOUCH_INTERVAL = int(os.environ.get('CONVERSATION_TOUCH_INTERVAL', '300'))
+
+conversation_write_stats = {"written": 0, "skipped": 0}
+
+# Chat transcripts, bucketed into the conversation document (see transcripts.py)
+TRANSCRIPTS_ENABLED = os.environ.get('TRANSCRIPTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+transcript_store = TranscriptStore(
+    db.conversations,
+    db.conversation_transcripts,
+    bucket_size=int(os.environ.get('TRANSCRIPT_BUCKET_SIZE', '50')),
+    max_bytes=int(os.environ.get('TRANSCRIPT_BUCKET_MAX_BYTES', str(64 * 1024))),
+    max_messages=int(os.environ.get('TRANSCRIPT_MAX_MESSAGES', '2000')),
+    compression=os.environ.get('TRANSCRIPT_COMPRESSION', ''),
+    # Messages from turns that change nothing wait for the next state write, up to this many / this long
+    buffer_messages=int(os.environ.get('TRANSCRIPT_BUFFER_MESSAGES', '20')),
+    buffer_seconds=float(os.environ.get('TRANSCRIPT_BUFFER_SECONDS', '60')),
+    partition=lambda: active_tenant(tenant_registry).scope,
+) if TRANSCRIPTS_ENABLED else None
+
+def count_conversation_writes(writes: int):
+    """``written`` counts round trips to conversations; ``skipped`` counts saves that needed none"""
+    if writes:
+        conversation_write_stats["written"] += writes
+    else:
+        conversation_write_stats["skipped"] += 1
+
+def count_flushed_transcripts(writes: int):
+    conversation_write_stats["written"] += writes
+
+# Hourly funnel rollups, $inc'd on every state change (see analytics.py)
+FUNNEL_ANALYTICS_ENABLED = os.environ.get('FUNNEL_ANALYTICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANALYTICS_TIMEZONE = os.environ.get('ANALYTICS_TIMEZONE', 'Australia/Melbourne')
+funnel_rollups = FunnelRollups(db.funnel_rollups) if FUNNEL_ANALYTICS_ENABLED else None
+
+def _touch_due(updated_at: Optional[str], now: datetime) -> bool:
+    """Whether an unchanged conversation's updated_at is stale enough to rewrite"""
+    if not updated_at:
+        return True
+    try:
+        last = datetime.fromisoformat(updated_at)
+    except ValueError:
+        return True
+    return (now - last).total_seconds() >= CONVERSATION_TOUCH_INTERVAL
+
+def conversation_changes(state: str, collected_data: dict, current: Optional[dict], turn: Optional[dict],
+                         now: datetime) -> Tuple[dict, Optional[tuple]]:
+    """The fields to $set for this state (empty if unchanged and not due a touch), and the
+    funnel rollup step (at, first_faq, increments) when the state changes"""
+    fields = {
+        "state": state,
+        "collected_data": collected_data,
+        "updated_at": now.isoformat()
+    }
+    funnel = None
+    if current is not None and current.get("state") == state and current.get("collected_data", {}) == collected_data:
+        if not _touch_due(current.get("updated_at"), now):
+            fields = {}
+    elif funnel_rollups is not None and current is not None and current.get("state", "greeting") != state:
+        first_faq = current.get("first_faq") or (turn or {}).get("faq")
+        increments, reached = funnel_step(current.get("state", "greeting"), state, current.get("funnel_reached", []))
+        fields.update(funnel_reached=reached, first_faq=first_faq)
+        funnel = (now, first_faq, increments)
+    return fields, funnel
+
+async def update_conversation(session_id: str, state: str, collected_data: dict, current: Optional[dict] = None,
+                              turn: Optional[dict] = None) -> bool:
+    """Update conversation state
+
+    When ``current`` (the loaded conversation) already has this state and data the write is
+    skipped, apart from an occasional updated_at touch. ``turn`` is this message's transcript
+    entry, appended in the same update. Returns whether the state was written.
+    """
+    now = datetime.now(timezone.utc)
+    fields, funnel = conversation_changes(state, collected_data, current, turn, now)
+    if funnel is not None:
+        await funnel_rollups.record(*funnel)
+
+    writes = 0
+    if turn is not None:
+        turn["state"] = state
+    if turn is not None and transcript_store is not None:
+        writes = await transcript_store.save(session_id, fields, turn, current or {})
+    elif fields:
+        await db.conversations.update_one({"session_id": session_id}, {"$set": fields})
+        writes = 1
+    count_conversation_writes(writes)
+    return bool(fields)
+
+class ConversationBatch:
+    """Several turns of one conversation applied in memory, then saved in one write
+
+    ``current`` is kept as each turn would have loaded it from the database, so the state
+    machine and the dirty check see exactly what separate requests would have seen.
+    """
+
+    def __init__(self, session_id: str, conv: dict):
+        self.session_id = session_id
+        self.loaded = conv
+        self.current = dict(conv)
+        self.fields: dict = {}
+        self.turns: List[dict] = []
+        self.funnel: List[tuple] = []
+
+    async def update(self, state: str, collected_data: dict, turn: Optional[dict] = None) -> bool:
+        """update_conversation for the next turn, without the write"""
+        fields, funnel = conversation_changes(state, collected_data, self.current, turn, datetime.now(timezone.utc))
+        if funnel is not None:
+            self.funnel.append(funnel)
+        self.fields.update(fields)
+        self.current.update(fields)
+        if turn is not None:
+            turn["state"] = state
+            self.turns.append(turn)
+        return bool(fields)
+
+    async def persist(self):
+        if self.funnel:
+            await funnel_rollups.record_many(self.funnel)
+        writes = 0
+        if self.turns and transcript_store is not None:
+            writes = await transcript_store.save_many(self.session_id, self.fields, self.turns, self.loaded)
+        elif self.fields:
+            await db.conversations.update_one({"session_id": self.session_id}, {"$set": self.fields})
+            writes = 1
+        count_conversation_writes(writes)
+
+PHONE_SEPARATORS_RE = re.compile(r'[\s\-\(\)]')
+# Optional +61/61/0 prefix, then a 9-digit number (mobile 4xxxxxxxx or area code + 8 digits)
+# or an 8-digit local landline without its area code
+AU_PHONE_RE = re.compile(r'^(?:\+?61|0)?([2-9]\d{7,8})$')
+
+# Area code assumed for 8-digit local landlines (3 = Victoria/Tasmania)
+DEFAULT_AREA_CODE = os.environ.get('DEFAULT_AREA_CODE', '3')
+
+def normalize_phone(phone: str) -> Optional[str]:
+    """Normalize an Australian phone number to E.164 (+61...), or None if invalid"""
+    match = AU_PHONE_RE.match(PHONE_SEPARATORS_RE.sub('', phone))
+    if not match:
+        return None
+    number = match.group(1)
+    if len(number) == 8:
+        number = DEFAULT_AREA_CODE + number
+    return "+61" + number
 
 def validate_phone(phone: str) -> bool:
     """Validate Australian phone number"""
-    cleaned = re.sub(r'[\s\-\(\)]', '', phone)
-    return bool(re.match(r'^(\+?61|0)?4\d{8}$', cleaned) or re.match(r'^(\+?61|0)?[2-9]\d{7,8}$', cleaned))
+    return normalize_phone(phone) is not None
+
+def canonical_suburb_fields(suburb: str) -> dict:
+    """Canonical suburb name and postcode for free-text suburb input"""
+    match = get_gazetteer().lookup(suburb)
+    if not match:
+        return {}
+    return {"suburb_canonical": match.name, "postcode": match.postcode}
+
+def build_projection(fields: Optional[str], allowed: set) -> Optional[dict]:
+    """Turn a comma-separated ?fields= parameter into a Mongo projection"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(requested) - allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}. Must be from: {sorted(allowed)}")
+    projection = {f: 1 for f in requested}
+    projection["_id"] = 0
+    return projection
+
+# ============== RATE LIMITING ==============
+
+# Per-route limits as "requests/seconds" for each key scope; "0" disables a scope
+RATE_LIMITS = {
+    "chat": {
+        "ip": parse_rate(os.environ.get('RATE_LIMIT_CHAT_IP', '60/60')),
+        "session": parse_rate(os.environ.get('RATE_LIMIT_CHAT_SESSION', '20/60')),
+    },
+}
+
+# Trust X-Forwarded-For only when running behind proxies that append to it; clients can send any
+# value, so the client address is the entry TRUSTED_PROXY_HOPS from the right (one per proxy)
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+TRUSTED_PROXY_HOPS = max(1, int(os.environ.get('TRUSTED_PROXY_HOPS', '1')))
+
+rate_limiter = RateLimiter(
+    RATE_LIMITS,
+    shared_store=MongoBucketStore(db.rate_limits) if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo' else None,
+)
+
+def client_ip(request: Request) -> str:
+    """Best guess at the caller's IP address"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+        if forwarded:
+            # Entries left of the ones our proxies appended were sent by the client
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(request: Request, route: str, cost: int = 1, **keys: str):
+    """Reject the request with 429 if the client IP (or any other key) is over its limit"""
+    retry_after = await rate_limiter.check(route, cost=cost, ip=client_ip(request), **keys)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many messages - please wait a moment and try again.",
+            headers={"Retry-After": str(max(1, round(retry_after)))},
+        )
+
+# ============== CONDITIONAL GET ==============
+
+# Seconds browsers may reuse a dashboard response before revalidating (0 = always revalidate)
+DASHBOARD_CACHE_MAX_AGE = int(os.environ.get('DASHBOARD_CACHE_MAX_AGE', '0'))
+
+async def bump_collection_version(name: str):
+    """Record that a collection changed so cached ETags become stale"""
+    await db.collection_versions.update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_collection_version(name: str) -> int:
+    """Get the change counter for a collection (a single tiny document read)"""
+    doc = await db.collection_versions.find_one({"_id": name})
+    return doc["version"] if doc else 0
+
+def make_etag(*parts) -> str:
+    """Build a weak ETag from version parts"""
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison of If-None-Match against the current ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in header.split(","))
+
+def cache_headers(etag: str) -> dict:
+    """ETag plus Cache-Control telling browsers to revalidate with If-None-Match"""
+    if DASHBOARD_CACHE_MAX_AGE > 0:
+        cache_control = f"private, max-age={DASHBOARD_CACHE_MAX_AGE}, must-revalidate"
+    else:
+        cache_control = "private, no-cache"
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+# ============== COLD ARCHIVE ==============
+
+# Completed leads older than ARCHIVE_AFTER_DAYS move, with their email logs, to compressed files
+# under ARCHIVE_DIR (see archive.py); lookups by id and lead search read through to them.
+# The archive is the only copy of those leads, so there is no default: unset disables archiving,
+# and it must be durable storage every worker shares.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '')
+# Automatic runs every N hours; 0 leaves archiving to POST /api/archive/run
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', '0'))
+
+async def leads_archived(lead_ids: List[str]):
+    """Archived leads have left the hot collection: drop them from the search index and caches"""
+    for lead_id in lead_ids:
+        lead_search.on_deleted(lead_id)
+    await bump_collection_version("leads")
+
+cold_archive = ColdArchive(
+    Path(ARCHIVE_DIR),
+    db.leads,
+    db.email_logs,
+    db.job_cursors,
+    scope=lambda: active_tenant(tenant_registry).scope,
+    after=timedelta(days=float(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))),
+    batch_size=int(os.environ.get('ARCHIVE_BATCH_SIZE', '500')),
+    on_moved=leads_archived,
+) if ARCHIVE_DIR else None
+
+async def find_lead(lead_id: str) -> Optional[dict]:
+    """A lead from the hot collection, or read-only from the archive if it has been moved there"""
+    lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
+    if lead is None and cold_archive is not None:
+        lead = await cold_archive.find_lead(lead_id)
+    return lead
+
+# ============== LEAD SEARCH ==============
+
+# "auto" uses the Mongo text index and falls back to an in-process index; "mongo"/"memory" force one
+lead_search = LeadSearch(
+    db.leads,
+    backend=os.environ.get('LEAD_SEARCH_BACKEND', 'auto'),
+    partition=lambda: active_tenant(tenant_registry).scope,  # one in-process index per tenant
+    archive=cold_archive,  # archived matches follow the hot ones
+)
+
+# ============== OUTBOUND ==============
+
+# Email/SMS sending goes through priority lanes (see outbound.py); reserved workers only serve urgent jobs
+outbound = OutboundDispatcher(
+    workers=int(os.environ.get('OUTBOUND_WORKERS', '4')),
+    reserved_urgent=int(os.environ.get('OUTBOUND_URGENT_WORKERS', '1')),
+)
+# At shutdown, queued and running sends get this long to finish before they are dropped
+OUTBOUND_DRAIN_SECONDS = float(os.environ.get('OUTBOUND_DRAIN_SECONDS', '10'))
+
+def outbound_lane(lead: dict) -> str:
+    return "urgent" if lead.get("urgency") == "urgent" else "normal"
+
+# ============== PROVIDERS ==============
+
+# One pooled HTTP client shared by every email/SMS provider (see providers.py), opened at startup
+http_pool = HttpPool(
+    http2=os.environ.get('HTTP_POOL_HTTP2', 'true').lower() in ('1', 'true', 'yes'),
+    max_connections=int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', '100')),
+    max_keepalive=int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', '20')),
+    per_host=int(os.environ.get('HTTP_POOL_PER_HOST', '10')),
+    timeout=float(os.environ.get('HTTP_POOL_TIMEOUT_SECONDS', '10')),
+    connect_timeout=float(os.environ.get('HTTP_POOL_CONNECT_TIMEOUT_SECONDS', '5')),
+    failure_threshold=int(os.environ.get('PROVIDER_FAILURE_THRESHOLD', '5')),
+    reset_seconds=float(os.environ.get('PROVIDER_RESET_SECONDS', '30')),
+)
+
+# EMAIL_PROVIDER=mock|sendgrid|resend and SMS_PROVIDER=mock|twilio; the *_BASE_URL settings can
+# point a provider at provider_stub.py
+EMAIL_FROM = os.environ.get('EMAIL_FROM', '')
+EMAIL_FROM_NAME = os.environ.get('EMAIL_FROM_NAME', BUSINESS_INFO['name'])
+# Number new-lead SMS alerts go to; defaults to the tenant's business phone
+SMS_ALERT_TO = os.environ.get('SMS_ALERT_TO', '')
+
+def make_email_provider(name: str) -> EmailProvider:
+    if name == "sendgrid":
+        return SendGridProvider(http_pool, os.environ['SENDGRID_API_KEY'], EMAIL_FROM, EMAIL_FROM_NAME,
+                                base_url=os.environ.get('SENDGRID_BASE_URL', SendGridProvider.BASE_URL))
+    if name == "resend":
+        return ResendProvider(http_pool, os.environ['RESEND_API_KEY'], EMAIL_FROM, EMAIL_FROM_NAME,
+                              base_url=os.environ.get('RESEND_BASE_URL', ResendProvider.BASE_URL))
+    if name == "mock":
+        return MockEmailProvider()
+    raise ValueError(f"Unknown EMAIL_PROVIDER {name!r}")
+
+def make_sms_provider(name: str) -> SmsProvider:
+    if name == "twilio":
+        return TwilioProvider(http_pool, os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'],
+                              os.environ['TWILIO_FROM_NUMBER'],
+                              base_url=os.environ.get('TWILIO_BASE_URL', TwilioProvider.BASE_URL))
+    if name == "mock":
+        return MockSmsProvider()
+    raise ValueError(f"Unknown SMS_PROVIDER {name!r}")
+
+email_provider = make_email_provider(os.environ.get('EMAIL_PROVIDER', 'mock'))
+sms_provider = make_sms_provider(os.environ.get('SMS_PROVIDER', 'mock'))
+
+# ============== LEAD CAPTURE ==============
+
+# Repeat enquiries from the same phone within this many days merge into the open lead (0 = off)
+LEAD_DEDUP_WINDOW_DAYS = int(os.environ.get('LEAD_DEDUP_WINDOW_DAYS', '30'))
+# Gazetteer suggestions offered when the suburb typed isn't recognised
+SUBURB_SUGGESTIONS = 4
+
+# Lead fields captured only after leads were already being saved: field -> the fields to $set on
+# an older lead missing it (the field itself defaults to None, so every lead read gets it)
+LEAD_BACKFILLS: Dict[str, Callable[[dict], dict]] = {
+    # Without these older leads can't be placed by the route planner
+    "suburb_canonical": lambda lead: {"postcode": None, **canonical_suburb_fields(lead.get("suburb") or "")},
+    # ... and without this they are missed by repeat-enquiry merging
+    "phone_e164": lambda lead: {"phone_e164": normalize_phone(lead.get("phone") or "")},
+}
+
+async def backfill_leads(field: str, fill: Callable[[dict], dict], batch_size: int = 500) -> int:
+    """Set ``field`` (and whatever else ``fill`` returns) on every lead missing it; returns how many"""
+    updated = 0
+    while True:
+        leads = await db.leads.find({field: {"$exists": False}}).limit(batch_size).to_list(batch_size)
+        if not leads:
+            break
+        await db.leads.bulk_write([UpdateOne({"_id": lead["_id"]}, {"$set": {field: None, **fill(lead)}})
+                                   for lead in leads], ordered=False)
+        updated += len(leads)
+    if updated:
+        await bump_collection_version("leads")
+        logger.info(f"Backfilled {field} on {updated} older leads")
+    return updated
+
+async def backfill_lead_fields(batch_size: int = 500) -> Dict[str, int]:
+    """Run each of LEAD_BACKFILLS that job_cursors doesn't record as done; returns leads updated per field
+
+    The $exists queries have no index, so a finished backfill is recorded rather than
+    re-scanning the leads at every startup.
+    """
+    updated = {}
+    for field, fill in LEAD_BACKFILLS.items():
+        job_id = f"backfill:{field}"
+        if await db.job_cursors.find_one({"_id": job_id, "status": "done"}, {"_id": 1}):
+            continue
+        updated[field] = await backfill_leads(field, fill, batch_size)
+        await db.job_cursors.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "done", "updated": updated[field], "finished_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True,
+        )
+    return updated
+
+async def find_open_lead_by_phone(phone_e164: Optional[str]) -> Optional[dict]:
+    """Most recent not-yet-completed lead for this phone inside the dedup window"""
+    if not phone_e164 or LEAD_DEDUP_WINDOW_DAYS <= 0:
+        return None
+    since = (datetime.now(timezone.utc) - timedelta(days=LEAD_DEDUP_WINDOW_DAYS)).isoformat()
+    return await db.leads.find_one(
+        {"phone_e164": phone_e164, "created_at": {"$gte": since}, "status": {"$ne": "completed"}},
+        {"_id": 0},
+        sort=[("created_at", -1)],
+    )
+
+async def capture_lead(collected_data: dict) -> tuple:
+    """Save a lead from the chat flow and return (lead_dict, enquiry)
+
+    A repeat enquiry is appended to the customer's open lead instead of creating a new
+    lead, so no second confirmation email goes out; an urgent one still texts the team.
+    ``enquiry`` is the entry appended (with its own id), or None when a new lead was saved.
+    """
+    urgency = "urgent" if collected_data.get("urgent") or is_urgent(collected_data.get("job_description", "")) else "normal"
+    existing = await find_open_lead_by_phone(collected_data.get("phone_e164"))
+    if existing:
+        enquiry = {
+            "id": str(uuid.uuid4()),
+            "name": collected_data.get("name", ""),
+            "job_description": collected_data.get("job_description", ""),
+            "suburb": collected_data.get("suburb", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        update = {"$push": {"enquiries": enquiry}, "$inc": {"enquiry_count": 1}}
+        if urgency == "urgent":
+            # An emergency escalates the open lead; a routine follow-up never downgrades it
+            update["$set"] = {"urgency": "urgent"}
+            existing["urgency"] = "urgent"
+        await db.leads.update_one({"id": existing["id"]}, update)
+        await bump_collection_version("leads")
+        lead_search.on_saved({**existing, "enquiries": existing.get("enquiries", []) + [enquiry]})
+        logger.info(f"Repeat enquiry from {existing['phone_e164']} merged into lead {existing['id']}")
+        if urgency == "urgent":
+            # Still no second confirmation email, but the team is texted about the emergency
+            await outbound.submit("urgent", send_sms, {**existing, "job_description": enquiry["job_description"]})
+        return existing, enquiry
+
+    lead_dict = LeadRecord(
+        name=collected_data.get("name", ""),
+        phone=collected_data.get("phone", ""),
+        suburb=collected_data.get("suburb", ""),
+        job_description=collected_data.get("job_description", ""),
+        suburb_canonical=collected_data.get("suburb_canonical"),
+        postcode=collected_data.get("postcode"),
+        phone_e164=collected_data.get("phone_e164"),
+        urgency=urgency
+    ).to_dict()
+    await db.leads.insert_one(lead_dict.copy())  # Use copy to avoid _id mutation
+    await bump_collection_version("leads")
+    lead_search.on_saved(lead_dict)
+    
+    # Auto-send confirmation email; urgent leads also text the team straight away
+    lane = outbound_lane(lead_dict)
+    await outbound.submit(lane, send_confirmation_email, lead_dict)
+    if lane == "urgent":
+        await outbound.submit(lane, send_sms, lead_dict)
+    return lead_dict, None
 
 # ============== API ROUTES ==============
 
 @api_router.get("/")
 async def root():
-    return {"message": "Add Power Electrics Chatbot API", "status": "online"}
+    return {"message": f"{tenant_config().business['name']} Chatbot API", "status": "online"}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Internal counters for monitoring"""
+    return {
+        "rate_limits": rate_limiter.stats(),
+        "conversation_writes": dict(conversation_write_stats),
+        "transcripts": transcript_store.stats() if transcript_store is not None else None,
+        "outbound": outbound.stats(),
+        "event_loop": loop_monitor.stats() if loop_monitor is not None else None,
+        "tenants": {"count": len(tenant_registry.all()), **tenant_registry.stats} if MULTI_TENANT else None,
+        "providers": {"http": http_pool.stats(), "email": email_provider.stats(), "sms": sms_provider.stats()},
+    }
 
 @api_router.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage):
+async def chat(chat_message: ChatMessage, request: Request):
     """Process chat message and return response"""
-    session_id = chat_message.session_id
-    message = chat_message.message.strip()
-    
+    # Rejected before any database access
+    await enforce_rate_limit(request, "chat", session=chat_message.session_id)
+    return await process_chat_message(chat_message.session_id, chat_message.message)
+
+@api_router.post("/chat/batch", response_model=List[ChatResponse])
+async def chat_batch(batch: ChatBatch, request: Request):
+    """Process messages queued by the widget, in order, with one conversation load and save"""
+    await enforce_rate_limit(request, "chat", cost=len(batch.messages), session=batch.session_id)
+    replies = await process_chat_batch(batch.session_id, batch.messages)
+    return Response(content=b"[" + b",".join(map(reply_json, replies)) + b"]", media_type="application/json")
+
+def reply_json(reply) -> bytes:
+    """A turn's reply as JSON (canned replies are already serialized)"""
+    if isinstance(reply, Response):
+        return reply.body
+    # A message the state machine doesn't handle in the current state gets no reply
+    return orjson.dumps(reply.model_dump() if reply is not None else None)
+
+async def process_chat_message(session_id: str, message: str):
+    """Run one turn of the chat state machine (shared by the API and transcript replay)"""
     # Get conversation state
     conv = await get_or_create_conversation(session_id)
+    return await chat_turn(message, conv, functools.partial(update_conversation, session_id, current=conv))
+
+async def process_chat_batch(session_id: str, messages: List[str]) -> list:
+    """Run several turns in order; the same replies as separate messages, saved once"""
+    batch = ConversationBatch(session_id, await get_or_create_conversation(session_id))
+    replies = [await chat_turn(message, batch.current, batch.update) for message in messages]
+    await batch.persist()
+    return replies
+
+async def chat_turn(message: str, conv: dict, save):
+    """One turn against the loaded ``conv``; ``save(state, collected_data, turn=...)`` stores the outcome"""
+    message = message.strip()
+    turn = {"at": datetime.now(timezone.utc).isoformat(), "message": message}
+    reply = await run_chat_turn(message, conv, turn, functools.partial(save, turn=turn))
+    if transcript_store is not None and "state" not in turn:
+        # Replies that leave the state alone still record the message (held back until the next write)
+        await save(conv.get("state", "greeting"), conv.get("collected_data", {}), turn=turn)
+    return reply
+
+# The lead fields echoed back to the widget once a lead is saved
+CHAT_LEAD_FIELDS = ("id", "name", "phone", "suburb", "job_description", "status", "created_at")
+
+async def run_chat_turn(message: str, conv: dict, turn: dict, save):
     state = conv.get("state", "greeting")
-    collected_data = conv.get("collected_data", {})
-    
-    intent, intent_response = detect_intent(message)
+    # Copy so the loaded document stays intact for the dirty check when saving
+    collected_data = dict(conv.get("collected_data", {}))
+    if is_urgent(message):
+        collected_data["urgent"] = True
+    # Data carried into the next lead capture when the conversation moves between intents
+    carried_data = {"urgent": True} if collected_data.get("urgent") else {}
+    
+    config = tenant_config()
+    responses = config.responses
+    intent, intent_response = detect_intent(message, config)
+    turn["intent"] = intent
+    if intent == "faq":
+        turn["faq"] = config.faq_labels.get(intent_response)
     
     # IMPORTANT: During lead collection, check if user is asking a question instead of answering
     if state in ["collect_name", "collect_phone", "collect_suburb", "collect_job"]:
@@ -306,13 +1051,9 @@ async def chat(chat_message: ChatMessage):
     if state == "collect_name":
         # Validate it looks like a name
         if not is_valid_name(message):
-            return ChatResponse(
-                response="I didn't quite catch that. Could you please tell me your name?",
-                action="collect_name",
-                quick_replies=[]
-            )
+            return canned_response(responses["name_retry"], "collect_name", action="collect_name")
         collected_data["name"] = message
-        await update_conversation(session_id, "collect_phone", collected_data)
+        await save("collect_phone", collected_data)
         return ChatResponse(
             response=f"Thanks {message}! 📱 What's the best phone number to reach you on?",
             action="collect_phone",
@@ -320,112 +1061,176 @@ async def chat(chat_message: ChatMessage):
         )
     
     elif state == "collect_phone":
-        if validate_phone(message):
+        phone_e164 = normalize_phone(message)
+        if phone_e164:
             collected_data["phone"] = message
-            await update_conversation(session_id, "collect_suburb", collected_data)
-            return ChatResponse(
-                response="Perfect! 📍 What suburb are you located in?",
-                action="collect_suburb",
-                quick_replies=QUICK_REPLIES["collect_suburb"]
-            )
+            collected_data["phone_e164"] = phone_e164
+            await save("collect_suburb", collected_data)
+            return canned_response(responses["ask_suburb"], "collect_suburb", action="collect_suburb")
         else:
-            return ChatResponse(
-                response="Hmm, that doesn't look like a valid phone number. Could you please enter your Australian mobile or landline number? (e.g., 0412 345 678)",
-                action="collect_phone",
-                quick_replies=[]
-            )
+            return canned_response(responses["phone_retry"], "collect_phone", action="collect_phone")
     
     elif state == "collect_suburb":
+        suburb_fields = canonical_suburb_fields(message)
+        if not suburb_fields and "suburb_unmatched" not in collected_data:
+            # Offer the gazetteer's nearest suburbs once; whatever comes next is kept, even if unrecognised
+            collected_data["suburb_unmatched"] = message
+            await save("collect_suburb", collected_data)
+            suggestions = [suburb.name for suburb in get_gazetteer().suggest(message, SUBURB_SUGGESTIONS)]
+            return ChatResponse(response=responses["suburb_retry"], action="collect_suburb",
+                                quick_replies=suggestions + [message])
+        collected_data.pop("suburb_unmatched", None)
         collected_data["suburb"] = message
-        await update_conversation(session_id, "collect_job", collected_data)
-        return ChatResponse(
-            response="Great! 🔧 Now, briefly describe the electrical work you need done:",
-            action="collect_job",
-            quick_replies=QUICK_REPLIES["collect_job"]
-        )
+        collected_data.update(suburb_fields)
+        await save("collect_job", collected_data)
+        return canned_response(responses["ask_job"], "collect_job", action="collect_job")
     
     elif state == "collect_job":
         collected_data["job_description"] = message
         
-        # Save the lead
-        lead = Lead(
-            name=collected_data.get("name", ""),
-            phone=collected_data.get("phone", ""),
-            suburb=collected_data.get("suburb", ""),
-            job_description=collected_data.get("job_description", "")
-        )
-        lead_dict = lead.model_dump()
-        await db.leads.insert_one(lead_dict.copy())  # Use copy to avoid _id mutation
-        
-        # Auto-send confirmation email
-        await send_confirmation_email(lead_dict)
+        lead_dict, enquiry = await capture_lead(collected_data)
         
         # Reset conversation
-        await update_conversation(session_id, "completed", {})
+        await save("completed", {})
         
+        if enquiry is not None:
+            # Whoever first gave this number owns the open lead: the reply reads exactly like a
+            # new lead's, so it neither confirms the match nor gives out the stored lead's id
+            lead_dict = {**collected_data, "id": enquiry["id"], "status": "new", "created_at": enquiry["created_at"]}
         # Return clean lead data without potential _id
-        clean_lead_data = {
-            "id": lead_dict["id"],
-            "name": lead_dict["name"],
-            "phone": lead_dict["phone"],
-            "suburb": lead_dict["suburb"],
-            "job_description": lead_dict["job_description"],
-            "status": lead_dict["status"],
-            "created_at": lead_dict["created_at"]
-        }
-        
+        clean_lead_data = {field: lead_dict.get(field, "") for field in CHAT_LEAD_FIELDS}
         return ChatResponse(
-            response=f"Awesome! ✅ Thanks {collected_data.get('name', '')}! I've passed your details to the team at Add Power Electrics and sent you a confirmation.\n\n📋 **Your Request:**\n• Name: {collected_data.get('name')}\n• Phone: {collected_data.get('phone')}\n• Suburb: {collected_data.get('suburb')}\n• Job: {collected_data.get('job_description')}\n\n📧 A confirmation has been sent to you!\n\nWe'll be in touch shortly! Is there anything else I can help with?",
+            response=config.render_lead_saved({
+                "name": collected_data.get('name', ''),
+                "phone": collected_data.get('phone'),
+                "suburb": collected_data.get('suburb'),
+                "job_description": collected_data.get('job_description'),
+            }),
             action="lead_saved",
             lead_data=clean_lead_data,
-            quick_replies=QUICK_REPLIES["lead_saved"]
+            quick_replies=config.quick_replies["lead_saved"]
         )
     
     # Handle intents based on current state
     if intent == "greeting":
-        await update_conversation(session_id, "greeting", {})
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["greeting"])
+        await save("greeting", carried_data)
+        return canned_response(intent_response, "greeting")
     
     elif intent == "diy_warning":
-        await update_conversation(session_id, "faq", {})
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["diy_warning"])
+        await save("faq", carried_data)
+        return canned_response(intent_response, "diy_warning")
     
     elif intent == "start_lead" or (intent == "affirmative" and state in ["greeting", "faq", "completed", "diy_warning"]):
-        await update_conversation(session_id, "collect_name", {})
-        return ChatResponse(
-            response="Great! I'd love to help you book a service. Let me grab a few details so we can get back to you quickly. 👤 What's your name?",
-            action="collect_name",
-            quick_replies=[]
-        )
+        await save("collect_name", carried_data)
+        return canned_response(responses["ask_name"], "collect_name", action="collect_name")
     
     elif intent == "faq":
-        await update_conversation(session_id, "faq", {})
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["faq_followup"])
+        await save("faq", carried_data)
+        return canned_response(intent_response, "faq_followup")
     
     elif intent == "negative":
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["negative"])
+        return canned_response(intent_response, "negative")
     
     elif intent == "other_service":
-        await update_conversation(session_id, "other", {})
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["other_service"])
+        await save("other", carried_data)
+        return canned_response(intent_response, "other_service")
     
     elif intent == "explore_services" or intent == "unknown":
-        await update_conversation(session_id, "exploring", {})
-        return ChatResponse(response=intent_response, quick_replies=QUICK_REPLIES["services_menu"])
+        await save("exploring", carried_data)
+        return canned_response(intent_response, "services_menu")
+
+@api_router.get("/conversations/{session_id}/transcript")
+async def get_transcript(session_id: str):
+    """Every recorded message of a chat session, oldest first"""
+    if transcript_store is None:
+        raise HTTPException(status_code=404, detail="Transcripts are disabled")
+    messages = await transcript_store.load(session_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="No transcript for this session")
+    return {"session_id": session_id, "messages": messages}
+
+# ============== PROFILING ==============
+
+# Off unless a secret (signed X-Profile header) or a sampling rate is configured
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET', '')
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+profile_store = ProfileStore(
+    Path(os.environ.get('PROFILING_DIR', str(ROOT_DIR / 'profiles'))),
+    keep=int(os.environ.get('PROFILING_KEEP', '200')),
+)
+
+def require_profiling_admin(request: Request):
+    token = request.headers.get("X-Profile-Admin", "")
+    if not PROFILING_SECRET or not verify_token(PROFILING_SECRET, "admin", token):
+        raise HTTPException(status_code=403, detail="Profiling admin token required")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(request: Request, limit: int = 100):
+    """Most recent request profiles, newest first"""
+    require_profiling_admin(request)
+    return {"profiles": await asyncio.to_thread(profile_store.list, min(max(limit, 1), 1000))}
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, request: Request):
+    """One profile as a pstats file"""
+    require_profiling_admin(request)
+    path = profile_store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
 
 @api_router.post("/leads", response_model=Lead)
 async def create_lead(lead_data: LeadCreate):
     """Manually create a lead"""
-    lead = Lead(**lead_data.model_dump())
-    lead_dict = lead.model_dump()
-    await db.leads.insert_one(lead_dict)
-    return lead
+    lead_dict = LeadRecord(
+        **lead_data.model_dump(),
+        **canonical_suburb_fields(lead_data.suburb),
+        phone_e164=normalize_phone(lead_data.phone),
+        urgency="urgent" if is_urgent(lead_data.job_description) else "normal"
+    ).to_dict()
+    await db.leads.insert_one(lead_dict.copy())
+    await bump_collection_version("leads")
+    lead_search.on_saved(lead_dict)
+    return ORJSONResponse(lead_dict)
 
 @api_router.get("/leads", response_model=List[Lead])
-async def get_leads():
-    """Get all leads"""
-    leads = await db.leads.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return leads
+async def get_leads(request: Request, fields: Optional[str] = None, lean: bool = False, suburb: Optional[str] = None):
+    """Get all leads, optionally only those in one suburb
+
+    Pass ``lean=true`` or ``fields=id,name,...`` to serialize the stored documents as they
+    are; otherwise each is given the Lead shape (defaults filled in, extra keys dropped).
+    """
+    projection = build_projection(fields, LEAD_FIELDS)
+    query = {}
+    if suburb:
+        # Misspelt/abbreviated filters resolve to the same indexed canonical name
+        query = {"suburb_canonical": canonical_suburb_fields(suburb).get("suburb_canonical", suburb)}
+    etag = make_etag("leads", await get_collection_version("leads"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    leads = await db.leads.find(query, projection or {"_id": 0}).sort("created_at", -1).to_list(1000)
+    if not (lean or projection):
+        leads = [wire_document(LeadRecord, lead) for lead in leads]
+    return ORJSONResponse(leads, headers=cache_headers(etag))
+
+@api_router.get("/leads/search")
+async def search_leads(q: str, page: int = 1, page_size: int = 20,
+                       created_from: Optional[str] = None, created_to: Optional[str] = None):
+    """Ranked full-text search over lead name, suburb and job description
+
+    ``created_from``/``created_to`` are ISO dates (e.g. 2026-03-01) bounding created_at.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    if created_to and len(created_to) == 10:
+        created_to += "T23:59:59.999999+00:00"  # make a bare date inclusive
+    total, results = await lead_search.search(
+        q, (page - 1) * page_size, page_size, created_from=created_from, created_to=created_to
+    )
+    return {"query": q, "total": total, "page": page, "page_size": page_size, "results": results}
 
 @api_router.patch("/leads/{lead_id}/status")
 async def update_lead_status(lead_id: str, status: str):
@@ -434,12 +1239,14 @@ async def update_lead_status(lead_id: str, status: str):
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
     
+    completed_at = datetime.now(timezone.utc).isoformat() if status == "completed" else None
     result = await db.leads.update_one(
         {"id": lead_id},
-        {"$set": {"status": status}}
+        {"$set": {"status": status, "completed_at": completed_at}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Lead not found")
+    await bump_collection_version("leads")
     return {"message": "Status updated", "status": status}
 
 @api_router.delete("/leads/{lead_id}")
@@ -448,11 +1255,18 @@ async def delete_lead(lead_id: str):
     result = await db.leads.delete_one({"id": lead_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Lead not found")
+    await bump_collection_version("leads")
+    lead_search.on_deleted(lead_id)
     return {"message": "Lead deleted"}
 
 @api_router.get("/stats")
-async def get_stats():
+async def get_stats(request: Request, response: Response):
     """Get dashboard statistics"""
+    etag = make_etag("stats", await get_collection_version("leads"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+
     total_leads = await db.leads.count_documents({})
     new_leads = await db.leads.count_documents({"status": "new"})
     contacted = await db.leads.count_documents({"status": "contacted"})
@@ -467,51 +1281,148 @@ async def get_stats():
         "completed": completed
     }
 
+@api_router.get("/stats/suburbs")
+async def get_suburb_stats(request: Request, response: Response):
+    """Lead counts per canonical suburb"""
+    etag = make_etag("suburb-stats", await get_collection_version("leads"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+
+    pipeline = [
+        {"$group": {"_id": {"suburb": "$suburb_canonical", "postcode": "$postcode"}, "leads": {"$sum": 1}}},
+        {"$sort": {"leads": -1}},
+    ]
+    rows = await db.leads.aggregate(pipeline).to_list(1000)
+    return [
+        {"suburb": row["_id"].get("suburb"), "postcode": row["_id"].get("postcode"), "leads": row["leads"]}
+        for row in rows
+    ]
+
+@api_router.get("/analytics/funnel")
+async def get_funnel(start: Optional[date] = None, end: Optional[date] = None, group_by: str = "day",
+                     first_faq: Optional[str] = None):
+    """Chat funnel drop-off from the hourly rollups, by local day, first FAQ, or in total"""
+    if funnel_rollups is None:
+        raise HTTPException(status_code=404, detail="Funnel analytics are disabled")
+    if group_by not in ("day", "faq", "total"):
+        raise HTTPException(status_code=400, detail="group_by must be day, faq or total")
+    tz = ZoneInfo(ANALYTICS_TIMEZONE)
+    end = end or datetime.now(tz).date()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    groups = await funnel_rollups.query(start, end, tz, first_faq=first_faq, group_by=group_by)
+    return {"start": start.isoformat(), "end": end.isoformat(), "timezone": ANALYTICS_TIMEZONE,
+            "group_by": group_by, "groups": groups}
+
+@api_router.get("/suburbs/suggest")
+async def suggest_suburbs(q: str, limit: int = 5):
+    """Typeahead suggestions for the suburb question"""
+    return [{"suburb": s.name, "postcode": s.postcode} for s in get_gazetteer().suggest(q, min(limit, 20))]
+
+# ============== SCHEDULING ==============
+
+SCHEDULE_DEPOT_SUBURB = os.environ.get('SCHEDULE_DEPOT_SUBURB', 'Clyde North')
+SCHEDULE_ELECTRICIANS = int(os.environ.get('SCHEDULE_ELECTRICIANS', '1'))
+SCHEDULE_JOBS_PER_DAY = int(os.environ.get('SCHEDULE_JOBS_PER_DAY', '6'))
+SCHEDULE_LEAD_FIELDS = ("id", "name", "phone", "suburb", "suburb_canonical", "postcode", "job_description",
+                        "urgency", "created_at")
+
+@api_router.get("/schedule/plan")
+async def plan_schedule(start: Optional[date] = None, days: int = 5, electricians: Optional[int] = None,
+                        jobs_per_day: Optional[int] = None):
+    """Group booked leads into one route per electrician per working day, shortest drive first
+
+    Oldest bookings are scheduled first; jobs that don't fit, or whose suburb isn't in the
+    centroid table, are listed separately. Distances are straight-line km between suburbs.
+    """
+    days = min(max(days, 1), 10)
+    electricians = min(max(electricians or SCHEDULE_ELECTRICIANS, 1), 20)
+    jobs_per_day = min(max(jobs_per_day or SCHEDULE_JOBS_PER_DAY, 1), 20)
+    centroids = get_centroids()
+    depot = centroids.get(SCHEDULE_DEPOT_SUBURB)
+    if depot is None:
+        raise HTTPException(status_code=500, detail=f"Depot suburb {SCHEDULE_DEPOT_SUBURB!r} is not in the centroid table")
+    start = start or datetime.now(ZoneInfo(ANALYTICS_TIMEZONE)).date()
+
+    projection = {"_id": 0, **{field: 1 for field in SCHEDULE_LEAD_FIELDS}}
+    # Urgent jobs first, then by booking age
+    leads = await db.leads.find({"status": "booked"}, projection).sort("created_at", 1).to_list(None)
+    leads.sort(key=lambda lead: lead.get("urgency") != "urgent")
+    located, points, unlocated = [], [], []
+    for lead in leads:
+        point = centroids.locate(lead)
+        if point is None:
+            unlocated.append(lead)
+        else:
+            located.append(lead)
+            points.append(point)
+
+    plan = await asyncio.to_thread(plan_routes, np.array(points, dtype=float).reshape(-1, 2), depot, start, days,
+                                   electricians, jobs_per_day)
+    return ORJSONResponse({
+        "depot": SCHEDULE_DEPOT_SUBURB,
+        "start": start.isoformat(),
+        "days": days,
+        "electricians": electricians,
+        "jobs_per_day": jobs_per_day,
+        "km": plan.km,
+        "baseline_km": plan.baseline_km,
+        "routes": [
+            {"date": route.day.isoformat(), "electrician": route.electrician, "km": route.km,
+             "jobs": [located[stop] for stop in route.stops]}
+            for route in plan.routes
+        ],
+        "unscheduled": [located[index] for index in plan.unscheduled],
+        "unlocated": unlocated,
+    })
+
 # ============== EMAIL FUNCTIONS ==============
 
-def generate_confirmation_email(lead: dict) -> dict:
-    """Generate confirmation email content for customer"""
-    subject = "Thanks for contacting Add Power Electrics! ⚡"
-    body = f"""Hi {lead['name']},
+CONFIRMATION_EMAIL = {
+    "subject": "Thanks for contacting {business_name}! ⚡",
+    "body": """Hi {name},
 
-Thanks for reaching out to Add Power Electrics! We've received your enquiry and a member of our team will be in touch shortly.
+Thanks for reaching out to {business_name}! We've received your enquiry and a member of our team will be in touch shortly.
 
 📋 YOUR REQUEST DETAILS:
 ━━━━━━━━━━━━━━━━━━━━━━
-• Name: {lead['name']}
-• Phone: {lead['phone']}
-• Location: {lead['suburb']}
-• Job Description: {lead['job_description']}
+• Name: {name}
+• Phone: {phone}
+• Location: {suburb}
+• Job Description: {job_description}
 ━━━━━━━━━━━━━━━━━━━━━━
 
-We typically respond within 2-4 business hours. For urgent electrical emergencies, please call us directly at 0448 195 614.
+We typically respond within 2-4 business hours. For urgent electrical emergencies, please call us directly at {business_phone}.
 
 What happens next?
 1. Our team reviews your request
 2. We'll call you to discuss the job and arrange a time
 3. We provide a free, no-obligation quote on-site
 
-⭐ Add Power Electrics
-Licensed & Insured | 5.0 Stars (37 Reviews)
-Servicing Clyde North & Melbourne's South-East
+⭐ {business_name}
+{business_email_signature}
 
-This is an automated confirmation email."""
-    
-    return {"subject": subject, "body": body}
+This is an automated confirmation email.""",
+}
 
-def generate_quote_email(lead: dict) -> dict:
-    """Generate quote request email content"""
-    subject = f"Your Free Quote Request - Add Power Electrics ⚡"
-    body = f"""Hi {lead['name']},
+def generate_confirmation_email(lead: dict) -> dict:
+    """Generate confirmation email content for customer"""
+    return tenant_config().render_email("confirmation", lead)
+
+QUOTE_EMAIL = {
+    "subject": "Your Free Quote Request - {business_name} ⚡",
+    "body": """Hi {name},
 
 Great news! We're ready to provide you with a FREE quote for your electrical work.
 
 📋 JOB SUMMARY:
 ━━━━━━━━━━━━━━━━━━━━━━
-{lead['job_description']}
+{job_description}
 ━━━━━━━━━━━━━━━━━━━━━━
 
-📍 Location: {lead['suburb']}
+📍 Location: {suburb}
 
 WHAT'S INCLUDED IN OUR QUOTE:
 ✓ Detailed breakdown of work required
@@ -522,108 +1433,144 @@ WHAT'S INCLUDED IN OUR QUOTE:
 We'd love to arrange a time to come out and assess the job. This visit is completely FREE with no obligation.
 
 To confirm your quote appointment, simply:
-📞 Call us: 0448 195 614
+📞 Call us: {business_phone}
 💬 Reply to this message
 
 We look forward to helping you!
 
-⭐ Add Power Electrics
-Licensed & Insured | 5.0 Stars (37 Reviews)
-Servicing Clyde North & Melbourne's South-East"""
-    
-    return {"subject": subject, "body": body}
+⭐ {business_name}
+{business_email_signature}""",
+}
 
-async def send_confirmation_email(lead: dict) -> dict:
-    """Send confirmation email when lead is captured (MOCKED)"""
-    email_content = generate_confirmation_email(lead)
-    
-    # Create email log
-    email_log = EmailLog(
+def generate_quote_email(lead: dict) -> dict:
+    """Generate quote request email content"""
+    return tenant_config().render_email("quote", lead)
+
+def email_message(lead: dict, email_type: str, email_content: dict) -> EmailMessage:
+    # Leads captured by the chat have no email address; only the mock provider "sends" those
+    return EmailMessage(to=lead.get('email'), to_name=lead['name'], subject=email_content['subject'],
+                        body=email_content['body'], tag=email_type)
+
+def make_email_log(lead: dict, email_type: str, email_content: dict, sent: bool) -> dict:
+    return EmailLogRecord(
         lead_id=lead['id'],
-        email_type="confirmation",
+        email_type=email_type,
         recipient_name=lead['name'],
         recipient_phone=lead['phone'],
         subject=email_content['subject'],
-        body=email_content['body']
-    )
+        body=email_content['body'],
+        status="sent" if sent else "failed"
+    ).to_dict()
+
+async def send_confirmation_email(lead: dict) -> dict:
+    """Send confirmation email when lead is captured"""
+    email_content = generate_confirmation_email(lead)
+    result = await email_provider.send(email_message(lead, "confirmation", email_content))
     
     # Store email log in database
-    await db.email_logs.insert_one(email_log.model_dump())
+    email_log = make_email_log(lead, "confirmation", email_content, result.ok)
+    await db.email_logs.insert_one(email_log.copy())
+    if not result.ok:
+        logger.error(f"{email_provider.log_prefix} Confirmation to {lead['name']} ({lead['phone']}) failed: {result.error}")
+        return email_log
     
     # Update lead
     await db.leads.update_one({"id": lead['id']}, {"$set": {"email_sent": True}})
+    await bump_collection_version("leads")
     
-    logger.info(f"[MOCKED EMAIL] Confirmation sent to {lead['name']} ({lead['phone']})")
+    logger.info(f"{email_provider.log_prefix} Confirmation sent to {lead['name']} ({lead['phone']})")
     
-    return email_log.model_dump()
+    return email_log
 
 # ============== EMAIL API ROUTES ==============
 
-@api_router.post("/email/send-quote")
-async def send_quote_email(lead_id: str):
-    """Send quote email to customer (MOCKED)"""
-    lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
-    if not lead:
-        raise HTTPException(status_code=404, detail="Lead not found")
-    
+async def send_quote(lead: dict) -> dict:
+    """Send quote email, returning its email log"""
     email_content = generate_quote_email(lead)
-    
-    # Create email log
-    email_log = EmailLog(
-        lead_id=lead_id,
-        email_type="quote",
-        recipient_name=lead['name'],
-        recipient_phone=lead['phone'],
-        subject=email_content['subject'],
-        body=email_content['body']
-    )
+    result = await email_provider.send(email_message(lead, "quote", email_content))
     
     # Store email log
-    await db.email_logs.insert_one(email_log.model_dump())
+    email_log = make_email_log(lead, "quote", email_content, result.ok)
+    await db.email_logs.insert_one(email_log.copy())
+    if not result.ok:
+        logger.error(f"{email_provider.log_prefix} Quote to {lead['name']} ({lead['phone']}) failed: {result.error}")
+        return email_log
     
     # Update lead
-    await db.leads.update_one({"id": lead_id}, {"$set": {"quote_sent": True}})
+    await db.leads.update_one({"id": lead['id']}, {"$set": {"quote_sent": True}})
+    await bump_collection_version("leads")
     
-    logger.info(f"[MOCKED EMAIL] Quote sent to {lead['name']} ({lead['phone']})")
+    logger.info(f"{email_provider.log_prefix} Quote sent to {lead['name']} ({lead['phone']})")
+    return email_log
+
+@api_router.post("/email/send-quote")
+async def send_quote_email(lead_id: str):
+    """Send quote email to customer"""
+    lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
+    if not lead:
+        raise HTTPException(status_code=404, detail="Lead not found")
+    
+    email_log = await outbound.run(outbound_lane(lead), send_quote, lead)
+    if not email_provider.mocked:
+        return {"message": f"Quote email {email_log['status']} via {email_provider.name}", "lead_id": lead_id, "email": email_log}
     
     return {
         "message": "Quote email simulated (Email integration ready)",
         "lead_id": lead_id,
-        "email": email_log.model_dump(),
+        "email": email_log,
         "note": "To enable real emails, add SendGrid/Resend credentials to .env"
     }
 
 @api_router.get("/email/logs")
-async def get_email_logs(lead_id: Optional[str] = None):
-    """Get email logs, optionally filtered by lead_id"""
+async def get_email_logs(lead_id: Optional[str] = None, fields: Optional[str] = None, lean: bool = False):
+    """Get email logs, optionally filtered by lead_id
+
+    ``fields=`` limits the returned keys (e.g. leave out ``body``); ``lean=true`` serializes
+    the stored documents directly with orjson.
+    """
     query = {"lead_id": lead_id} if lead_id else {}
-    logs = await db.email_logs.find(query, {"_id": 0}).sort("sent_at", -1).to_list(100)
+    projection = build_projection(fields, EMAIL_LOG_FIELDS)
+    logs = await db.email_logs.find(query, projection or {"_id": 0}).sort("sent_at", -1).to_list(100)
+    archived = await cold_archive.find_email_logs(lead_id) if lead_id and cold_archive is not None else []
+    if archived:
+        if projection:
+            archived = [{f: log[f] for f in projection if f in log} for log in archived]
+        logs = sorted(logs + archived, key=lambda log: log.get("sent_at", ""), reverse=True)[:100]
+    if lean or projection:
+        return ORJSONResponse(logs)
     return logs
 
 @api_router.get("/email/preview/{lead_id}")
-async def preview_emails(lead_id: str):
+async def preview_emails(lead_id: str, request: Request, response: Response):
     """Preview what emails would be sent for a lead"""
-    lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
+    # The emails depend on the lead and on the tenant's templates and business details, which
+    # can be reloaded at any time, so the tenant's config fingerprint is part of the validator
+    etag = make_etag("preview", lead_id, await get_collection_version("leads"),
+                     active_tenant(tenant_registry).fingerprint[:16])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    lead = await find_lead(lead_id)
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
     
+    response.headers.update(cache_headers(etag))
     return {
         "confirmation": generate_confirmation_email(lead),
         "quote": generate_quote_email(lead),
         "review_request": generate_review_request_email(lead)
     }
 
-def generate_review_request_email(lead: dict) -> dict:
-    """Generate review request email for completed jobs"""
-    subject = "How did we do? ⭐ - Add Power Electrics"
-    body = f"""Hi {lead['name']},
+REVIEW_REQUEST_EMAIL = {
+    "subject": "How did we do? ⭐ - {business_name}",
+    "body": """Hi {name},
 
-Thanks for choosing Add Power Electrics for your recent electrical work!
+Thanks for choosing {business_name} for your recent electrical work!
 
 We hope everything went smoothly. If you were happy with our service, we'd really appreciate a quick Google review - it only takes 30 seconds and helps other Melburnians find a sparky they can trust.
 
 ⭐ LEAVE A REVIEW:
-https://g.page/r/YOUR-GOOGLE-REVIEW-LINK/review
+{business_review_link}
 
 Your feedback helps us:
 ✓ Improve our service
@@ -632,66 +1579,204 @@ Your feedback helps us:
 
 Already left a review? Thank you so much! 🙏
 
-If anything wasn't quite right, please reply to this email or call us on 0448 195 614 - we want to make it right.
+If anything wasn't quite right, please reply to this email or call us on {business_phone} - we want to make it right.
 
 Thanks again for your business!
 
-⚡ Add Power Electrics
-5.0 Stars | 37+ Reviews | Greater Melbourne
-Licensed & Insured"""
-    
-    return {"subject": subject, "body": body}
+⚡ {business_name}
+{business_review_signature}""",
+}
+
+def generate_review_request_email(lead: dict) -> dict:
+    """Generate review request email for completed jobs"""
+    return tenant_config().render_email("review_request", lead)
+
+# Email templates a tenant can override, by name; {name} {phone} {suburb} {job_description}
+# come from the lead, {business_*} from the tenant's business details
+EMAIL_TEMPLATES = {
+    "confirmation": CONFIRMATION_EMAIL,
+    "quote": QUOTE_EMAIL,
+    "review_request": REVIEW_REQUEST_EMAIL,
+}
+
+# ============== TENANTS ==============
+
+# Tenant specs are re-read every this many seconds and swapped in when they changed
+TENANT_RELOAD_SECONDS = float(os.environ.get('TENANT_RELOAD_SECONDS', '30'))
+# Requests whose host/API key match no tenant get the default business (false: 404)
+TENANT_FALLBACK_DEFAULT = os.environ.get('TENANT_FALLBACK_DEFAULT', 'true').lower() in ('1', 'true', 'yes')
+
+def tenant_source():
+    if TENANTS_SOURCE == 'files':
+        return FileTenantSource(Path(TENANTS_DIR))
+    if TENANTS_SOURCE == 'mongo':
+        return MongoTenantSource(db.unscoped('tenants'))
+    return None
+
+tenant_registry = TenantRegistry(TenantConfig, source=tenant_source())
+
+def tenant_config() -> TenantConfig:
+    """Compiled config of the tenant this request (or background job) is for"""
+    return active_tenant(tenant_registry).config
+
+async def run_for_each_tenant(fn):
+    """Await ``fn()`` once per tenant with that tenant active; one tenant failing doesn't stop the rest"""
+    for tenant in tenant_registry.all():
+        token = current_tenant.set(tenant)
+        try:
+            await fn()
+        except Exception as e:
+            logger.error(f"{getattr(fn, '__qualname__', fn)} failed for tenant {tenant.id}: {e}")
+        finally:
+            current_tenant.reset(token)
+
+async def deliver_review_request(lead: dict) -> dict:
+    """Render and send one review request email, returning its email log; raises ProviderError if it fails"""
+    email_content = generate_review_request_email(lead)
+    result = await email_provider.send(email_message(lead, "review_request", email_content))
+    if not result.ok:
+        raise ProviderError(result.error)
+    logger.info(f"{email_provider.log_prefix} Review request sent to {lead['name']} ({lead['phone']})")
+    return make_email_log(lead, "review_request", email_content, True)
+
+async def deliver_review_requests(leads: List[dict]) -> List[Optional[dict]]:
+    """Send review requests through the provider's batch API: an email log per lead, None if it failed"""
+    contents = [generate_review_request_email(lead) for lead in leads]
+    results = await email_provider.send_batch([
+        email_message(lead, "review_request", content) for lead, content in zip(leads, contents)
+    ])
+    logs = []
+    for lead, content, result in zip(leads, contents, results):
+        if result.ok:
+            logs.append(make_email_log(lead, "review_request", content, True))
+        else:
+            logger.error(f"{email_provider.log_prefix} Review request to {lead['name']} ({lead['phone']}) failed: {result.error}")
+            logs.append(None)
+    logger.info(f"{email_provider.log_prefix} {len(leads) - logs.count(None)} of {len(leads)} review requests sent")
+    return logs
+
+async def save_review_requests(leads: List[dict], email_logs: List[dict]):
+    """Store the email logs and flag the leads for a batch of sent review requests"""
+    await db.email_logs.insert_many([log.copy() for log in email_logs])  # copies avoid _id mutation
+    await db.leads.update_many({"id": {"$in": [lead['id'] for lead in leads]}}, {"$set": {"review_requested": True}})
+    await bump_collection_version("leads")
 
 @api_router.post("/email/send-review-request")
 async def send_review_request_email(lead_id: str):
-    """Send review request email to customer after job completion (MOCKED)"""
-    lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
+    """Send review request email to customer after job completion"""
+    lead = await find_lead(lead_id)
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
     
     if lead.get('status') != 'completed':
         raise HTTPException(status_code=400, detail="Can only request reviews for completed jobs")
-    
-    email_content = generate_review_request_email(lead)
-    
-    # Create email log
-    email_log = EmailLog(
-        lead_id=lead_id,
-        email_type="review_request",
-        recipient_name=lead['name'],
-        recipient_phone=lead['phone'],
-        subject=email_content['subject'],
-        body=email_content['body']
-    )
-    
-    # Store email log
-    await db.email_logs.insert_one(email_log.model_dump())
-    
-    # Update lead
-    await db.leads.update_one({"id": lead_id}, {"$set": {"review_requested": True}})
-    
-    logger.info(f"[MOCKED EMAIL] Review request sent to {lead['name']} ({lead['phone']})")
+    # Archived leads can't be flagged, so their review request is only recorded by its email log
+    if lead.get('review_requested') or await db.email_logs.find_one(
+            {"lead_id": lead_id, "email_type": "review_request"}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="A review request has already been sent for this lead")
+    
+    try:
+        email_log = await outbound.run("normal", deliver_review_request, lead)
+    except ProviderError as e:
+        raise HTTPException(status_code=502, detail=f"Review request email failed: {e}")
+    await save_review_requests([lead], [email_log])
+    if not email_provider.mocked:
+        return {"message": f"Review request email sent via {email_provider.name}", "lead_id": lead_id, "email": email_log}
     
     return {
         "message": "Review request email simulated (Email integration ready)",
         "lead_id": lead_id,
-        "email": email_log.model_dump(),
+        "email": email_log,
         "note": "To enable real emails, add SendGrid/Resend credentials to .env"
     }
 
-# SMS placeholder endpoint (ready for Twilio integration)
+# ============== REVIEW REQUEST CAMPAIGN ==============
+
+# Automatic runs every N minutes; 0 leaves the campaign to POST /api/campaigns/review-requests/run
+REVIEW_CAMPAIGN_INTERVAL_MINUTES = float(os.environ.get('REVIEW_CAMPAIGN_INTERVAL_MINUTES', '0'))
+
+review_campaign = ReviewCampaign(
+    db.leads,
+    db.job_cursors,
+    deliver=functools.partial(outbound.run, "bulk", deliver_review_request),
+    save=save_review_requests,
+    delay=timedelta(hours=float(os.environ.get('REVIEW_REQUEST_DELAY_HOURS', '24'))),
+    batch_size=int(os.environ.get('REVIEW_CAMPAIGN_BATCH_SIZE', '50')),
+    concurrency=int(os.environ.get('REVIEW_CAMPAIGN_CONCURRENCY', '5')),
+    per_minute=int(os.environ.get('REVIEW_CAMPAIGN_PER_MINUTE', '60')),
+    # Providers with a batch API take a chunk of leads per request
+    deliver_batch=functools.partial(outbound.run, "bulk", deliver_review_requests) if email_provider.batch_size > 1 else None,
+    batch_chunk=email_provider.batch_size,
+)
+background_tasks = set()
+
+def start_background_task(coro) -> asyncio.Task:
+    """Run ``coro`` in the background, keeping a reference so the task isn't garbage collected"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+@api_router.get("/campaigns/review-requests")
+async def get_review_campaign():
+    """Campaign progress, last run's throughput and how many leads are waiting"""
+    return await review_campaign.status()
+
+@api_router.post("/campaigns/review-requests/run", status_code=202)
+async def run_review_campaign():
+    """Start a campaign pass now (in the background)"""
+    current = await review_campaign.status()
+    if current.get("status") == "running" and current.get("lease_until", 0) > time.time():
+        raise HTTPException(status_code=409, detail="Review campaign is already running")
+    start_background_task(review_campaign.run())
+    return {"message": "Review campaign started", "eligible": current["eligible"]}
+
+# ============== COLD ARCHIVE API ==============
+
+@api_router.get("/archive")
+async def get_archive():
+    """Archived leads and email logs per month, the last run, and how many leads are due"""
+    if cold_archive is None:
+        return {"status": "disabled", "detail": "Set ARCHIVE_DIR to enable the cold archive"}
+    return await cold_archive.status()
+
+@api_router.post("/archive/run", status_code=202)
+async def run_archive():
+    """Move old completed leads and their email logs to the archive now (in the background)"""
+    if cold_archive is None:
+        raise HTTPException(status_code=400, detail="Set ARCHIVE_DIR to a durable directory shared by every worker before archiving")
+    current = await cold_archive.status()
+    if current.get("status") == "running" and current.get("lease_until", 0) > time.time():
+        raise HTTPException(status_code=409, detail="Archiving is already running")
+    start_background_task(cold_archive.run())
+    return {"message": "Archive run started", "eligible": current["eligible"]}
+
+async def send_sms(lead: dict) -> bool:
+    """New-lead SMS to the team; returns whether it was sent"""
+    urgency = lead.get('urgency', 'normal')
+    message = f"New lead from {lead['name']}! Phone: {lead['phone']}, Suburb: {lead['suburb']}, Job: {lead['job_description']}"
+    if urgency == "urgent":
+        message = f"URGENT: {message}"
+    result = await sms_provider.send(SmsMessage(to=SMS_ALERT_TO or normalize_phone(tenant_config().business['phone']), body=message))
+    if not result.ok:
+        logger.error(f"{sms_provider.log_prefix} {urgency} lead alert for {lead['name']} ({lead['phone']}) failed: {result.error}")
+        return False
+    
+    await db.leads.update_one({"id": lead['id']}, {"$set": {"sms_sent": True}})
+    await bump_collection_version("leads")
+    logger.info(f"{sms_provider.log_prefix} {urgency} lead alert for {lead['name']} ({lead['phone']})")
+    return True
+
 @api_router.post("/sms/send")
 async def send_sms_notification(lead_id: str):
-    """Placeholder for SMS notification - ready for Twilio integration"""
+    """Send the new-lead SMS to the team (again)"""
     lead = await db.leads.find_one({"id": lead_id}, {"_id": 0})
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
     
-    # TODO: Integrate Twilio here
-    # message = f"New lead from {lead['name']}! Phone: {lead['phone']}, Suburb: {lead['suburb']}, Job: {lead['job_description']}"
-    # client.messages.create(body=message, from_=TWILIO_NUMBER, to=BUSINESS_PHONE)
-    
-    await db.leads.update_one({"id": lead_id}, {"$set": {"sms_sent": True}})
+    sent = await outbound.run(outbound_lane(lead), send_sms, lead)
+    if not sms_provider.mocked:
+        return {"message": f"SMS notification {'sent' if sent else 'failed'} via {sms_provider.name}", "lead_id": lead_id, "sms_sent": sent}
     
     return {
         "message": "SMS notification simulated (Twilio integration ready)",
@@ -711,6 +1796,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gzip/brotli for large payloads (lead lists, email logs with full bodies)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+)
+
+# Event-loop lag / slow-callback monitor; stalls are attributed to the route being handled
+LOOP_MONITOR_ENABLED = os.environ.get('LOOP_MONITOR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+loop_monitor = LoopMonitor(
+    slow_callback=float(os.environ.get('LOOP_SLOW_CALLBACK_MS', '100')) / 1000,
+    interval=float(os.environ.get('LOOP_LAG_INTERVAL_MS', '250')) / 1000,
+) if LOOP_MONITOR_ENABLED else None
+if loop_monitor is not None:
+    app.add_middleware(RouteContextMiddleware)
+
+if MULTI_TENANT:
+    app.add_middleware(TenantMiddleware, registry=tenant_registry, fallback_to_default=TENANT_FALLBACK_DEFAULT)
+
+# Outermost, so a profile covers compression and CORS too
+if PROFILING_SECRET or PROFILING_SAMPLE_RATE > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        secret=PROFILING_SECRET or None,
+        sample_rate=PROFILING_SAMPLE_RATE,
+        sample_paths=tuple(os.environ.get('PROFILING_SAMPLE_PATHS', '/api/chat').split(',')),
+    )
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if MULTI_TENANT:
+        await tenant_registry.reload(force=True)
+        start_background_task(tenant_registry.watch(TENANT_RELOAD_SECONDS))
+    # In multi-tenant mode every index below is prefixed with tenant_id (see tenants.ScopedCollection)
+    await db.leads.create_index([("id", 1)])
+    await db.conversations.create_index([("session_id", 1)])
+    await db.email_logs.create_index([("lead_id", 1)])
+    await db.leads.create_index([("suburb_canonical", 1), ("created_at", -1)])
+    await db.leads.create_index([("phone_e164", 1), ("created_at", -1)])
+    await db.leads.create_index([("status", 1), ("created_at", 1)])
+    await lead_search.ensure_indexes()
+    if transcript_store is not None:
+        await transcript_store.ensure_indexes()
+        start_background_task(transcript_store.run_forever(on_flushed=count_flushed_transcripts))
+    if funnel_rollups is not None:
+        await funnel_rollups.ensure_indexes()
+    if rate_limiter.shared is not None:
+        await rate_limiter.shared.ensure_indexes()
+    await review_campaign.ensure_indexes()
+    if cold_archive is not None:
+        await cold_archive.ensure_indexes()
+    start_background_task(run_for_each_tenant(backfill_lead_fields) if MULTI_TENANT else backfill_lead_fields())
+    await http_pool.start()
+    if loop_monitor is not None:
+        loop_monitor.install()
+        start_background_task(loop_monitor.run())
+    if REVIEW_CAMPAIGN_INTERVAL_MINUTES > 0:
+        start_background_task(review_campaign.run_forever(
+            REVIEW_CAMPAIGN_INTERVAL_MINUTES * 60,
+            run_pass=functools.partial(run_for_each_tenant, review_campaign.run) if MULTI_TENANT else None,
+        ))
+    if ARCHIVE_INTERVAL_HOURS > 0 and cold_archive is None:
+        logger.warning("ARCHIVE_INTERVAL_HOURS is set but ARCHIVE_DIR isn't; leads won't be archived")
+    elif ARCHIVE_INTERVAL_HOURS > 0:
+        start_background_task(cold_archive.run_forever(
+            ARCHIVE_INTERVAL_HOURS * 3600,
+            run_pass=functools.partial(run_for_each_tenant, cold_archive.run) if MULTI_TENANT else None,
+        ))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    for task in list(background_tasks):
+        task.cancel()
+    if transcript_store is not None:
+        count_flushed_transcripts(await transcript_store.flush())
+    await outbound.stop(timeout=OUTBOUND_DRAIN_SECONDS)
+    await http_pool.close()
+    if loop_monitor is not None:
+        loop_monitor.uninstall()
+    if client is not None:
+        client.close()
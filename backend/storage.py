@@ -0,0 +1,863 @@
+"""Storage backends: Motor (MongoDB) or an in-process, Mongo-compatible memory store
+
+``STORAGE_BACKEND=memory`` swaps the Motor database for ``MemoryDatabase``, which
+implements the part of the Motor collection API this app uses - filters with the usual
+comparison/logical operators, projections, sorting, skip/limit, $set/$unset/$inc/$push/
+$setOnInsert updates with upserts, find_one_and_update, counts, bulk_write and a small
+aggregation pipeline. Every module keeps talking to "a collection", so the same code
+runs against either backend.
+
+``create_index`` builds a hash index on each field of the index key; equality and $in
+filters on those fields are answered from the index instead of a scan. Unique indexes are
+enforced, compound ones (e.g. every unique index of a tenant-scoped collection) on the
+whole key, except for documents holding an array in it. TTL and text indexes are not:
+text indexes raise OperationFailure, which the lead search already treats as "use the
+in-process index".
+
+Data lives only as long as the process. It is meant for tests, local load tests and
+benchmarks that need the application's CPU cost without a database round trip.
+"""
+import itertools
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+_MISSING = object()
+
+
+def open_database(backend: str, mongo_url: Optional[str], db_name: str):
+    """Return (client, database) for ``backend`` ("mongo" or "memory"); client is None for memory"""
+    if backend == "memory":
+        return None, MemoryDatabase(db_name)
+    if backend != "mongo":
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(mongo_url)
+    return client, client[db_name]
+
+
+# ============== DOCUMENT HELPERS ==============
+
+def _clone(value):
+    """Copy a JSON-like document (faster than copy.deepcopy for plain dicts/lists)"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _get_path(doc: dict, path: str):
+    """Value at a dotted path; through arrays of documents it yields the list of values"""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            values = [v.get(part, _MISSING) for v in value if isinstance(v, dict)]
+            value = [v for v in values if v is not _MISSING]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _candidates(value) -> list:
+    """Values a condition is tested against: the value itself plus, for arrays, each element"""
+    if value is _MISSING:
+        return [None]
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+def _compare(op: str, value, operand) -> bool:
+    try:
+        if op == "$gt":
+            return value is not None and value > operand
+        if op == "$gte":
+            return value is not None and value >= operand
+        if op == "$lt":
+            return value is not None and value < operand
+        if op == "$lte":
+            return value is not None and value <= operand
+    except TypeError:
+        return False  # different BSON types never compare
+    raise OperationFailure(f"unknown operator: {op}")
+
+
+def _match_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq":
+                ok = operand in _candidates(value)
+            elif op == "$ne":
+                ok = operand not in _candidates(value)
+            elif op == "$in":
+                ok = any(c in operand for c in _candidates(value))
+            elif op == "$nin":
+                ok = not any(c in operand for c in _candidates(value))
+            elif op == "$exists":
+                ok = (value is not _MISSING) == bool(operand)
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                ok = any(_compare(op, c, operand) for c in _candidates(value) if c is not None)
+            elif op == "$text":
+                raise OperationFailure("text search is not supported by the in-memory backend")
+            else:
+                raise OperationFailure(f"unknown operator: {op}")
+            if not ok:
+                return False
+        return True
+    return condition in _candidates(value)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """Whether ``doc`` satisfies a Mongo filter"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$text":
+            raise OperationFailure("text search is not supported by the in-memory backend")
+        elif not _match_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = _clone(doc)
+    if not projection:
+        return doc
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(isinstance(v, dict) for v in fields.values()):
+        raise OperationFailure("projection operators are not supported by the in-memory backend")
+    if fields and all(fields.values()):
+        out = {}
+        for path in fields:
+            top, _, rest = path.partition(".")
+            if top not in doc:
+                continue
+            if not rest:
+                out[top] = doc[top]
+            elif isinstance(doc[top], list):
+                out[top] = [project(v, {"_id": 1, rest: 1}) for v in doc[top] if isinstance(v, dict)]
+            elif isinstance(doc[top], dict):
+                out.setdefault(top, {}).update(project(doc[top], {"_id": 1, rest: 1}))
+        if include_id and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    for path, keep in fields.items():
+        if not keep:
+            _unset_path(doc, path)
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+
+def _sort_key(value):
+    # Missing/null sort before everything else, then numbers, then strings, then the rest
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (4, str(value))
+
+
+def sort_documents(docs: List[dict], sort: List[Tuple[str, int]]) -> List[dict]:
+    for key, direction in reversed(sort):
+        if isinstance(direction, dict):
+            raise OperationFailure("$meta sort is not supported by the in-memory backend")
+        docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+    return docs
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return list(key_or_list)
+
+
+def evaluate(expression, doc: dict):
+    """Aggregation expression: "$field.path" references, literals, and documents of those"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        if any(k.startswith("$") for k in expression):
+            raise OperationFailure(f"expression operator {next(iter(expression))} is not supported by the in-memory backend")
+        return {k: evaluate(v, doc) for k, v in expression.items()}
+    return expression
+
+
+# ============== UPDATES ==============
+
+def apply_update(doc: dict, update, inserting: bool = False):
+    if isinstance(update, list):
+        # Aggregation-pipeline update, limited to $set/$unset of plain expressions
+        for stage in update:
+            for op, spec in stage.items():
+                if op in ("$set", "$addFields"):
+                    values = {path: evaluate(expr, doc) for path, expr in spec.items()}
+                    for path, value in values.items():
+                        _set_path(doc, path, value)
+                elif op == "$unset":
+                    for path in [spec] if isinstance(spec, str) else spec:
+                        _unset_path(doc, path)
+                else:
+                    raise OperationFailure(f"pipeline stage {op} is not supported by the in-memory backend")
+        return
+
+    if not any(k.startswith("$") for k in update):
+        raise ValueError("update only works with $ operators")
+    for op, spec in update.items():
+        if op == "$set":
+            for path, value in spec.items():
+                _set_path(doc, path, _clone(value))
+        elif op == "$setOnInsert":
+            if inserting:
+                for path, value in spec.items():
+                    _set_path(doc, path, _clone(value))
+        elif op == "$unset":
+            for path in spec:
+                _unset_path(doc, path)
+        elif op == "$inc":
+            for path, amount in spec.items():
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING else current) + amount)
+        elif op == "$push":
+            for path, value in spec.items():
+                current = _get_path(doc, path)
+                items = [] if current is _MISSING else current
+                if isinstance(value, dict) and "$each" in value:
+                    items = items + _clone(value["$each"])
+                else:
+                    items = items + [_clone(value)]
+                _set_path(doc, path, items)
+        elif op == "$addToSet":
+            for path, value in spec.items():
+                current = _get_path(doc, path)
+                items = [] if current is _MISSING else current
+                if value not in items:
+                    _set_path(doc, path, items + [_clone(value)])
+        else:
+            raise OperationFailure(f"update operator {op} is not supported by the in-memory backend")
+
+
+def _upsert_seed(query: dict) -> dict:
+    """The equality parts of a filter, which become fields of an upserted document"""
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set_path(doc, key, _clone(condition["$eq"]))
+            continue
+        _set_path(doc, key, _clone(condition))
+    return doc
+
+
+# ============== RESULTS / CURSORS ==============
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+        self.acknowledged = True
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.acknowledged = True
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.acknowledged = True
+
+
+class MemoryCursor:
+    """Lazy result set mirroring Motor's cursor chaining (sort/skip/limit/to_list/async for)"""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[dict]] = None
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> "MemoryCursor":
+        return self
+
+    def _evaluate(self) -> List[dict]:
+        if self._results is None:
+            self._results = self._fetch(self._sort, self._skip, self._limit)
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._evaluate()
+        return results[:length] if length else list(results)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._evaluate():
+            yield doc
+
+
+# ============== COLLECTION ==============
+
+class HashIndex:
+    """Field value -> document ids; arrays are indexed per element (multikey)"""
+
+    def __init__(self, field: str, unique: bool):
+        self.field = field
+        self.unique = unique
+        self.entries: Dict[Any, Set[int]] = defaultdict(set)
+        self.unhashable: Set[int] = set()
+
+    def keys_for(self, doc: dict) -> Optional[list]:
+        value = _get_path(doc, self.field)
+        values = _candidates(value)[1:] if isinstance(value, list) else _candidates(value)
+        try:
+            for v in values:
+                hash(v)
+        except TypeError:
+            return None
+        return values
+
+    def add(self, doc_id: int, doc: dict):
+        keys = self.keys_for(doc)
+        if keys is None:
+            self.unhashable.add(doc_id)
+            return
+        for key in keys:
+            self.entries[key].add(doc_id)
+
+    def remove(self, doc_id: int, doc: dict):
+        self.unhashable.discard(doc_id)
+        keys = self.keys_for(doc)
+        for key in keys or ():
+            ids = self.entries.get(key)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.entries[key]
+
+    def lookup(self, condition) -> Optional[Set[int]]:
+        """Candidate ids for a filter condition, or None if the index can't narrow it"""
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                values = [condition["$eq"]]
+            elif "$in" in condition:
+                values = list(condition["$in"])
+            else:
+                return None
+        else:
+            values = [condition]
+        found = set(self.unhashable)
+        try:
+            for value in values:
+                found |= self.entries.get(value, set())
+        except TypeError:
+            return None
+        return found
+
+
+class UniqueKey:
+    """A compound unique index: the tuple of its fields' values (missing = null) -> document id"""
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self.entries: Dict[tuple, int] = {}
+
+    def key_for(self, doc: dict) -> Optional[tuple]:
+        key = tuple(None if value is _MISSING else value for value in (_get_path(doc, f) for f in self.fields))
+        try:
+            hash(key)
+        except TypeError:
+            return None  # arrays (multikey) aren't checked
+        return key
+
+    def add(self, doc_id: int, doc: dict):
+        key = self.key_for(doc)
+        if key is not None:
+            self.entries[key] = doc_id
+
+    def remove(self, doc_id: int, doc: dict):
+        key = self.key_for(doc)
+        if key is not None and self.entries.get(key) == doc_id:
+            del self.entries[key]
+
+    def conflicts(self, doc: dict, doc_id: Optional[int]) -> bool:
+        key = self.key_for(doc)
+        return key is not None and self.entries.get(key, doc_id) != doc_id
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[int, dict] = {}  # insertion order is the natural order
+        self._ids: Dict[Any, int] = {}     # _id -> internal id
+        self._next = itertools.count()
+        self._indexes: Dict[str, HashIndex] = {}
+        self._unique_keys: Dict[Tuple[str, ...], UniqueKey] = {}
+
+    def __repr__(self):
+        return f"MemoryCollection({self.database.name}.{self.name})"
+
+    # ----- indexes -----
+
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        spec = _normalize_sort(keys)
+        if any(direction == "text" for _, direction in spec):
+            raise OperationFailure("text indexes are not supported by the in-memory backend")
+        index_name = name or "_".join(f"{k}_{d}" for k, d in spec)
+        # Every field of a compound key gets its own hash index, so a key prefixed with a
+        # low-selectivity field (e.g. tenant_id) still serves lookups on the later fields
+        for field, _ in spec:
+            if field in self._indexes and not (unique and len(spec) == 1 and not self._indexes[field].unique):
+                continue
+            index = HashIndex(field, unique and len(spec) == 1)
+            for doc_id, doc in self._docs.items():
+                index.add(doc_id, doc)
+            if index.unique and any(len(ids) > 1 for ids in index.entries.values()):
+                raise DuplicateKeyError(f"cannot build unique index {index_name}: duplicate values")
+            self._indexes[field] = index
+        fields = tuple(field for field, _ in spec)
+        if unique and len(fields) > 1 and fields not in self._unique_keys:
+            unique_key = UniqueKey(fields)
+            for doc_id, doc in self._docs.items():
+                if unique_key.conflicts(doc, None):
+                    raise DuplicateKeyError(f"cannot build unique index {index_name}: duplicate values")
+                unique_key.add(doc_id, doc)
+            self._unique_keys[fields] = unique_key
+        return index_name
+
+    async def index_information(self) -> dict:
+        return {"_id_": {"key": [("_id", 1)]}, **{
+            f"{field}_1": {"key": [(field, 1)], "unique": index.unique} for field, index in self._indexes.items()
+        }, **{
+            "_".join(f"{field}_1" for field in fields): {"key": [(field, 1) for field in fields], "unique": True}
+            for fields in self._unique_keys
+        }}
+
+    def _candidate_ids(self, query: dict) -> Iterable[int]:
+        best: Optional[Set[int]] = None
+        for key, condition in query.items():
+            if key == "_id" and not isinstance(condition, dict):
+                doc_id = self._ids.get(condition)
+                return [] if doc_id is None else [doc_id]
+            index = self._indexes.get(key)
+            if index is None:
+                continue
+            found = index.lookup(condition)
+            if found is not None and (best is None or len(found) < len(best)):
+                best = found
+        if best is None:
+            return list(self._docs)
+        return sorted(best)
+
+    def _find_ids(self, query: Optional[dict]) -> List[int]:
+        query = query or {}
+        return [doc_id for doc_id in self._candidate_ids(query) if matches(self._docs[doc_id], query)]
+
+    def _check_unique(self, doc: dict, doc_id: Optional[int] = None):
+        existing = self._ids.get(doc.get("_id"))
+        if existing is not None and existing != doc_id:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        for index in self._indexes.values():
+            if not index.unique:
+                continue
+            for key in index.keys_for(doc) or ():
+                if index.entries.get(key, set()) - {doc_id}:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {index.field}_1")
+        for fields, unique_key in self._unique_keys.items():
+            if unique_key.conflicts(doc, doc_id):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: "
+                                        + "_".join(f"{field}_1" for field in fields))
+
+    def _store(self, doc: dict) -> int:
+        self._check_unique(doc)
+        doc_id = next(self._next)
+        self._docs[doc_id] = doc
+        self._ids[doc["_id"]] = doc_id
+        for index in [*self._indexes.values(), *self._unique_keys.values()]:
+            index.add(doc_id, doc)
+        return doc_id
+
+    def _replace(self, doc_id: int, new_doc: dict):
+        old = self._docs[doc_id]
+        self._check_unique(new_doc, doc_id)
+        for index in [*self._indexes.values(), *self._unique_keys.values()]:
+            index.remove(doc_id, old)
+            index.add(doc_id, new_doc)
+        self._docs[doc_id] = new_doc
+
+    def _delete(self, doc_id: int):
+        doc = self._docs.pop(doc_id)
+        self._ids.pop(doc.get("_id"), None)
+        for index in [*self._indexes.values(), *self._unique_keys.values()]:
+            index.remove(doc_id, doc)
+
+    # ----- reads -----
+
+    def _fetch(self, query, projection, sort, skip, limit) -> List[dict]:
+        docs = [self._docs[doc_id] for doc_id in self._find_ids(query)]
+        if sort:
+            docs = sort_documents(docs, sort)
+        if skip:
+            docs = docs[skip:]
+        if limit:
+            docs = docs[:limit]
+        return [project(doc, projection) for doc in docs]
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None,
+             skip: int = 0, limit: int = 0) -> MemoryCursor:
+        cursor = MemoryCursor(lambda s, sk, lim: self._fetch(filter, projection, s, sk, lim))
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None):
+        results = self._fetch(filter, projection, _normalize_sort(sort) if sort else None, 0, 1)
+        return results[0] if results else None
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        if not filter:
+            return len(self._docs)
+        return len(self._find_ids(filter))
+
+    async def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        values = []
+        for doc_id in self._find_ids(filter):
+            value = _get_path(self._docs[doc_id], key)
+            if value is _MISSING:
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if item not in values:
+                    values.append(item)
+        return values
+
+    def aggregate(self, pipeline: List[dict]) -> MemoryCursor:
+        return MemoryCursor(lambda s, sk, lim: self._aggregate(pipeline))
+
+    def _aggregate(self, pipeline: List[dict]) -> List[dict]:
+        docs = [_clone(doc) for doc in self._docs.values()]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, spec)]
+            elif op == "$sort":
+                docs = sort_documents(docs, list(spec.items()))
+            elif op == "$skip":
+                docs = docs[spec:]
+            elif op == "$limit":
+                docs = docs[:spec]
+            elif op == "$project":
+                docs = [project(d, spec) for d in docs]
+            elif op == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            elif op == "$group":
+                docs = _group(docs, spec)
+            else:
+                raise OperationFailure(f"aggregation stage {op} is not supported by the in-memory backend")
+        return docs
+
+    # ----- writes -----
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        document.setdefault("_id", ObjectId())  # pymongo adds _id to the caller's dict too
+        self._store(_clone(document))
+        return InsertOneResult(document["_id"])
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        ids = []
+        for document in documents:
+            ids.append((await self.insert_one(document)).inserted_id)
+        return InsertManyResult(ids)
+
+    def _update(self, filter: dict, update, upsert: bool, many: bool) -> UpdateResult:
+        doc_ids = self._find_ids(filter)
+        if not many:
+            doc_ids = doc_ids[:1]
+        modified = 0
+        for doc_id in doc_ids:
+            old = self._docs[doc_id]
+            new = _clone(old)
+            apply_update(new, update)
+            if new.get("_id") != old.get("_id"):
+                raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+            if new != old:
+                self._replace(doc_id, new)
+                modified += 1
+        if doc_ids or not upsert:
+            return UpdateResult(len(doc_ids), modified)
+        doc = _upsert_seed(filter)
+        apply_update(doc, update, inserting=True)
+        doc.setdefault("_id", ObjectId())
+        self._store(doc)
+        return UpdateResult(0, 0, upserted_id=doc["_id"])
+
+    async def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, many=False)
+
+    async def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, many=True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        doc_ids = self._find_ids(filter)[:1]
+        if doc_ids:
+            new = _clone(replacement)
+            new["_id"] = self._docs[doc_ids[0]]["_id"]
+            self._replace(doc_ids[0], new)
+            return UpdateResult(1, 1)
+        if not upsert:
+            return UpdateResult(0, 0)
+        new = {**_upsert_seed(filter), **_clone(replacement)}
+        new.setdefault("_id", ObjectId())
+        self._store(new)
+        return UpdateResult(0, 0, upserted_id=new["_id"])
+
+    async def find_one_and_update(self, filter: dict, update, projection: Optional[dict] = None, sort=None,
+                                  upsert: bool = False, return_document=ReturnDocument.BEFORE, **kwargs):
+        doc_ids = self._find_ids(filter)
+        if sort and doc_ids:
+            ordered = sort_documents([self._docs[i] for i in doc_ids], _normalize_sort(sort))
+            doc_ids = [self._ids[ordered[0]["_id"]]]
+        if doc_ids:
+            doc_id = doc_ids[0]
+            before = self._docs[doc_id]
+            after = _clone(before)
+            apply_update(after, update)
+            self._replace(doc_id, after)
+            return project(after if return_document == ReturnDocument.AFTER else before, projection)
+        if not upsert:
+            return None
+        doc = _upsert_seed(filter)
+        apply_update(doc, update, inserting=True)
+        doc.setdefault("_id", ObjectId())
+        self._store(doc)
+        return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, sort=None, **kwargs):
+        doc_ids = self._find_ids(filter)
+        if not doc_ids:
+            return None
+        if sort:
+            ordered = sort_documents([self._docs[i] for i in doc_ids], _normalize_sort(sort))
+            doc_ids = [self._ids[ordered[0]["_id"]]]
+        doc = self._docs[doc_ids[0]]
+        self._delete(doc_ids[0])
+        return project(doc, projection)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        doc_ids = self._find_ids(filter)[:1]
+        for doc_id in doc_ids:
+            self._delete(doc_id)
+        return DeleteResult(len(doc_ids))
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        doc_ids = self._find_ids(filter)
+        for doc_id in doc_ids:
+            self._delete(doc_id)
+        return DeleteResult(len(doc_ids))
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = BulkWriteResult()
+        for request in requests:
+            # pymongo's operation classes keep their arguments in private attributes
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                result.inserted_count += 1
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                r = self._update(request._filter, request._doc, bool(request._upsert), many=isinstance(request, UpdateMany))
+                result.matched_count += r.matched_count
+                result.modified_count += r.modified_count
+                result.upserted_count += r.upserted_id is not None
+            elif isinstance(request, ReplaceOne):
+                r = await self.replace_one(request._filter, request._doc, upsert=bool(request._upsert))
+                result.matched_count += r.matched_count
+                result.upserted_count += r.upserted_id is not None
+            elif isinstance(request, DeleteOne):
+                result.deleted_count += (await self.delete_one(request._filter)).deleted_count
+            else:
+                raise OperationFailure(f"bulk operation {type(request).__name__} is not supported by the in-memory backend")
+        return result
+
+    async def drop(self):
+        self.database._drop(self.name)
+
+    async def rename(self, new_name: str, dropTarget: bool = False, **kwargs):
+        self.database._rename(self.name, new_name, dropTarget)
+
+    def clear(self):
+        self._docs.clear()
+        self._ids.clear()
+        for field, index in list(self._indexes.items()):
+            self._indexes[field] = HashIndex(field, index.unique)
+        for fields in self._unique_keys:
+            self._unique_keys[fields] = UniqueKey(fields)
+
+
+def _group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    keys: Dict[Any, Any] = {}
+    accumulators = {k: v for k, v in spec.items() if k != "_id"}
+    for doc in docs:
+        key = evaluate(spec["_id"], doc)
+        hashable = repr(key)
+        group = groups.get(hashable)
+        if group is None:
+            group = groups[hashable] = {name: None for name in accumulators}
+            keys[hashable] = key
+            group["__count"] = {}
+        for name, accumulator in accumulators.items():
+            (op, expression), = accumulator.items()
+            value = evaluate(expression, doc)
+            current = group[name]
+            if op == "$sum":
+                group[name] = (current or 0) + (value if isinstance(value, (int, float)) else 0)
+            elif op == "$avg":
+                total, count = group["__count"].get(name, (0, 0))
+                if isinstance(value, (int, float)):
+                    total, count = total + value, count + 1
+                group["__count"][name] = (total, count)
+                group[name] = total / count if count else None
+            elif op == "$min":
+                group[name] = value if current is None or (value is not None and value < current) else current
+            elif op == "$max":
+                group[name] = value if current is None or (value is not None and value > current) else current
+            elif op == "$first":
+                if name not in group["__count"]:
+                    group[name] = value
+                    group["__count"][name] = True
+            elif op == "$last":
+                group[name] = value
+            elif op == "$push":
+                group[name] = (current or []) + [value]
+            elif op == "$addToSet":
+                group[name] = current or []
+                if value not in group[name]:
+                    group[name].append(value)
+            else:
+                raise OperationFailure(f"accumulator {op} is not supported by the in-memory backend")
+    out = []
+    for hashable, group in groups.items():
+        group.pop("__count")
+        out.append({"_id": keys[hashable], **group})
+    return out
+
+
+class MemoryDatabase:
+    """Collections are created on first access, like Motor's ``db.<name>``"""
+
+    def __init__(self, name: str = "memory"):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def drop_collection(self, name: str):
+        self._drop(name)
+
+    def clear(self):
+        """Empty every collection in place, keeping indexes and existing references valid"""
+        for collection in self._collections.values():
+            collection.clear()
+
+    def _drop(self, name: str):
+        if name in self._collections:
+            self._collections[name].clear()
+            self._collections[name]._indexes.clear()
+            self._collections[name]._unique_keys.clear()
+
+    def _rename(self, old: str, new: str, drop_target: bool):
+        source = self[old]
+        target = self[new]
+        if target._docs and not drop_target:
+            raise OperationFailure(f"target namespace {self.name}.{new} exists")
+        # Move the contents, so references held to either collection object stay usable
+        target._docs, target._ids, target._next = source._docs, source._ids, source._next
+        target._indexes, target._unique_keys = source._indexes, source._unique_keys
+        source._docs, source._ids, source._next = {}, {}, itertools.count()
+        source._indexes, source._unique_keys = {}, {}
@@ -0,0 +1,384 @@
+"""Multi-tenant mode: one deployment serving many businesses
+
+Each business is a tenant spec - a JSON file in ``TENANTS_DIR`` or a document in the
+``tenants`` collection:
+
+    {
+      "id": "bright-sparks",
+      "hosts": ["chat.brightsparks.com.au"],
+      "api_key_sha256": ["<sha256 hex of the tenant's API key>"],
+      "business": {"name": "Bright Sparks", "phone": "03 9000 0000", ...},
+      "responses": {"greeting": "..."},
+      "faq": [{"keywords": ["ev", "car charger"], "answer": "..."}],
+      "quick_replies": {"collect_suburb": ["Geelong", "Other"]},
+      "emails": {"confirmation": {"subject": "...", "body": "..."}}
+    }
+
+Specs are compiled once (matchers, canned responses, templates - see
+``server.TenantConfig``) into an immutable snapshot. ``TenantRegistry.reload`` compiles
+changed specs in a worker thread and swaps the snapshot reference in one assignment, so
+requests never wait on a reload and a request in flight keeps the config it started
+with. A spec that fails to compile keeps its previous version.
+
+``TenantMiddleware`` resolves the tenant per request, by ``X-API-Key`` first and then the
+Host header, into the ``current_tenant`` context variable. ``ScopedDatabase`` hands out
+collections that add the tenant to every filter, document and index, so the rest of the
+app (and every helper module that takes a collection) stays tenant-unaware. The default
+tenant's documents carry no tenant_id, which keeps single-tenant data as it was.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT_ID = "default"
+TENANT_FIELD = "tenant_id"
+
+current_tenant: ContextVar[Optional["Tenant"]] = ContextVar("current_tenant", default=None)
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def spec_fingerprint(spec: dict) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Tenant:
+    """A tenant's identity plus its compiled config; read-only once built"""
+
+    def __init__(self, spec: dict, config: Any):
+        self.id = spec["id"]
+        # Value stored in tenant_id; the default tenant's documents have none
+        self.scope = None if self.id == DEFAULT_TENANT_ID else self.id
+        self.hosts = {host.lower() for host in spec.get("hosts", [])}
+        self.api_key_hashes = set(spec.get("api_key_sha256", []))
+        self.fingerprint = spec_fingerprint(spec)
+        self.config = config
+
+
+class Snapshot:
+    def __init__(self, tenants: Dict[str, Tenant]):
+        self.tenants = tenants
+        self.default = tenants[DEFAULT_TENANT_ID]
+        self.by_host = {host: t for t in tenants.values() for host in t.hosts}
+        self.by_key = {key: t for t in tenants.values() for key in t.api_key_hashes}
+
+
+# ============== SOURCES ==============
+
+class FileTenantSource:
+    """One ``<id>.json`` spec per tenant in a directory"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    async def fingerprint(self) -> Any:
+        def scan():
+            return tuple(sorted((p.name, p.stat().st_mtime_ns, p.stat().st_size) for p in self.directory.glob("*.json")))
+        return await asyncio.to_thread(scan)
+
+    async def load(self) -> List[dict]:
+        def read():
+            specs = []
+            for path in sorted(self.directory.glob("*.json")):
+                try:
+                    spec = json.loads(path.read_text(encoding="utf-8"))
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping tenant file {path.name}: {e}")
+                    continue
+                spec.setdefault("id", path.stem)
+                specs.append(spec)
+            return specs
+        return await asyncio.to_thread(read)
+
+
+class MongoTenantSource:
+    """Specs stored as documents; bump ``updated_at`` on a change so it is picked up"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def fingerprint(self) -> Any:
+        latest = await self.collection.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
+        return (await self.collection.count_documents({}), (latest or {}).get("updated_at"))
+
+    async def load(self) -> List[dict]:
+        return await self.collection.find({}, {"_id": 0}).to_list(None)
+
+
+# ============== REGISTRY ==============
+
+class TenantRegistry:
+    def __init__(self, compile_config: Callable[[dict], Any], source=None):
+        self.compile_config = compile_config
+        self.source = source
+        self._source_fingerprint = None
+        # The built-in business, used unless a spec with the default id overrides it
+        self.builtin_default = self._build({"id": DEFAULT_TENANT_ID})
+        self.snapshot = Snapshot({DEFAULT_TENANT_ID: self.builtin_default})
+        self.stats = {"reloads": 0, "compiled": 0, "failed": 0}
+
+    def _build(self, spec: dict) -> Tenant:
+        return Tenant(spec, self.compile_config(spec))
+
+    @property
+    def default(self) -> Tenant:
+        return self.snapshot.default
+
+    def get(self, tenant_id: str) -> Optional[Tenant]:
+        return self.snapshot.tenants.get(tenant_id)
+
+    def all(self) -> List[Tenant]:
+        return list(self.snapshot.tenants.values())
+
+    def resolve(self, host: Optional[str], api_key: Optional[str]) -> Optional[Tenant]:
+        snapshot = self.snapshot
+        if api_key:
+            return snapshot.by_key.get(hash_api_key(api_key))
+        if host:
+            return snapshot.by_host.get(host.split(":", 1)[0].lower())
+        return None
+
+    def _compile_changed(self, specs: List[dict]) -> Tuple[Dict[str, Tenant], int, int]:
+        """Runs in a worker thread: recompile only specs whose content changed"""
+        previous = self.snapshot.tenants
+        tenants, compiled, failed = {}, 0, 0
+        for spec in specs:
+            tenant_id = spec.get("id")
+            if not tenant_id or tenant_id in tenants:
+                logger.error(f"Skipping tenant spec with a missing or duplicate id: {tenant_id!r}")
+                failed += 1
+                continue
+            old = previous.get(tenant_id)
+            if old is not None and old.fingerprint == spec_fingerprint(spec):
+                tenants[tenant_id] = old
+                continue
+            try:
+                tenants[tenant_id] = self._build(spec)
+                compiled += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Tenant {tenant_id} config is invalid, keeping the previous version: {e}")
+                if old is not None:
+                    tenants[tenant_id] = old
+        tenants.setdefault(DEFAULT_TENANT_ID, self.builtin_default)
+        return tenants, compiled, failed
+
+    async def reload(self, force: bool = False) -> dict:
+        """Load specs from the source and swap in a new snapshot if anything changed"""
+        if self.source is None:
+            return {"changed": False, "tenants": len(self.snapshot.tenants)}
+        fingerprint = await self.source.fingerprint()
+        if not force and fingerprint == self._source_fingerprint:
+            return {"changed": False, "tenants": len(self.snapshot.tenants)}
+        specs = await self.source.load()
+        tenants, compiled, failed = await asyncio.to_thread(self._compile_changed, specs)
+        self.snapshot = Snapshot(tenants)  # the swap: readers see the old or the new snapshot, never a mix
+        self._source_fingerprint = fingerprint
+        self.stats["reloads"] += 1
+        self.stats["compiled"] += compiled
+        self.stats["failed"] += failed
+        logger.info(f"Loaded {len(tenants)} tenants ({compiled} compiled, {failed} failed)")
+        return {"changed": True, "tenants": len(tenants), "compiled": compiled, "failed": failed}
+
+    async def watch(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Tenant reload failed: {e}")
+
+
+def active_tenant(registry: TenantRegistry) -> Tenant:
+    return current_tenant.get() or registry.default
+
+
+class TenantMiddleware:
+    """Resolve the request's tenant into ``current_tenant``"""
+
+    def __init__(self, app: ASGIApp, registry: TenantRegistry, fallback_to_default: bool = True):
+        self.app = app
+        self.registry = registry
+        self.fallback_to_default = fallback_to_default
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        api_key = headers.get("x-api-key")
+        tenant = self.registry.resolve(headers.get("host"), api_key)
+        if tenant is None:
+            if api_key or not self.fallback_to_default:
+                response = JSONResponse({"detail": "Unknown tenant"}, status_code=401 if api_key else 404)
+                await response(scope, receive, send)
+                return
+            tenant = self.registry.default
+        token = current_tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_tenant.reset(token)
+
+
+# ============== TENANT-SCOPED COLLECTIONS ==============
+
+def _is_exclusion(projection: dict) -> bool:
+    return all(not v for k, v in projection.items() if not isinstance(v, dict))
+
+
+class ScopedCollection:
+    """Wraps a Motor collection so every operation only sees the active tenant's documents
+
+    Filters get ``tenant_id``, inserts and upserts store it, aggregations start with a
+    $match on it, and indexes are prefixed with it. String ``_id``s (rollup and counter
+    documents keyed by name) are prefixed with the tenant id so tenants don't collide.
+    Operations not listed here (drop, rename, ...) act on the whole collection.
+    """
+
+    def __init__(self, collection, scope: Callable[[], Optional[str]]):
+        self.collection = collection
+        self.scope = scope
+
+    def __getattr__(self, name: str):
+        return getattr(self.collection, name)
+
+    def _filter(self, filter_: Optional[dict]) -> dict:
+        scope = self.scope()
+        filter_ = dict(filter_ or {})
+        if scope is not None and isinstance(filter_.get("_id"), str):
+            filter_["_id"] = f"{scope}:{filter_['_id']}"
+        filter_[TENANT_FIELD] = scope  # None also matches documents without the field
+        return filter_
+
+    def _document(self, document: dict) -> dict:
+        scope = self.scope()
+        if scope is None:
+            return document
+        document = {**document, TENANT_FIELD: scope}
+        if isinstance(document.get("_id"), str):
+            document["_id"] = f"{scope}:{document['_id']}"
+        return document
+
+    @staticmethod
+    def _projection(projection: Optional[dict]) -> dict:
+        if projection is None:
+            return {TENANT_FIELD: 0}
+        if _is_exclusion(projection):
+            return {**projection, TENANT_FIELD: 0}
+        return projection
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        return self.collection.find(self._filter(filter), self._projection(projection), *args, **kwargs)
+
+    async def find_one(self, filter=None, projection=None, *args, **kwargs):
+        return await self.collection.find_one(self._filter(filter), self._projection(projection), *args, **kwargs)
+
+    async def count_documents(self, filter, **kwargs):
+        return await self.collection.count_documents(self._filter(filter), **kwargs)
+
+    async def estimated_document_count(self, **kwargs):
+        return await self.collection.count_documents(self._filter({}))
+
+    async def distinct(self, key, filter=None, **kwargs):
+        return await self.collection.distinct(key, self._filter(filter), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.collection.aggregate([{"$match": self._filter({})}] + list(pipeline), **kwargs)
+
+    async def insert_one(self, document, **kwargs):
+        scoped = self._document(document)
+        result = await self.collection.insert_one(scoped, **kwargs)
+        document.setdefault("_id", scoped["_id"])  # like pymongo, the caller's document gets the _id
+        return result
+
+    async def insert_many(self, documents, **kwargs):
+        scoped = [self._document(d) for d in documents]
+        result = await self.collection.insert_many(scoped, **kwargs)
+        for document, stored in zip(documents, scoped):
+            document.setdefault("_id", stored["_id"])
+        return result
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self.collection.update_one(self._filter(filter), update, **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self.collection.update_many(self._filter(filter), update, **kwargs)
+
+    async def replace_one(self, filter, replacement, **kwargs):
+        return await self.collection.replace_one(self._filter(filter), self._document(replacement), **kwargs)
+
+    async def find_one_and_update(self, filter, update, projection=None, **kwargs):
+        return await self.collection.find_one_and_update(self._filter(filter), update, self._projection(projection), **kwargs)
+
+    async def find_one_and_delete(self, filter, projection=None, **kwargs):
+        return await self.collection.find_one_and_delete(self._filter(filter), self._projection(projection), **kwargs)
+
+    async def delete_one(self, filter, **kwargs):
+        return await self.collection.delete_one(self._filter(filter), **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self.collection.delete_many(self._filter(filter), **kwargs)
+
+    async def bulk_write(self, requests, **kwargs):
+        scoped = []
+        for request in requests:
+            # pymongo's operation classes keep their arguments in private attributes
+            if isinstance(request, InsertOne):
+                scoped.append(InsertOne(self._document(request._doc)))
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                scoped.append(type(request)(self._filter(request._filter), request._doc, upsert=request._upsert))
+            elif isinstance(request, ReplaceOne):
+                scoped.append(ReplaceOne(self._filter(request._filter), self._document(request._doc), upsert=request._upsert))
+            elif isinstance(request, DeleteOne):
+                scoped.append(DeleteOne(self._filter(request._filter)))
+            else:
+                raise TypeError(f"Unsupported bulk operation {type(request).__name__}")
+        return await self.collection.bulk_write(scoped, **kwargs)
+
+    async def create_index(self, keys, **kwargs):
+        if "expireAfterSeconds" in kwargs:
+            # TTL indexes must be single-field; expiry needs no tenant prefix
+            return await self.collection.create_index(keys, **kwargs)
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        if kwargs.get("name"):
+            kwargs["name"] = f"{kwargs['name']}_by_tenant"
+        return await self.collection.create_index([(TENANT_FIELD, 1)] + keys, **kwargs)
+
+
+class ScopedDatabase:
+    """Database whose collections are ``ScopedCollection``s bound to the active tenant"""
+
+    def __init__(self, database, scope: Callable[[], Optional[str]]):
+        self.database = database
+        self.scope = scope
+        self._collections: Dict[str, ScopedCollection] = {}
+
+    def __getattr__(self, name: str) -> ScopedCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> ScopedCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = ScopedCollection(self.database[name], self.scope)
+        return collection
+
+    def unscoped(self, name: str):
+        return self.database[name]
@@ -0,0 +1,231 @@
+"""Append-only chat transcripts stored with the bucket pattern
+
+The open bucket is a ``transcript`` array on the conversation document. Messages are
+appended with $push in the same update that saves the conversation state, so recording
+them costs no extra round trip. A turn that leaves the state alone has no update to ride
+on, so its message waits in memory until the session's next state write, until
+``buffer_messages`` are waiting, or until it is ``buffer_seconds`` old (``flush()``, run
+periodically and at shutdown). A crash loses at most those waiting messages. Once the
+open bucket holds ``bucket_size`` messages or ``max_bytes`` of JSON it is sealed into one
+conversation_transcripts document per (session, seq), optionally zlib-compressed, and the
+open bucket starts again empty.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import orjson
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ("", "zlib")
+
+
+def encode_bucket(session_id: str, seq: int, messages: List[dict], compression: str = "") -> dict:
+    """Sealed bucket document; with compression the messages are stored as one zlib blob"""
+    doc = {
+        "session_id": session_id,
+        "seq": seq,
+        "count": len(messages),
+        "started_at": messages[0].get("at"),
+        "ended_at": messages[-1].get("at"),
+        "sealed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if compression == "zlib":
+        doc["encoding"] = "zlib"
+        doc["data"] = zlib.compress(orjson.dumps(messages), 6)
+    else:
+        doc["messages"] = messages
+    return doc
+
+
+def decode_bucket(doc: dict) -> List[dict]:
+    if doc.get("encoding") == "zlib":
+        return orjson.loads(zlib.decompress(doc["data"]))
+    return doc.get("messages", [])
+
+
+class PendingMessages:
+    """Messages held back for one session, with the context (tenant) they were recorded in"""
+    __slots__ = ("entries", "since", "context")
+
+    def __init__(self):
+        self.entries: List[dict] = []
+        self.since = time.monotonic()
+        self.context = contextvars.copy_context()
+
+
+class TranscriptStore:
+    def __init__(self, conversations, buckets, bucket_size: int = 50, max_bytes: int = 64 * 1024,
+                 max_messages: int = 2000, compression: str = "", buffer_messages: int = 20,
+                 buffer_seconds: float = 60.0, partition: Callable[[], Optional[str]] = lambda: None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown transcript compression {compression!r}")
+        self.conversations = conversations
+        self.buckets = buckets
+        self.bucket_size = bucket_size
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.compression = compression
+        self.buffer_messages = buffer_messages
+        self.buffer_seconds = buffer_seconds
+        # Keeps two tenants' sessions apart when they share a session id
+        self.partition = partition
+        self.pending: Dict[Tuple[Optional[str], str], PendingMessages] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    async def ensure_indexes(self):
+        await self.buckets.create_index([("session_id", 1), ("seq", 1)], unique=True)
+        await self.buckets.create_index("ended_at")
+
+    async def save(self, session_id: str, fields: dict, entry: dict, current: dict) -> int:
+        """Write the conversation ``fields`` and append ``entry`` to its transcript in one update"""
+        return await self.save_many(session_id, fields, [entry], current)
+
+    async def save_many(self, session_id: str, fields: dict, entries: List[dict], current: dict) -> int:
+        """Write ``fields`` and append ``entries`` in order, as that many single saves would
+
+        With no ``fields`` to write the entries are held back while the session's buffer has
+        room and isn't due; otherwise they go out after whatever was held back. Returns the
+        number of writes to the conversation (0 when held back).
+        """
+        key = (self.partition(), session_id)
+        held = self.pending.get(key)
+        if not fields and self._can_hold(held, len(entries)):
+            if held is None:
+                held = self.pending[key] = PendingMessages()
+            held.entries.extend(entries)
+            self.counters["held"] += len(entries)
+            return 0
+        if held is not None:
+            del self.pending[key]
+            entries = held.entries + entries
+        return await self._write(session_id, fields, entries, current)
+
+    def _can_hold(self, held: Optional[PendingMessages], count: int) -> bool:
+        if (len(held.entries) if held is not None else 0) + count > self.buffer_messages:
+            return False
+        return held is None or time.monotonic() - held.since < self.buffer_seconds
+
+    async def flush(self, max_age: float = 0.0) -> int:
+        """Write out every session's held-back messages that are at least ``max_age`` seconds
+        old; returns the number of writes to conversations"""
+        now = time.monotonic()
+        due = [key for key, held in self.pending.items() if now - held.since >= max_age]
+        writes = 0
+        for key in due:
+            held = self.pending.pop(key)
+            try:
+                # In the context the messages were recorded in, so a tenant's go to its own conversation
+                writes += await asyncio.create_task(self._flush(key[1], held.entries), context=held.context)
+            except Exception as e:
+                self.counters["flush_failed"] += 1
+                logger.error(f"Failed to flush transcript messages for {key[1]}: {e}")
+        return writes
+
+    async def _flush(self, session_id: str, entries: List[dict]) -> int:
+        current = await self.conversations.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "transcript_count": 1, "transcript_bytes": 1, "transcript_total": 1},
+        )
+        if current is None:
+            self.counters["dropped"] += len(entries)
+            return 0
+        return await self._write(session_id, {}, entries, current)
+
+    async def run_forever(self, on_flushed: Callable[[int], None]):
+        """Flush held-back messages as they come due; ``on_flushed`` gets each pass's write count"""
+        while True:
+            await asyncio.sleep(max(self.buffer_seconds / 4, 1.0))
+            on_flushed(await self.flush(self.buffer_seconds))
+
+    async def _write(self, session_id: str, fields: dict, entries: List[dict], current: dict) -> int:
+        """One update unless the open bucket fills up along the way; each seal is another"""
+        room = max(0, self.max_messages - current.get("transcript_total", 0))
+        if len(entries) > room:
+            # Session cap reached (usually a bot) - keep the state, stop recording
+            self.counters["dropped"] += len(entries) - room
+            entries = entries[:room]
+
+        count = current.get("transcript_count", 0)
+        open_bytes = current.get("transcript_bytes", 0)
+        pending: List[dict] = []
+        pending_bytes = 0
+        writes = 0
+        for i, entry in enumerate(entries):
+            size = len(orjson.dumps(entry))
+            if count + 1 >= self.bucket_size or open_bytes + size >= self.max_bytes:
+                last = i == len(entries) - 1
+                await self._seal(session_id, fields if last else {}, pending + [entry])
+                writes += 1
+                count, open_bytes, pending, pending_bytes = 0, 0, [], 0
+                if last:
+                    return writes
+                continue
+            pending.append(entry)
+            pending_bytes += size
+            count += 1
+            open_bytes += size
+
+        if not pending:
+            if fields:
+                await self.conversations.update_one({"session_id": session_id}, {"$set": fields})
+                writes += 1
+            return writes
+        update = {
+            "$push": {"transcript": pending[0] if len(pending) == 1 else {"$each": pending}},
+            "$inc": {"transcript_count": len(pending), "transcript_bytes": pending_bytes, "transcript_total": len(pending)},
+        }
+        if fields:
+            update["$set"] = fields
+        await self.conversations.update_one({"session_id": session_id}, update)
+        self.counters["appended"] += len(pending)
+        return writes + 1
+
+    async def _seal(self, session_id: str, fields: dict, entries: List[dict]):
+        """Empty the open bucket (atomically taking its contents) and store it with ``entries``"""
+        before = await self.conversations.find_one_and_update(
+            {"session_id": session_id},
+            {
+                "$set": {**fields, "transcript": [], "transcript_count": 0, "transcript_bytes": 0},
+                "$inc": {"transcript_seq": 1, "transcript_total": len(entries)},
+            },
+            projection={"_id": 0, "transcript": 1, "transcript_seq": 1},
+            return_document=ReturnDocument.BEFORE,
+        ) or {}
+        messages = before.get("transcript", []) + entries
+        try:
+            await self.buckets.insert_one(encode_bucket(session_id, before.get("transcript_seq", 0), messages, self.compression))
+        except Exception as e:
+            self.counters["seal_failed"] += 1
+            logger.error(f"Failed to seal transcript bucket for {session_id}: {e}")
+            return
+        self.counters["appended"] += len(entries)
+        self.counters["sealed"] += 1
+
+    async def load(self, session_id: str) -> List[dict]:
+        """Every recorded message for a session, oldest first"""
+        messages = []
+        async for doc in self.buckets.find({"session_id": session_id}, {"_id": 0}).sort("seq", 1):
+            messages.extend(decode_bucket(doc))
+        conversation = await self.conversations.find_one({"session_id": session_id}, {"_id": 0, "transcript": 1})
+        if conversation:
+            messages.extend(conversation.get("transcript", []))
+        held = self.pending.get((self.partition(), session_id))
+        if held is not None:
+            messages.extend(held.entries)
+        return messages
+
+    def stats(self) -> dict:
+        return {
+            "bucket_size": self.bucket_size,
+            "compression": self.compression or "none",
+            "held_sessions": len(self.pending),
+            "counters": dict(self.counters),
+        }
@@ -0,0 +1,48 @@
+"""Shared fixtures: the backend on the in-memory store (STORAGE_BACKEND=memory)"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Set before server is first imported - it reads its configuration at import time
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("DB_NAME", "tests")
+os.environ["RATE_LIMIT_CHAT_IP"] = "0"
+os.environ["RATE_LIMIT_CHAT_SESSION"] = "0"
+os.environ.pop("TENANTS_DIR", None)
+os.environ.pop("TENANTS_SOURCE", None)
+os.environ.pop("ARCHIVE_DIR", None)
+
+
+@pytest.fixture
+def server():
+    import server as module
+    yield module
+    module.db.clear()
+    module.lead_search.indexes.clear()
+    if module.transcript_store is not None:
+        module.transcript_store.pending.clear()
+
+
+@pytest.fixture
+def client(server):
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def chat(client):
+    def send(session_id: str, *messages: str) -> dict:
+        """Send messages in one chat session and return the last reply"""
+        reply = None
+        for message in messages:
+            response = client.post("/api/chat", json={"message": message, "session_id": session_id})
+            assert response.status_code == 200, response.text
+            reply = response.json()
+        return reply
+    return send
@@ -0,0 +1,101 @@
+"""Funnel rollup rebuild: recompute past hours without losing what the live server records"""
+import asyncio
+from datetime import datetime
+
+from analytics import FunnelRollups, configured_tenant_ids, rebuild_funnel, rebuild_tenant_funnels
+from storage import MemoryDatabase
+from tenants import DEFAULT_TENANT_ID, ScopedDatabase
+
+CUTOFF = "2025-03-01T10"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def message(at, state, faq=None):
+    return {"at": at, "message": "...", "state": state, "faq": faq}
+
+
+def seed(db):
+    rollups = FunnelRollups(db.funnel_rollups)
+
+    async def insert():
+        await rollups.ensure_indexes()
+        await db.conversations.insert_many([
+            # Finished before the cutoff
+            {"session_id": "a", "state": "collect_name", "transcript": [
+                message("2025-03-01T08:10:00+00:00", "greeting"),
+                message("2025-03-01T08:11:00+00:00", "collect_name"),
+            ]},
+            # Still going after the cutoff: its later turns were already counted live
+            {"session_id": "b", "state": "collect_phone", "transcript": [
+                message("2025-03-01T09:50:00+00:00", "greeting"),
+                message("2025-03-01T10:05:00+00:00", "collect_name"),
+                message("2025-03-01T10:06:00+00:00", "collect_phone"),
+            ]},
+        ])
+        # What the live server recorded, plus a stale rollup and one recorded while the scan ran
+        await db.funnel_rollups.insert_many([
+            {"_id": "2025-03-01T08|none", "hour": "2025-03-01T08", "first_faq": "none", "reached": {"greeting": 5}},
+            {"_id": "2025-03-01T07|none", "hour": "2025-03-01T07", "first_faq": "none", "reached": {"greeting": 1}},
+            {"_id": "2025-03-01T10|none", "hour": "2025-03-01T10", "first_faq": "none",
+             "reached": {"collect_name": 1, "collect_phone": 2}},
+        ])
+    run(insert())
+    return rollups
+
+
+async def by_hour(db):
+    return {doc["hour"]: doc.get("reached") for doc in await db.funnel_rollups.find({}, {"_id": 0}).to_list(None)}
+
+
+def test_rebuild_replaces_only_hours_before_the_cutoff():
+    db = MemoryDatabase("tests")
+    seed(db)
+
+    stats = run(rebuild_funnel(db, batch_size=1, cutoff=CUTOFF))
+
+    assert (stats["sessions"], stats["rollups"], stats["removed"]) == (2, 2, 1)
+    assert run(by_hour(db)) == {
+        "2025-03-01T08": {"greeting": 1, "collect_name": 1},
+        "2025-03-01T09": {"greeting": 1},
+        "2025-03-01T10": {"collect_name": 1, "collect_phone": 2},  # left as the live server counted it
+    }
+    assert run(db.funnel_rollups_rebuild.count_documents({})) == 0
+
+
+def test_rebuild_keeps_the_live_collection_and_its_index():
+    db = MemoryDatabase("tests")
+    rollups = seed(db)
+    indexes = run(db.funnel_rollups.index_information())
+
+    run(rebuild_funnel(db, cutoff=CUTOFF))
+    run(rollups.record(datetime.fromisoformat("2025-03-01T10:30:00+00:00"), None, {"reached.collect_phone": 1}))
+
+    assert run(db.funnel_rollups.index_information()) == indexes
+    assert run(by_hour(db))["2025-03-01T10"] == {"collect_name": 1, "collect_phone": 3}
+
+
+def test_tenants_are_rebuilt_separately(monkeypatch, tmp_path):
+    raw = MemoryDatabase("tests")
+    scope = {"tenant": None}
+    db = ScopedDatabase(raw, lambda: scope["tenant"])
+    for tenant in (None, "acme"):
+        scope["tenant"] = tenant
+        seed(db)
+    scope["tenant"] = None
+    (tmp_path / "acme.json").write_text('{"business": {"name": "Acme"}}')
+    monkeypatch.setenv("TENANTS_DIR", str(tmp_path))
+    monkeypatch.delenv("TENANTS_SOURCE", raising=False)
+
+    tenant_ids = run(configured_tenant_ids(raw))
+    assert tenant_ids == [DEFAULT_TENANT_ID, "acme"]
+    results = run(rebuild_tenant_funnels(raw, tenant_ids))
+
+    assert {tenant: stats["sessions"] for tenant, stats in results.items()} == {DEFAULT_TENANT_ID: 2, "acme": 2}
+    for tenant in (None, "acme"):
+        scope["tenant"] = tenant
+        assert run(by_hour(db))["2025-03-01T08"] == {"greeting": 1, "collect_name": 1}
+    assert run(raw.funnel_rollups.count_documents({"tenant_id": "acme"})) == 3
+    assert run(raw.funnel_rollups.count_documents({})) == 6
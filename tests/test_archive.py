@@ -0,0 +1,126 @@
+"""Cold archive: moving old completed leads, read-through, and what must stay hot"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from archive import ColdArchive
+
+OLD = (datetime.now(timezone.utc) - timedelta(days=400)).isoformat()
+RECENT = (datetime.now(timezone.utc) - timedelta(days=10)).isoformat()
+
+
+@pytest.fixture
+def archive(server, client, tmp_path, monkeypatch):
+    cold = ColdArchive(tmp_path, server.db.leads, server.db.email_logs, server.db.job_cursors,
+                       on_moved=server.leads_archived)
+    monkeypatch.setattr(server, "cold_archive", cold)
+    monkeypatch.setattr(server.lead_search, "archive", cold)
+    return cold
+
+
+@pytest.fixture
+def add_lead(server, client):
+    def add(name, completed_at=OLD, logs=1, **fields):
+        lead = server.Lead(name=name, phone="0412 345 678", suburb="Berwick", job_description=f"{name} switchboard",
+                           status="completed", completed_at=completed_at, **fields).model_dump()
+        email_logs = [server.make_email_log(lead, "confirmation", {"subject": "Thanks", "body": "..."}, True)
+                      for _ in range(logs)]
+
+        async def insert():
+            await server.db.leads.insert_one(dict(lead))
+            if email_logs:
+                await server.db.email_logs.insert_many([dict(log) for log in email_logs])
+        client.portal.call(insert)
+        return lead
+    return add
+
+
+def test_run_moves_old_completed_leads(server, client, archive, add_lead):
+    old = add_lead("Olga")
+    recent = add_lead("Rita", completed_at=RECENT)
+
+    stats = client.portal.call(archive.run)
+
+    assert (stats["leads"], stats["email_logs"], stats["batches"]) == (1, 1, 1)
+    assert [lead["id"] for lead in client.get("/api/leads").json()] == [recent["id"]]
+    assert client.get("/api/archive").json()["archived"] == {OLD[:7]: {"leads": 1, "email_logs": 1}}
+    # A second pass has nothing left to do
+    assert client.portal.call(archive.run)["leads"] == 0
+    assert client.portal.call(archive.find_lead, old["id"])["name"] == "Olga"
+
+
+def test_archived_leads_read_through(server, client, archive, add_lead):
+    old = add_lead("Olga", logs=2)
+    client.portal.call(archive.run)
+
+    preview = client.get(f"/api/email/preview/{old['id']}")
+    assert preview.status_code == 200
+    assert "Olga" in preview.json()["review_request"]["body"]
+
+    logs = client.get("/api/email/logs", params={"lead_id": old["id"]}).json()
+    assert len(logs) == 2
+
+    results = client.get("/api/leads/search", params={"q": "Olga"}).json()["results"]
+    assert [(lead["id"], lead["archived"]) for lead in results] == [(old["id"], True)]
+
+
+def test_run_only_deletes_what_it_wrote(server, client, archive, add_lead, monkeypatch):
+    moved = add_lead("Olga")
+    changed = add_lead("Cara")
+    reopened = add_lead("Bea")
+    late_log = server.make_email_log(moved, "quote", {"subject": "Quote", "body": "..."}, True)
+
+    async def change_mid_batch():
+        await server.db.leads.update_one({"id": changed["id"]}, {"$set": {"quote_sent": True}})
+        await server.db.leads.update_one({"id": reopened["id"]}, {"$set": {"status": "booked", "completed_at": None}})
+        await server.db.email_logs.insert_one(dict(late_log))
+
+    write_batch = archive._write_batch
+    batches = []
+
+    def write_then_change(directory, leads, email_logs):
+        written = write_batch(directory, leads, email_logs)
+        if not batches:
+            client.portal.call(change_mid_batch)
+        batches.append([lead["id"] for lead in leads])
+        return written
+    monkeypatch.setattr(archive, "_write_batch", write_then_change)
+
+    stats = client.portal.call(archive.run)
+
+    # The updated lead is still due, so the next batch archives it as it is now
+    assert batches[1] == [changed["id"]]
+    assert (stats["leads"], stats["email_logs"], stats["batches"]) == (2, 2, 2)
+    assert client.portal.call(archive.find_lead, changed["id"])["quote_sent"] is True
+    # The reopened lead stays hot, and its stale archived copy is released
+    assert [lead["id"] for lead in client.get("/api/leads").json()] == [reopened["id"]]
+    assert client.portal.call(archive.find_lead, reopened["id"]) is None
+    assert client.get("/api/leads/search", params={"q": "Bea"}).json()["total"] == 1
+    assert client.get("/api/archive").json()["archived"] == {OLD[:7]: {"leads": 2, "email_logs": 2}}
+    # The log written after the batch was read isn't in the archive, so it must stay hot
+    logs = client.get("/api/email/logs", params={"lead_id": moved["id"]}).json()
+    assert sorted(log["email_type"] for log in logs) == ["confirmation", "quote"]
+
+
+def test_review_request_for_archived_lead_is_sent_once(server, client, archive, add_lead):
+    old = add_lead("Olga")
+    client.portal.call(archive.run)
+
+    first = client.post("/api/email/send-review-request", params={"lead_id": old["id"]})
+    assert first.status_code == 200
+    second = client.post("/api/email/send-review-request", params={"lead_id": old["id"]})
+    assert second.status_code == 409
+
+
+def test_review_request_not_repeated_for_flagged_lead(server, client, add_lead):
+    lead = add_lead("Rita", completed_at=RECENT, review_requested=True)
+
+    response = client.post("/api/email/send-review-request", params={"lead_id": lead["id"]})
+    assert response.status_code == 409
+
+
+def test_archiving_requires_archive_dir(server, client):
+    assert server.cold_archive is None  # ARCHIVE_DIR isn't set for the tests
+
+    assert client.post("/api/archive/run").status_code == 400
+    assert client.get("/api/archive").json()["status"] == "disabled"
@@ -0,0 +1,21 @@
+"""Email preview caching: the ETag follows the lead and the tenant's templates"""
+from tenants import DEFAULT_TENANT_ID, Snapshot
+
+
+def test_preview_etag_changes_with_tenant_templates(server, client, monkeypatch):
+    lead = server.Lead(name="Alice Smith", phone="0412 345 678", suburb="Berwick", job_description="Lights").model_dump()
+    client.portal.call(server.db.leads.insert_one, lead)
+    lead_id = lead["id"]
+    first = client.get(f"/api/email/preview/{lead_id}")
+    etag = first.headers["etag"]
+    assert client.get(f"/api/email/preview/{lead_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    # A reload that changes the review request template, with no lead changed
+    spec = {"id": DEFAULT_TENANT_ID, "emails": {"review_request": {"subject": "Rate us, {name}"}}}
+    monkeypatch.setattr(server.tenant_registry, "snapshot",
+                        Snapshot({DEFAULT_TENANT_ID: server.tenant_registry._build(spec)}))
+
+    second = client.get(f"/api/email/preview/{lead_id}", headers={"If-None-Match": etag})
+    assert second.status_code == 200
+    assert second.json()["review_request"]["subject"] == "Rate us, Alice Smith"
+    assert second.headers["etag"] != etag
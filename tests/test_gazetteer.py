@@ -0,0 +1,85 @@
+"""Suburb lookup and suggestions, in the chat flow and backfilled onto older leads"""
+import pytest
+
+from gazetteer import get_gazetteer, normalize_suburb
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Berwick", ("Berwick", "3806", 0)),
+    ("cranbourne nth", ("Cranbourne North", "3977", 0)),
+    ("Mt Eliza", ("Mount Eliza", "3930", 0)),
+    ("Clyde Nth VIC 3978", ("Clyde North", "3978", 0)),
+    ("cranborne", ("Cranbourne", "3977", 1)),
+    ("Pakenam", ("Pakenham", "3810", 1)),
+])
+def test_lookup(text, expected):
+    assert tuple(get_gazetteer().lookup(text)) == expected
+
+
+@pytest.mark.parametrize("text", ["Zzzz", "Other", "3806", ""])
+def test_lookup_rejects_unknown_or_ambiguous(text):
+    # 3806 is both Berwick and Harkaway
+    assert get_gazetteer().lookup(text) is None
+
+
+def test_normalize_suburb_pulls_out_postcode():
+    assert normalize_suburb("St. Kilda, VIC 3182") == ("st kilda", "3182")
+
+
+def test_suggest_prefix_then_postcode():
+    gazetteer = get_gazetteer()
+    assert [s.name for s in gazetteer.suggest("Glen", 4)] == ["Glen Huntly", "Glen Iris", "Glen Waverley", "Glenroy"]
+    assert [s.name for s in gazetteer.suggest("3806")] == ["Berwick", "Harkaway"]
+
+
+def test_chat_suggests_suburbs_for_unrecognised_input(client, chat):
+    chat("s1", "I want to book a job", "Alice Smith", "0412 345 678")
+
+    reply = chat("s1", "Glen")
+    assert reply["action"] == "collect_suburb"
+    assert reply["quick_replies"] == ["Glen Huntly", "Glen Iris", "Glen Waverley", "Glenroy", "Glen"]
+
+    reply = chat("s1", "Glen Iris", "Downlights")
+    assert reply["action"] == "lead_saved"
+    lead = client.get("/api/leads").json()[0]
+    assert (lead["suburb_canonical"], lead["postcode"]) == ("Glen Iris", "3146")
+
+
+def test_chat_keeps_suburb_sent_again_as_typed(client, chat):
+    chat("s1", "I want to book a job", "Alice Smith", "0412 345 678")
+
+    assert chat("s1", "Wodonga NSW")["action"] == "collect_suburb"
+    assert chat("s1", "Wodonga NSW")["action"] == "collect_job"
+    chat("s1", "Downlights")
+    lead = client.get("/api/leads").json()[0]
+    assert (lead["suburb"], lead["suburb_canonical"]) == ("Wodonga NSW", None)
+
+
+LEGACY_LEADS = [
+    {"id": "old", "name": "Olga", "phone": "0412 345 678", "suburb": "cranbourne nth",
+     "job_description": "Fan", "created_at": "2024-01-01T00:00:00+00:00", "status": "new"},
+    {"id": "odd", "name": "Oscar", "phone": "n/a", "suburb": "Zzzz",
+     "job_description": "Fan", "created_at": "2024-01-01T00:00:00+00:00", "status": "new"},
+]
+
+
+def test_backfill_fills_legacy_leads(server, client):
+    async def run():
+        await server.db.job_cursors.delete_many({})  # startup has already recorded the backfill as done
+        await server.db.leads.insert_many([dict(lead) for lead in LEGACY_LEADS])
+        first = await server.backfill_lead_fields(batch_size=1)
+        return first["suburb_canonical"], await server.backfill_lead_fields()
+    assert client.portal.call(run) == (2, {})
+
+    leads = {lead["id"]: lead for lead in client.get("/api/leads").json()}
+    assert (leads["old"]["suburb_canonical"], leads["old"]["postcode"]) == ("Cranbourne North", "3977")
+    assert (leads["odd"]["suburb_canonical"], leads["odd"]["postcode"]) == (None, None)
+
+
+def test_finished_backfill_is_not_rerun(server, client):
+    async def run():
+        await server.db.leads.insert_many([dict(lead) for lead in LEGACY_LEADS])
+        return await server.backfill_lead_fields(), await server.db.leads.find_one({"id": "old"})
+    updated, lead = client.portal.call(run)
+    assert updated == {}
+    assert "suburb_canonical" not in lead
@@ -0,0 +1,89 @@
+"""Chat lead capture and repeat-enquiry merging by phone number"""
+import pytest
+
+
+@pytest.fixture
+def book(chat):
+    def send(session_id, name, phone, suburb, job):
+        return chat(session_id, "I want to book a job", name, phone, suburb, job)
+    return send
+
+
+def test_chat_creates_lead(client, book):
+    reply = book("s1", "Alice Smith", "0412 345 678", "Berwick", "Switchboard upgrade")
+    assert reply["action"] == "lead_saved"
+    assert reply["lead_data"]["name"] == "Alice Smith"
+
+    leads = client.get("/api/leads").json()
+    assert len(leads) == 1
+    assert leads[0]["phone_e164"] == "+61412345678"
+    assert leads[0]["suburb_canonical"] == "Berwick"
+
+
+def test_repeat_enquiry_merges_into_open_lead(client, book):
+    book("s1", "Alice Smith", "0412 345 678", "Berwick", "Switchboard upgrade")
+    book("s2", "Alice Smith", "+61 412 345 678", "Berwick", "Two new powerpoints")
+
+    leads = client.get("/api/leads").json()
+    assert len(leads) == 1
+    assert leads[0]["enquiry_count"] == 2
+    assert leads[0]["enquiries"][0]["job_description"] == "Two new powerpoints"
+
+
+def test_merge_reply_does_not_reveal_the_match(client, book):
+    first = book("victim", "Alice Smith", "0412 345 678", "Berwick", "Switchboard upgrade at 12 Secret St")
+    merged = book("attacker", "Mallory", "0412345678", "Pakenham", "Lights")
+    fresh = book("other", "Mallory", "0412000111", "Pakenham", "Lights")
+
+    # The same reply as for a number with no open lead, and not the open lead's id
+    assert merged["response"] == fresh["response"].replace("0412000111", "0412345678")
+    assert list(merged["lead_data"]) == list(fresh["lead_data"])
+    assert {k: v for k, v in merged["lead_data"].items() if k not in ("id", "phone", "created_at")} == \
+        {k: v for k, v in fresh["lead_data"].items() if k not in ("id", "phone", "created_at")}
+    assert merged["lead_data"]["id"] != first["lead_data"]["id"]
+    assert "Alice" not in merged["response"] and "Secret" not in merged["response"]
+
+    # The stored lead keeps the original customer, with the new enquirer's name on the enquiry
+    lead = next(lead for lead in client.get("/api/leads").json() if lead["id"] == first["lead_data"]["id"])
+    assert lead["name"] == "Alice Smith"
+    assert lead["enquiries"][0]["name"] == "Mallory"
+    assert lead["enquiries"][0]["id"] == merged["lead_data"]["id"]
+
+
+def test_urgent_repeat_enquiry_texts_the_team(server, client, book, monkeypatch):
+    submitted = []
+    submit = server.outbound.submit
+
+    async def record(lane, fn, *args):
+        future = await submit(lane, fn, *args)
+        submitted.append((lane, fn.__name__, future))
+        return future
+    monkeypatch.setattr(server.outbound, "submit", record)
+
+    book("s1", "Alice Smith", "0412 345 678", "Berwick", "Switchboard upgrade")
+    assert [(lane, name) for lane, name, _ in submitted] == [("normal", "send_confirmation_email")]
+    book("s2", "Alice Smith", "0412 345 678", "Berwick", "EMERGENCY switchboard sparking, no power")
+
+    assert [(lane, name) for lane, name, _ in submitted[1:]] == [("urgent", "send_sms")]
+
+    async def wait():
+        return [await future for _, _, future in submitted]
+    assert client.portal.call(wait)[1] is True
+    lead = client.get("/api/leads").json()[0]
+    assert (lead["urgency"], lead["enquiry_count"], lead["sms_sent"]) == ("urgent", 2, True)
+
+
+def test_older_leads_get_phone_backfilled_and_merge(server, client, book):
+    async def insert_and_backfill():
+        await server.db.job_cursors.delete_many({})  # startup has already recorded the backfill as done
+        await server.db.leads.insert_one({
+            "id": "old", "name": "Olga", "phone": "0412 345 678", "suburb": "Berwick", "job_description": "Fan",
+            "created_at": server.datetime.now(server.timezone.utc).isoformat(), "status": "new",
+        })
+        return await server.backfill_lead_fields()
+    assert client.portal.call(insert_and_backfill)["phone_e164"] == 1
+
+    book("s1", "Olga", "0412345678", "Berwick", "Lights")
+    leads = client.get("/api/leads").json()
+    assert [(lead["id"], lead["phone_e164"]) for lead in leads] == [("old", "+61412345678")]
+    assert [enquiry["job_description"] for enquiry in leads[0]["enquiries"]] == ["Lights"]
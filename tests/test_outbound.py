@@ -0,0 +1,42 @@
+"""OutboundDispatcher shutdown: drain what's queued, drop (and log) what doesn't finish in time"""
+import asyncio
+import logging
+
+from outbound import OutboundDispatcher
+
+
+def test_stop_drains_queued_jobs():
+    async def run():
+        dispatcher = OutboundDispatcher(workers=2, reserved_urgent=1)
+        sent = []
+
+        async def send(n):
+            await asyncio.sleep(0.01)
+            sent.append(n)
+        futures = [await dispatcher.submit("bulk", send, n) for n in range(5)]
+        await dispatcher.stop(timeout=5)
+
+        assert sorted(sent) == list(range(5))
+        assert all(f.done() and not f.cancelled() for f in futures)
+        assert dispatcher.pending() == 0
+    asyncio.run(run())
+
+
+def test_stop_drops_and_logs_what_misses_the_deadline(caplog):
+    async def run():
+        dispatcher = OutboundDispatcher(workers=2, reserved_urgent=1)
+
+        async def hang():
+            await asyncio.sleep(60)
+        running = await dispatcher.submit("normal", hang)
+        await asyncio.sleep(0)
+        queued = await dispatcher.submit("bulk", hang)
+        with caplog.at_level(logging.WARNING, logger="outbound"):
+            await dispatcher.stop(timeout=0.05)
+
+        assert running.cancelled() and queued.cancelled()
+        assert dispatcher.pending() == 0
+    asyncio.run(run())
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Outbound: cancelling 1 job(s) still running after 0.05s" in messages
+    assert "Outbound bulk job hang dropped at shutdown" in messages
@@ -0,0 +1,151 @@
+"""HttpPool's per-host circuit breaker and provider response handling"""
+import asyncio
+
+import httpx
+import pytest
+
+from providers import (CircuitOpenError, EmailMessage, EmailProvider, HttpPool, ProviderError, ResendProvider,
+                       SmsMessage, SmsProvider, TwilioProvider)
+
+URL = "https://provider.test/send"
+
+
+def make_pool(handler, **kwargs) -> HttpPool:
+    return HttpPool(http2=False, failure_threshold=2, reset_seconds=60, transport=httpx.MockTransport(handler), **kwargs)
+
+
+def status(code: int, **kwargs):
+    return lambda request: httpx.Response(code, **kwargs)
+
+
+def breaker(pool: HttpPool):
+    return pool.hosts["provider.test"].breaker
+
+
+def half_open(pool: HttpPool):
+    """Skip the reset wait"""
+    breaker(pool).opened_at -= breaker(pool).reset_seconds
+
+
+def trip(pool: HttpPool):
+    """Open the host's circuit as enough failures would, and go straight to half-open"""
+    for _ in range(pool.failure_threshold):
+        pool._host(URL).breaker.record_failure()
+    half_open(pool)
+
+
+async def fail_until_open(pool: HttpPool):
+    for _ in range(pool.failure_threshold):
+        with pytest.raises(ProviderError):
+            await pool.request("POST", URL)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    async def run():
+        pool = make_pool(status(503))
+        await fail_until_open(pool)
+        assert breaker(pool).state == "open"
+        with pytest.raises(CircuitOpenError):
+            await pool.request("POST", URL)
+        assert pool.stats()["hosts"]["provider.test"]["rejected"] == 1
+    asyncio.run(run())
+
+
+def test_client_errors_do_not_count_against_the_host():
+    async def run():
+        pool = make_pool(status(400))
+        for _ in range(5):
+            assert (await pool.request("POST", URL)).status_code == 400
+        assert breaker(pool).state == "closed"
+    asyncio.run(run())
+
+
+def test_half_open_trial_closes_or_reopens_the_circuit():
+    async def run():
+        responses = iter([503, 503, 503, 200])
+        pool = make_pool(lambda request: httpx.Response(next(responses)))
+        await fail_until_open(pool)
+
+        half_open(pool)
+        with pytest.raises(ProviderError):
+            await pool.request("POST", URL)  # the trial fails
+        assert breaker(pool).state == "open"
+        assert breaker(pool).times_opened == 2
+
+        half_open(pool)
+        assert (await pool.request("POST", URL)).status_code == 200
+        assert breaker(pool).state == "closed"
+    asyncio.run(run())
+
+
+def test_only_one_trial_while_half_open():
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200)
+        pool = make_pool(handler)
+        trip(pool)
+
+        trial = asyncio.create_task(pool.request("POST", URL))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await pool.request("POST", URL)
+        release.set()
+        assert (await trial).status_code == 200
+    asyncio.run(run())
+
+
+def test_cancelled_trial_frees_the_circuit():
+    async def run():
+        async def handler(request):
+            await asyncio.sleep(60)
+        pool = make_pool(handler)
+        trip(pool)
+
+        trial = asyncio.create_task(pool.request("POST", URL))
+        await asyncio.sleep(0)
+        assert breaker(pool).trial_running
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not breaker(pool).trial_running
+        assert breaker(pool).allow()
+    asyncio.run(run())
+
+
+def test_unexpected_error_in_trial_frees_the_circuit():
+    async def run():
+        def handler(request):
+            raise RuntimeError("bug in a transport")
+        pool = make_pool(handler)
+        trip(pool)
+
+        with pytest.raises(RuntimeError):
+            await pool.request("POST", URL)
+        assert breaker(pool).state == "half_open"
+        assert breaker(pool).allow()
+    asyncio.run(run())
+
+
+def test_success_without_a_json_body_still_counts_as_sent():
+    async def run():
+        pool = make_pool(lambda request: httpx.Response(200 if "resend" in request.url.host else 201, text="OK"))
+        resend = ResendProvider(pool, "key", "jobs@sparky.test", base_url="https://resend.test")
+        twilio = TwilioProvider(pool, "AC1", "token", "+61400000000", base_url="https://twilio.test")
+
+        email = EmailMessage("a@example.com", "Alice", "Hi", "Body")
+        results = await resend.send_batch([email, email])
+        assert [(r.ok, r.message_id) for r in results] == [(True, None), (True, None)]
+        assert (await resend.send(email)).ok
+        sms = await twilio.send(SmsMessage("+61412345678", "Hi"))
+        assert (sms.ok, sms.message_id) == (True, None)
+    asyncio.run(run())
+
+
+def test_provider_bases_are_abstract():
+    with pytest.raises(TypeError):
+        EmailProvider()
+    with pytest.raises(TypeError):
+        SmsProvider()
@@ -0,0 +1,111 @@
+"""Token buckets, client IP resolution and the chat rate limit"""
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from rate_limit import InMemoryBucketStore, RateLimit, RateLimiter, parse_rate
+
+
+def make_request(forwarded=None, peer="10.0.0.1"):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+def test_parse_rate():
+    assert parse_rate("30/60") == RateLimit(30, 60.0)
+    assert parse_rate("5") == RateLimit(5, 60.0)
+    assert parse_rate("0") is None
+    assert parse_rate("") is None
+
+
+def test_bucket_allows_burst_then_refills():
+    store = InMemoryBucketStore()
+    limit = RateLimit(2, 10)
+    assert store.consume("k", limit, now=0)[0]
+    assert store.consume("k", limit, now=0)[0]
+    allowed, retry_after = store.consume("k", limit, now=0)
+    assert not allowed
+    assert retry_after == pytest.approx(5.0)
+    assert store.consume("k", limit, now=5)[0]
+
+
+def test_bucket_cost():
+    store = InMemoryBucketStore()
+    limit = RateLimit(5, 5)
+    assert store.consume("k", limit, now=0, cost=4)[0]
+    allowed, retry_after = store.consume("k", limit, now=0, cost=3)
+    assert not allowed
+    assert retry_after == pytest.approx(2.0)
+
+
+def test_sweep_keeps_buckets_within_their_own_window():
+    store = InMemoryBucketStore(max_keys=3)
+    slow, fast = RateLimit(2, 600), RateLimit(100, 10)
+    store.consume("session", slow, now=0)
+    store.consume("session", slow, now=0)
+    store.consume("ip:old", fast, now=0)
+    # The sweep triggered by short-window buckets must not reset the drained long-window one
+    store.consume("ip:a", fast, now=100)
+    store.consume("ip:b", fast, now=100)
+    assert set(store._buckets) == {"session", "ip:a", "ip:b"}
+    assert not store.consume("session", slow, now=100)[0]
+
+
+def test_sweep_drops_refilled_buckets():
+    store = InMemoryBucketStore(max_keys=2)
+    limit = RateLimit(10, 10)
+    store.consume("old", limit, now=0)
+    store.consume("a", limit, now=50)
+    store.consume("b", limit, now=50)
+    assert set(store._buckets) == {"a", "b"}
+
+
+def test_limiter_rejects_when_any_scope_is_exhausted():
+    limiter = RateLimiter({"chat": {"ip": RateLimit(5, 60), "session": RateLimit(2, 60)}})
+    check = lambda session: asyncio.run(limiter.check("chat", ip="1.2.3.4", session=session))
+    assert check("s1") is None
+    assert check("s1") is None
+    assert check("s1") is not None
+    assert check("s2") is None
+    assert limiter.counters["chat.session.rejected_local"] == 1
+
+
+def test_client_ip_ignores_forwarded_for_by_default(server):
+    assert server.TRUST_PROXY_HEADERS is False
+    assert server.client_ip(make_request("203.0.113.9")) == "10.0.0.1"
+
+
+@pytest.mark.parametrize("hops, forwarded, expected", [
+    (1, "198.51.100.7", "198.51.100.7"),
+    (1, "spoofed, 198.51.100.7", "198.51.100.7"),
+    (2, "spoofed, 198.51.100.7, 10.1.1.1", "198.51.100.7"),
+    (3, "198.51.100.7, 10.1.1.1", "198.51.100.7"),
+])
+def test_client_ip_counts_trusted_hops_from_the_right(server, monkeypatch, hops, forwarded, expected):
+    monkeypatch.setattr(server, "TRUST_PROXY_HEADERS", True)
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", hops)
+    assert server.client_ip(make_request(forwarded)) == expected
+
+
+@pytest.fixture
+def strict_chat_limit(server, monkeypatch):
+    monkeypatch.setattr(server, "rate_limiter", RateLimiter({"chat": {"ip": RateLimit(3, 60), "session": RateLimit(20, 60)}}))
+
+
+def post_chats(client, forwarded_for):
+    return [
+        client.post("/api/chat", json={"message": "hi", "session_id": f"s{i}"},
+                    headers={"X-Forwarded-For": forwarded_for(i)}).status_code
+        for i in range(5)
+    ]
+
+
+def test_chat_limit_ignores_spoofed_forwarded_for_by_default(client, strict_chat_limit):
+    assert post_chats(client, lambda i: f"203.0.113.{i}") == [200, 200, 200, 429, 429]
+
+
+def test_chat_limit_uses_proxy_appended_address(server, client, strict_chat_limit, monkeypatch):
+    monkeypatch.setattr(server, "TRUST_PROXY_HEADERS", True)
+    # The client rotates its own entry; the proxy appends the address it actually saw
+    assert post_chats(client, lambda i: f"203.0.113.{i}, 198.51.100.7") == [200, 200, 200, 429, 429]
@@ -0,0 +1,201 @@
+"""MemoryDatabase: the Mongo query and update semantics the app relies on"""
+import asyncio
+
+import pytest
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from storage import MemoryDatabase
+
+
+@pytest.fixture
+def leads():
+    return MemoryDatabase("tests").leads
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def ids(collection, query, **kwargs):
+    return [doc["id"] for doc in await collection.find(query, {"_id": 0}, **kwargs).to_list(None)]
+
+
+@pytest.fixture
+def seeded(leads):
+    run(leads.insert_many([
+        {"id": "a", "status": "new", "tags": ["urgent", "ev"], "score": 3, "contact": {"phone": "+61400000001"}},
+        {"id": "b", "status": "completed", "tags": [], "score": 7, "completed_at": "2025-01-02"},
+        {"id": "c", "status": "booked", "score": None},
+        {"id": "d", "status": "new", "score": "high"},
+    ]))
+    return leads
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"status": "new"}, ["a", "d"]),
+    ({"tags": "ev"}, ["a"]),  # equality matches any array element
+    ({"tags": []}, ["b"]),  # ... or the whole array
+    ({"contact.phone": "+61400000001"}, ["a"]),
+    ({"score": None}, ["c"]),  # null matches missing and null; every document here has score
+    ({"completed_at": None}, ["a", "c", "d"]),
+    ({"completed_at": {"$exists": False}}, ["a", "c", "d"]),
+    ({"score": {"$exists": True}}, ["a", "b", "c", "d"]),
+    ({"status": {"$ne": "new"}}, ["b", "c"]),
+    ({"tags": {"$ne": "ev"}}, ["b", "c", "d"]),
+    ({"status": {"$in": ["booked", "completed"]}}, ["b", "c"]),
+    ({"tags": {"$nin": ["urgent"]}}, ["b", "c", "d"]),
+    ({"score": {"$gte": 3}}, ["a", "b"]),  # comparisons skip null and other types
+    ({"score": {"$lt": "z"}}, ["d"]),
+    ({"$or": [{"status": "booked"}, {"score": {"$gt": 5}}]}, ["b", "c"]),
+    ({"$and": [{"status": "new"}, {"tags": "urgent"}]}, ["a"]),
+    ({"$nor": [{"status": "new"}, {"status": "booked"}]}, ["b"]),
+])
+def test_filters(seeded, query, expected):
+    assert sorted(run(ids(seeded, query))) == expected
+
+
+def test_unknown_operator_raises(seeded):
+    with pytest.raises(OperationFailure):
+        run(seeded.find_one({"score": {"$regex": "h"}}))
+
+
+def test_sort_skip_limit_and_missing_first(seeded):
+    assert run(ids(seeded, {}, sort=[("completed_at", -1), ("id", 1)])) == ["b", "a", "c", "d"]
+    assert run(seeded.find({}, {"_id": 0, "id": 1}).sort("id", -1).skip(1).limit(2).to_list(None)) == \
+        [{"id": "c"}, {"id": "b"}]
+
+
+def test_projection(seeded):
+    assert run(seeded.find_one({"id": "a"}, {"_id": 0, "id": 1, "contact.phone": 1})) == \
+        {"id": "a", "contact": {"phone": "+61400000001"}}
+    doc = run(seeded.find_one({"id": "a"}, {"tags": 0}))
+    assert "tags" not in doc and "_id" in doc
+
+
+def test_returned_documents_are_copies(seeded):
+    doc = run(seeded.find_one({"id": "a"}, {"_id": 0}))
+    doc["tags"].append("changed")
+    assert run(seeded.find_one({"id": "a"}, {"_id": 0}))["tags"] == ["urgent", "ev"]
+
+
+def test_insert_sets_id_on_callers_dict(leads):
+    doc = {"id": "x"}
+    result = run(leads.insert_one(doc))
+    assert doc["_id"] == result.inserted_id
+
+
+def test_update_operators(seeded):
+    result = run(seeded.update_one({"id": "a"}, {
+        "$set": {"contact.email": "a@example.com"},
+        "$unset": {"score": ""},
+        "$inc": {"enquiry_count": 1},
+        "$push": {"tags": {"$each": ["solar", "ev"]}},
+        "$addToSet": {"labels": "vip"},
+    }))
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    doc = run(seeded.find_one({"id": "a"}, {"_id": 0}))
+    assert doc == {"id": "a", "status": "new", "tags": ["urgent", "ev", "solar", "ev"], "enquiry_count": 1,
+                   "contact": {"phone": "+61400000001", "email": "a@example.com"}, "labels": ["vip"]}
+
+
+def test_update_reports_unmodified_and_many(seeded):
+    assert run(seeded.update_one({"id": "a"}, {"$set": {"status": "new"}})).modified_count == 0
+    result = run(seeded.update_many({"status": "new"}, {"$set": {"status": "contacted"}}))
+    assert (result.matched_count, result.modified_count) == (2, 2)
+    with pytest.raises(ValueError):
+        run(seeded.update_one({"id": "a"}, {"status": "replaced"}))
+    with pytest.raises(OperationFailure):
+        run(seeded.update_one({"id": "a"}, {"$set": {"_id": 1}}))
+
+
+def test_upsert_seeds_from_equality_filter(leads):
+    update = {"$inc": {"count": 1}, "$setOnInsert": {"created": True}}
+    result = run(leads.update_one({"_id": "k", "kind": {"$eq": "hour"}, "n": {"$gt": 1}}, update, upsert=True))
+    assert result.upserted_id == "k"
+    run(leads.update_one({"_id": "k"}, update, upsert=True))
+    assert run(leads.find_one({"_id": "k"})) == {"_id": "k", "kind": "hour", "count": 2, "created": True}
+
+
+def test_pipeline_update(leads):
+    """Field references only, as the review campaign's completed_at backfill uses"""
+    run(leads.insert_many([{"_id": 1, "created_at": "2025-01-01"}, {"_id": 2, "created_at": "2025-02-01"}]))
+    run(leads.update_many({}, [{"$set": {"completed_at": "$created_at", "meta": {"from": "$created_at"}}},
+                               {"$unset": "created_at"}]))
+    assert run(leads.find_one({"_id": 2})) == {"_id": 2, "completed_at": "2025-02-01", "meta": {"from": "2025-02-01"}}
+    with pytest.raises(OperationFailure):
+        run(leads.update_one({"_id": 1}, [{"$set": {"n": {"$add": ["$n", 1]}}}]))
+
+
+def test_find_one_and_update_and_delete(seeded):
+    before = run(seeded.find_one_and_update({"status": "new"}, {"$set": {"status": "booked"}},
+                                            {"_id": 0, "id": 1, "status": 1}, sort=[("id", -1)]))
+    assert before == {"id": "d", "status": "new"}
+    after = run(seeded.find_one_and_update({"id": "zz"}, {"$set": {"status": "new"}}, {"_id": 0},
+                                           upsert=True, return_document=ReturnDocument.AFTER))
+    assert after == {"id": "zz", "status": "new"}
+    assert run(seeded.find_one_and_delete({"status": "booked"}, {"_id": 0, "id": 1}, sort=[("id", 1)])) == {"id": "c"}
+    assert run(seeded.count_documents({"status": "booked"})) == 1
+
+
+def test_indexes_follow_writes(leads):
+    run(leads.create_index("phone", unique=True))
+    run(leads.create_index([("status", 1), ("created_at", -1)]))
+    run(leads.insert_many([{"id": "a", "phone": "1", "status": "new"}, {"id": "b", "phone": "2", "status": "new"}]))
+    with pytest.raises(DuplicateKeyError):
+        run(leads.insert_one({"id": "c", "phone": "1"}))
+    with pytest.raises(DuplicateKeyError):
+        run(leads.update_one({"id": "b"}, {"$set": {"phone": "1"}}))
+
+    run(leads.update_one({"id": "a"}, {"$set": {"status": "booked", "phone": "3"}}))
+    assert run(ids(leads, {"status": "new"})) == ["b"]
+    assert run(ids(leads, {"phone": {"$in": ["1", "3"]}})) == ["a"]
+    run(leads.delete_one({"id": "a"}))
+    run(leads.insert_one({"id": "d", "phone": "3"}))  # the deleted document's key is free again
+    assert run(ids(leads, {"phone": "3"})) == ["d"]
+
+
+def test_bulk_write(leads):
+    result = run(leads.bulk_write([
+        InsertOne({"id": "a", "n": 1}),
+        UpdateOne({"id": "a"}, {"$inc": {"n": 1}}),
+        UpdateOne({"id": "b"}, {"$set": {"n": 5}}, upsert=True),
+        DeleteOne({"id": "missing"}),
+    ]))
+    assert (result.inserted_count, result.modified_count, result.upserted_count, result.deleted_count) == (1, 1, 1, 0)
+    assert run(leads.find({}, {"_id": 0}).sort("id", 1).to_list(None)) == [{"id": "a", "n": 2}, {"id": "b", "n": 5}]
+
+
+def test_aggregate_and_distinct(seeded):
+    groups = run(seeded.aggregate([
+        {"$match": {"status": {"$ne": "booked"}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None))
+    assert groups == [{"_id": "completed", "count": 1}, {"_id": "new", "count": 2}]
+    assert sorted(run(seeded.distinct("tags"))) == ["ev", "urgent"]
+
+
+def test_rename_and_drop():
+    db = MemoryDatabase("tests")
+    run(db.scratch.insert_one({"_id": 1}))
+    run(db.target.insert_one({"_id": 2}))
+    run(db.scratch.rename("target", dropTarget=True))
+    assert run(db.target.find({}).to_list(None)) == [{"_id": 1}]
+    assert run(db.list_collection_names()) == ["target"]
+    run(db.target.drop())
+    assert run(db.list_collection_names()) == []
+
+
+def test_compound_unique_index(leads):
+    run(leads.create_index([("session_id", 1), ("seq", 1)], unique=True))
+    run(leads.insert_many([{"session_id": "s1", "seq": 0}, {"session_id": "s1", "seq": 1}, {"session_id": "s2", "seq": 0}]))
+    with pytest.raises(DuplicateKeyError):
+        run(leads.insert_one({"session_id": "s1", "seq": 1}))
+    with pytest.raises(DuplicateKeyError):
+        run(leads.update_one({"session_id": "s2"}, {"$set": {"session_id": "s1"}}))
+
+    run(leads.delete_one({"session_id": "s1", "seq": 1}))
+    run(leads.update_one({"session_id": "s2"}, {"$set": {"session_id": "s1", "seq": 1}}))  # the freed key
+    run(leads.insert_one({"session_id": "s2", "seq": 0}))
+    assert run(leads.count_documents({})) == 3
@@ -0,0 +1,140 @@
+"""ScopedCollection: every operation sees only the active tenant's documents"""
+import asyncio
+
+import pytest
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from storage import MemoryDatabase
+from tenants import TENANT_FIELD, ScopedDatabase
+
+
+class Scope:
+    """Stands in for the current_tenant context variable"""
+
+    def __init__(self):
+        self.tenant = None
+
+    def __call__(self):
+        return self.tenant
+
+
+@pytest.fixture
+def scope():
+    return Scope()
+
+
+@pytest.fixture
+def raw():
+    return MemoryDatabase("tests")
+
+
+@pytest.fixture
+def db(raw, scope):
+    return ScopedDatabase(raw, scope)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def as_tenant(scope, tenant, coro_fn):
+    scope.tenant = tenant
+    try:
+        return run(coro_fn())
+    finally:
+        scope.tenant = None
+
+
+@pytest.fixture
+def seeded(db, scope):
+    for tenant in (None, "a", "b"):
+        as_tenant(scope, tenant, lambda: db.leads.insert_many([
+            {"id": f"{tenant}-1", "status": "new", "suburb": f"{tenant}-suburb"},
+            {"id": f"{tenant}-2", "status": "completed", "suburb": f"{tenant}-suburb"},
+        ]))
+    return db
+
+
+async def lead_ids(db, query=None):
+    return sorted(doc["id"] for doc in await db.leads.find(query or {}, {"_id": 0}).to_list(None))
+
+
+@pytest.mark.parametrize("tenant", [None, "a", "b"])
+def test_reads_see_only_own_documents(seeded, scope, tenant):
+    async def reads():
+        return (
+            await lead_ids(seeded),
+            await seeded.leads.count_documents({"status": "new"}),
+            await seeded.leads.estimated_document_count(),
+            await seeded.leads.distinct("suburb"),
+            await seeded.leads.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]).to_list(None),
+        )
+    ids, new, total, suburbs, groups = as_tenant(scope, tenant, reads)
+    assert ids == [f"{tenant}-1", f"{tenant}-2"]
+    assert (new, total, suburbs) == (1, 2, [f"{tenant}-suburb"])
+    assert sorted(g["n"] for g in groups) == [1, 1]
+
+
+def test_default_tenant_documents_have_no_tenant_field(seeded, raw):
+    stored = run(raw.leads.find({"id": "None-1"}).to_list(None))
+    assert len(stored) == 1 and TENANT_FIELD not in stored[0]
+    assert run(raw.leads.find_one({"id": "a-1"}))[TENANT_FIELD] == "a"
+
+
+def test_filter_cannot_name_another_tenant(seeded, scope):
+    assert as_tenant(scope, "a", lambda: lead_ids(seeded, {TENANT_FIELD: "b"})) == ["a-1", "a-2"]
+    assert as_tenant(scope, "a", lambda: lead_ids(seeded, {"id": "b-1"})) == []
+
+
+def test_projection_hides_tenant_field(seeded, scope):
+    doc = as_tenant(scope, "a", lambda: seeded.leads.find_one({"id": "a-1"}))
+    assert TENANT_FIELD not in doc
+    doc = as_tenant(scope, "a", lambda: seeded.leads.find_one({"id": "a-1"}, {"_id": 0, "id": 1}))
+    assert doc == {"id": "a-1"}
+
+
+def test_writes_stay_inside_the_tenant(seeded, scope, raw):
+    async def writes():
+        await seeded.leads.update_many({}, {"$set": {"status": "booked"}})
+        await seeded.leads.delete_many({"status": "booked", "id": "a-2"})
+        await seeded.leads.find_one_and_update({}, {"$set": {"touched": True}})
+        assert await seeded.leads.find_one_and_delete({"id": "b-1"}) is None
+        await seeded.leads.bulk_write([
+            InsertOne({"id": "a-3", "status": "new"}),
+            UpdateOne({"id": "b-2"}, {"$set": {"status": "hijacked"}}),
+            DeleteOne({"id": "None-1"}),
+        ])
+    as_tenant(scope, "a", writes)
+
+    by_id = {doc["id"]: doc for doc in run(raw.leads.find({}, {"_id": 0}).to_list(None))}
+    assert sorted(by_id) == ["None-1", "None-2", "a-1", "a-3", "b-1", "b-2"]
+    assert by_id["a-1"]["status"] == "booked" and by_id["a-1"]["touched"]
+    assert by_id["a-3"][TENANT_FIELD] == "a"
+    assert {by_id[i]["status"] for i in ("None-1", "None-2", "b-1", "b-2")} == {"new", "completed"}
+    assert not any(by_id[i].get("touched") for i in ("None-1", "None-2", "b-1", "b-2"))
+
+
+def test_named_documents_are_per_tenant(db, scope, raw):
+    """String _ids (counters, rollups) are prefixed, so tenants don't share a document"""
+    async def bump():
+        await db.collection_versions.update_one({"_id": "leads"}, {"$inc": {"version": 1}}, upsert=True)
+        return await db.collection_versions.find_one({"_id": "leads"})
+    assert as_tenant(scope, "a", bump)["version"] == 1
+    assert as_tenant(scope, "a", bump)["version"] == 2
+    assert as_tenant(scope, "b", bump)["version"] == 1
+    assert run(bump())["version"] == 1
+    assert sorted(doc["_id"] for doc in run(raw.collection_versions.find({}).to_list(None))) == ["a:leads", "b:leads", "leads"]
+
+
+def test_unique_indexes_are_per_tenant(db, scope):
+    run(db.leads.create_index("phone_e164", unique=True))
+    as_tenant(scope, "a", lambda: db.leads.insert_one({"id": "1", "phone_e164": "+61400000001"}))
+    as_tenant(scope, "b", lambda: db.leads.insert_one({"id": "2", "phone_e164": "+61400000001"}))
+    with pytest.raises(DuplicateKeyError):
+        as_tenant(scope, "a", lambda: db.leads.insert_one({"id": "3", "phone_e164": "+61400000001"}))
+
+
+def test_unsupported_bulk_operation_is_refused(db):
+    with pytest.raises(TypeError):
+        run(db.leads.bulk_write([object()]))
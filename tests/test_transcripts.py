@@ -0,0 +1,61 @@
+"""Chat transcripts: messages from turns that change nothing ride on the next real write"""
+import pytest
+
+MESSAGES = ["hi", "ev charger", "lights", "switchboard", "no", "no", "smoke alarm"]
+
+
+@pytest.fixture
+def writes(server, client, monkeypatch):
+    """Round trips to the conversations collection, by method"""
+    counts = {"update_one": 0, "find_one_and_update": 0}
+    conversations = server.db.conversations
+    for method in counts:
+        original = getattr(conversations, method)
+
+        def counted(*args, _method=method, _original=original, **kwargs):
+            counts[_method] += 1
+            return _original(*args, **kwargs)
+        monkeypatch.setattr(conversations, method, counted)
+    monkeypatch.setitem(server.conversation_write_stats, "written", 0)
+    monkeypatch.setitem(server.conversation_write_stats, "skipped", 0)
+    return counts
+
+
+def transcript(client, session_id):
+    return [m["message"] for m in client.get(f"/api/conversations/{session_id}/transcript").json()["messages"]]
+
+
+def test_unchanged_turns_add_no_writes(server, client, chat, writes):
+    for message in MESSAGES:
+        chat("s1", message)
+
+    stats = server.conversation_write_stats
+    assert stats["written"] == sum(writes.values())
+    assert stats["written"] + stats["skipped"] == len(MESSAGES)
+    assert stats["written"] < len(MESSAGES)
+    assert transcript(client, "s1") == MESSAGES
+
+
+def test_held_messages_go_out_with_the_next_state_write(server, client, chat, writes):
+    chat("s1", "hi", "hi")
+    assert sum(writes.values()) == 0
+    chat("s1", "I want to book a job")  # moves to collect_name
+    assert sum(writes.values()) == 1
+    assert server.transcript_store.pending == {}
+    stored = client.portal.call(server.db.conversations.find_one, {"session_id": "s1"})
+    assert [m["message"] for m in stored["transcript"]] == ["hi", "hi", "I want to book a job"]
+
+
+def test_held_messages_flush_when_due(server, client, chat, writes, monkeypatch):
+    monkeypatch.setattr(server.transcript_store, "buffer_messages", 2)
+    chat("s1", "hi", "hi")
+    assert sum(writes.values()) == 0
+    chat("s1", "hi")  # a third would overfill the buffer
+    assert sum(writes.values()) == 1
+
+    chat("s2", "hi")
+    assert client.portal.call(server.transcript_store.flush, 60) == 0  # not old enough yet
+    assert client.portal.call(server.transcript_store.flush) == 1
+    stored = client.portal.call(server.db.conversations.find_one, {"session_id": "s2"})
+    assert [m["message"] for m in stored["transcript"]] == ["hi"]
+    assert transcript(client, "s1") == ["hi", "hi", "hi"]